@@ -0,0 +1,284 @@
+import os
+import shutil
+import time
+from collections import Counter
+from pathlib import Path
+
+from sqlalchemy import delete, exists, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+import database
+import jobs
+from models import Photo, PhotoBlob, PhotoVariant, User
+from rendercache import RENDER_CACHE_DIR
+from storage import UPLOAD_DIR, variant_dir_for
+
+COLLECT_JOB = "uploads.collect"
+
+def stored_path(path) -> str:
+    # Rows keep paths as "/uploads/ab/cd/<sha256>.jpg"
+    return f"/{Path(path).as_posix()}"
+
+def upload_file(path: str):
+    """The file a stored path names, None when it lies outside the uploads directory."""
+    target = Path(path.lstrip("/")).resolve()
+    return target if UPLOAD_DIR.resolve() in target.parents else None
+
+async def referenced_paths(db: AsyncSession, paths) -> set:
+    """Those of paths a photo, a variant or a user still points at."""
+    if not paths:
+        return set()
+    return set(await db.scalars(union_all(
+        select(Photo.photo_path).where(Photo.photo_path.in_(paths)),
+        select(PhotoVariant.variant_path).where(PhotoVariant.variant_path.in_(paths)),
+        select(User.photo_path).where(User.photo_path.in_(paths)),
+    )))
+
+async def drop_blobs(db: AsyncSession, hashes) -> list:
+    """Delete the rows of those blobs no photo references, returns their (sha256, blob_path)."""
+    if not hashes:
+        return []
+    unreferenced = (PhotoBlob.ref_count <= 0) & ~exists().where(Photo.blob_hash == PhotoBlob.sha256)
+    rows = (await db.execute(
+        select(PhotoBlob.sha256, PhotoBlob.blob_path).where(PhotoBlob.sha256.in_(hashes), unreferenced)
+    )).all()
+    if not rows:
+        return []
+    await db.execute(
+        delete(PhotoBlob)
+        .where(PhotoBlob.sha256.in_([row.sha256 for row in rows]), unreferenced)
+        .execution_options(synchronize_session=False)
+    )
+    # An upload of the same content may have taken a reference in between
+    kept = set(await db.scalars(select(PhotoBlob.sha256).where(PhotoBlob.sha256.in_([row.sha256 for row in rows]))))
+    return [row for row in rows if row.sha256 not in kept]
+
+def prune_empty(directory: Path):
+    # Shard directories left empty, up to the uploads directory itself
+    root = UPLOAD_DIR.resolve()
+    directory = directory.resolve()
+    while root in directory.parents:
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+        directory = directory.parent
+
+def remove_files(paths, directories=()) -> tuple:
+    """Delete stored paths and whole directories under uploads, returns (files, bytes) removed."""
+    files = size = 0
+    for path in paths:
+        target = upload_file(path)
+        if target is None:
+            continue
+        try:
+            file_size = target.stat().st_size
+            target.unlink()
+        except FileNotFoundError:
+            continue
+        files += 1
+        size += file_size
+        prune_empty(target.parent)
+    for directory in directories:
+        if not directory.is_dir():
+            continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    files += 1
+                    size += entry.stat().st_size
+        shutil.rmtree(directory, ignore_errors=True)
+        prune_empty(directory.parent)
+    return files, size
+
+async def schedule_removal(db: AsyncSession, paths=(), blobs=()):
+    """Queue the removal of files with db's transaction.
+
+    The job runs once that commits and only removes what nothing references
+    by then, so a file taken back into use in between is kept.
+    """
+    if paths or blobs:
+        await jobs.enqueue(db, COLLECT_JOB, {"paths": sorted(set(paths)), "blobs": sorted(set(blobs))})
+
+@jobs.handler(COLLECT_JOB)
+async def collect_files(db: AsyncSession, payload: dict, progress) -> dict:
+    """Remove files of deleted photos and replaced profile photos.
+
+    Blobs without references lose their row, their original and their
+    variants. Removing a file that is already gone is not an error, so the
+    job can run again.
+    """
+    blobs = await drop_blobs(db, payload.get("blobs", []))
+    paths = sorted(set(payload.get("paths", [])) | {blob_path for _, blob_path in blobs})
+    referenced = await referenced_paths(db, paths)
+    files, size = await run_in_threadpool(
+        remove_files, [path for path in paths if path not in referenced], [variant_dir_for(sha256) for sha256, _ in blobs]
+    )
+    return {"blobs": len(blobs), "files": files, "bytes": size}
+
+def walk_files(root: Path, skip=()):
+    """Files under root as os.DirEntry, one directory listing open at a time."""
+    skip = {os.path.realpath(path) for path in skip}
+    pending = [str(root)]
+    while pending:
+        directory = pending.pop()
+        if os.path.realpath(directory) in skip:
+            continue
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            # Pruned while walking
+            continue
+
+def chunks(items, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def missing_files(paths) -> list:
+    return [path for path in paths if not os.path.isfile(path.lstrip("/"))]
+
+def human_bytes(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+async def unreferenced_blobs(db: AsyncSession, totals: Counter, purge: bool, batch_size: int):
+    last = ""
+    while True:
+        rows = (await db.execute(
+            select(PhotoBlob.sha256, PhotoBlob.blob_path, PhotoBlob.byte_size)
+            .where(PhotoBlob.ref_count <= 0, PhotoBlob.sha256 > last)
+            .order_by(PhotoBlob.sha256)
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            return
+        last = rows[-1].sha256
+        for row in rows:
+            print(f"unreferenced blob: {row.sha256} -> {row.blob_path}")
+            totals["unreferenced blobs"] += 1
+            totals["unreferenced blob bytes"] += row.byte_size
+        if purge:
+            await collect_files(db, {"blobs": [row.sha256 for row in rows]}, None)
+        await db.commit()
+
+async def orphaned_files(db: AsyncSession, totals: Counter, purge: bool, min_age: int, batch_size: int):
+    cutoff = time.time() - min_age
+    for batch in chunks(walk_files(UPLOAD_DIR, skip=[RENDER_CACHE_DIR]), batch_size):
+        found = {stored_path(entry.path): entry.stat() for entry in batch}
+        referenced = await referenced_paths(db, list(found))
+        await db.commit()
+        orphans = []
+        for path, stat in found.items():
+            totals["files"] += 1
+            totals["file bytes"] += stat.st_size
+            if path in referenced:
+                continue
+            if stat.st_mtime > cutoff:
+                # May belong to an upload whose row is not committed yet
+                totals["recent unreferenced files"] += 1
+                continue
+            print(f"orphan: {path} ({human_bytes(stat.st_size)})")
+            totals["orphaned files"] += 1
+            totals["orphaned bytes"] += stat.st_size
+            orphans.append(path)
+        if purge and orphans:
+            # Checked once more, a row may point at one of them by now
+            referenced = await referenced_paths(db, orphans)
+            await db.commit()
+            await run_in_threadpool(remove_files, [path for path in orphans if path not in referenced])
+
+async def dangling_rows(db: AsyncSession, totals: Counter, purge: bool, batch_size: int):
+    sources = (
+        ("photo", Photo.id_photo, Photo.photo_path),
+        ("variant", PhotoVariant.id_variant, PhotoVariant.variant_path),
+        ("user", User.id_user, User.photo_path),
+    )
+    for name, key, path in sources:
+        last = 0
+        while True:
+            rows = (await db.execute(
+                select(key, path).where(path.is_not(None), key > last).order_by(key).limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            last = rows[-1][0]
+            missing = set(await run_in_threadpool(missing_files, [row[1] for row in rows]))
+            dangling = [ident for ident, row_path in rows if row_path in missing]
+            for ident, row_path in rows:
+                if row_path in missing:
+                    print(f"dangling: {name} {ident} -> {row_path}")
+            totals[f"dangling {name} rows"] += len(dangling)
+            if name == "variant" and purge and dangling:
+                await rerender_variants(db, dangling)
+            await db.commit()
+
+    # Photos whose path is not the one of the blob they count as
+    mismatched = await db.scalar(
+        select(Photo.id_photo).join(PhotoBlob, PhotoBlob.sha256 == Photo.blob_hash)
+        .where(Photo.photo_path != PhotoBlob.blob_path).limit(1)
+    )
+    if mismatched is not None:
+        print("photos point at a different file than their blob, run migrate-storage")
+    legacy = await db.scalar(select(Photo.id_photo).where(Photo.blob_hash.is_(None)).limit(1))
+    if legacy is not None:
+        print("photos outside the content-addressed tree, run migrate-storage")
+    await db.commit()
+
+async def rerender_variants(db: AsyncSession, variant_ids):
+    """Drop the variants of content with a missing file and queue them for rendering again.
+
+    Every photo sharing the content loses its rows, otherwise processing
+    would copy the dangling ones back. Photos outside the content-addressed
+    tree are left as they are, they can only be rendered after migrate-storage.
+    """
+    hashes = set(await db.scalars(
+        select(Photo.blob_hash)
+        .join(PhotoVariant, PhotoVariant.id_photo == Photo.id_photo)
+        .where(PhotoVariant.id_variant.in_(variant_ids), Photo.blob_hash.is_not(None))
+        .distinct()
+    ))
+    if not hashes:
+        return
+    photo_ids = set(await db.scalars(select(Photo.id_photo).where(Photo.blob_hash.in_(hashes))))
+    await db.execute(delete(PhotoVariant).where(PhotoVariant.id_photo.in_(photo_ids)))
+    await jobs.enqueue(db, "photos.process", {"photo_ids": sorted(photo_ids)})
+
+async def reconcile(purge: bool, min_age: int, batch_size: int):
+    """Compare the uploads directory with the paths stored in the database.
+
+    Both sides are streamed batch_size at a time, so memory stays flat
+    however many files there are. Reports unreferenced blobs, files no row
+    points at (orphans) and rows whose file is missing (dangling). With
+    purge, unreferenced blobs and orphans older than min_age seconds are
+    removed and missing variants are queued for rendering again. Photos
+    and profile pictures with a missing file are only reported.
+    """
+    totals = Counter()
+    async with database.session_scope() as db:
+        await unreferenced_blobs(db, totals, purge, batch_size)
+        await orphaned_files(db, totals, purge, min_age, batch_size)
+        await dangling_rows(db, totals, purge, batch_size)
+
+    print()
+    for label in ("files", "orphaned files", "recent unreferenced files", "unreferenced blobs",
+                  "dangling photo rows", "dangling variant rows", "dangling user rows"):
+        print(f"{label}: {totals[label]}")
+    print(f"bytes on disk: {human_bytes(totals['file bytes'])}, orphaned: {human_bytes(totals['orphaned bytes'])}, "
+          f"in unreferenced blobs: {human_bytes(totals['unreferenced blob bytes'])}")
+    if purge:
+        print("orphans and unreferenced blobs removed, missing variants queued for rendering")
@@ -0,0 +1,79 @@
+from sqlalchemy import inspect, select, text
+
+from models import CategoriesAndPhotos, FeaturedPhoto, GalleryAndPhotos, Photo, PublicPage, User
+
+# Statements the API runs on its hot paths, their plans should not scan
+HOT_QUERIES = {
+    "login by email": select(User.id_user).where(User.email == "admin@example.com"),
+    "photo listing page": select(Photo.id_photo).order_by(Photo.date.asc().nulls_last(), Photo.id_photo.asc()).limit(50),
+    "featured photos by type": select(FeaturedPhoto.id_photo).where(FeaturedPhoto.featured_type == "home").order_by(FeaturedPhoto.position),
+    "categories of a photo": select(CategoriesAndPhotos.id_category).where(CategoriesAndPhotos.id_photo == 1),
+    "galleries of a photo": select(GalleryAndPhotos.id_gallery).where(GalleryAndPhotos.id_photo == 1),
+    "public page": select(PublicPage.document).where(PublicPage.page_key == "gallery:1"),
+}
+
+def print_rows(title: str, headers, rows):
+    print(f"\n== {title}")
+    rows = [[str(value) for value in row] for row in rows]
+    if not rows:
+        print("(none)")
+        return
+    widths = [max(len(header), *(len(row[i]) for row in rows)) for i, header in enumerate(headers)]
+    print("  ".join(header.ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+def explain(connection, statement) -> tuple:
+    """Query plan lines and whether the plan reads a whole table."""
+    sql = str(statement.compile(connection, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "postgresql":
+        lines = [row[0] for row in connection.execute(text(f"EXPLAIN {sql}"))]
+        return lines, any("Seq Scan" in line for line in lines)
+    if connection.dialect.name == "sqlite":
+        lines = [row[3] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        return lines, any(line.startswith("SCAN") and "INDEX" not in line for line in lines)
+    return [], False
+
+def report_indexes(connection):
+    inspector = inspect(connection)
+    rows = []
+    for table in sorted(inspector.get_table_names()):
+        for index in inspector.get_indexes(table):
+            rows.append((table, index["name"], ", ".join(filter(None, index["column_names"])), "unique" if index["unique"] else ""))
+    print_rows("indexes", ("table", "index", "columns", ""), rows)
+
+def report_postgres(connection):
+    print_rows("index usage since the statistics were reset, least used first", ("table", "index", "scans", "size"), connection.execute(text(
+        """SELECT relname, indexrelname, idx_scan, pg_size_pretty(pg_relation_size(indexrelid))
+        FROM pg_stat_user_indexes ORDER BY idx_scan, pg_relation_size(indexrelid) DESC"""
+    )))
+    print_rows("sequential scans by table", ("table", "seq scans", "rows read", "index scans", "live rows"), connection.execute(text(
+        """SELECT relname, seq_scan, seq_tup_read, coalesce(idx_scan, 0), n_live_tup
+        FROM pg_stat_user_tables ORDER BY seq_tup_read DESC"""
+    )))
+    if connection.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")).first():
+        print_rows("slowest statements by mean time", ("calls", "mean ms", "total ms", "query"), connection.execute(text(
+            """SELECT calls, round(mean_exec_time::numeric, 2), round(total_exec_time::numeric, 2),
+                left(regexp_replace(query, '\\s+', ' ', 'g'), 120)
+            FROM pg_stat_statements WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            ORDER BY mean_exec_time DESC LIMIT 15"""
+        )))
+    else:
+        print("\n(pg_stat_statements is not installed, no per-statement timings)")
+
+def report(engine):
+    with engine.connect() as connection:
+        print(f"database: {engine.url.render_as_string(hide_password=True)}")
+        report_indexes(connection)
+        if connection.dialect.name == "postgresql":
+            report_postgres(connection)
+
+        candidates = []
+        for name, statement in HOT_QUERIES.items():
+            lines, scans = explain(connection, statement)
+            print(f"\n== plan: {name}{'  <-- full scan' if scans else ''}")
+            for line in lines:
+                print(f"  {line}")
+            if scans:
+                candidates.append(name)
+        print(f"\nslow-query candidates: {', '.join(candidates) if candidates else 'none'}")
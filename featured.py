@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+from decouple import config
+from sqlalchemy import select
+
+import database
+from models import PublicPage
+from pages import page_key
+from periodic import PeriodicRefresh
+from versions import read_versions
+
+# Seconds between checks of the table versions, other workers pick up a
+# change to the featured lists within this delay
+FEATURED_REFRESH_SECONDS = config("FEATURED_REFRESH_SECONDS", default=5, cast=int)
+
+# A featured page changes with its rows and with the photos it lists
+FEATURED_TABLES = ("featured_photos", "photos", "photo_variants")
+
+class FeaturedSnapshot(PeriodicRefresh):
+    """Featured lists of every type held in memory as encoded JSON.
+
+    The lists are copied from the prebuilt featured pages, so a rebuild is
+    a range read on public_pages and never joins. It only happens when the
+    versions of FEATURED_TABLES moved, requests just read the dict.
+    """
+
+    def __init__(self, interval: int):
+        super().__init__(interval)
+        self.documents = None
+        self._versions = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, force: bool = False):
+        async with self._lock:
+            async with database.session_scope() as db:
+                versions = sorted((table_name, version) for table_name, version, _ in await read_versions(db, FEATURED_TABLES))
+                if force or versions != self._versions or self.documents is None:
+                    # "featured;" is the first key after every "featured:..." one
+                    rows = await db.execute(
+                        select(PublicPage.page_key, PublicPage.document)
+                        .where(PublicPage.page_key >= page_key("featured", ""), PublicPage.page_key < "featured;")
+                    )
+                    self.documents = {key.split(":", 1)[1]: document.encode() for key, document in rows}
+                    self._versions = versions
+
+    async def get(self, featured_type: str) -> bytes:
+        if self.documents is None:
+            await self.refresh()
+        document = self.documents.get(featured_type)
+        if document is None:
+            return json.dumps({"featured_type": featured_type, "photos": []}, separators=(",", ":")).encode()
+        return document
+
+featured_snapshot = FeaturedSnapshot(FEATURED_REFRESH_SECONDS)
@@ -0,0 +1,214 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+from decouple import config, Csv
+from PIL import ExifTags, Image, ImageOps
+
+# Derivative sizes and formats generated for every uploaded photo
+VARIANT_WIDTHS = config("PHOTO_VARIANT_WIDTHS", default="320,640,1280,2048", cast=Csv(int))
+VARIANT_FORMATS = config("PHOTO_VARIANT_FORMATS", default="jpeg,webp,avif", cast=Csv())
+VARIANT_QUALITY = config("PHOTO_VARIANT_QUALITY", default=80, cast=int)
+
+# Longest side of the inline placeholder, a few hundred bytes as base64
+LQIP_SIZE = config("PHOTO_LQIP_SIZE", default=16, cast=int)
+
+# Size of the process pool used for Pillow work, 0 means one per core
+IMAGE_WORKERS = config("IMAGE_WORKERS", default=0, cast=int)
+
+# Hex digits of the output digest in variant file names
+VARIANT_DIGEST_LENGTH = 12
+
+FORMAT_EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "avif": "avif", "png": "png"}
+
+_pool = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS or os.cpu_count())
+    return _pool
+
+async def run_in_pool(func, *args, **kwargs):
+    # Image decoding and encoding is CPU bound, keep it off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), partial(func, *args, **kwargs))
+
+def supported_formats(formats=VARIANT_FORMATS) -> list:
+    # WebP and AVIF are only available when Pillow was built with them
+    Image.init()
+    return [fmt.lower() for fmt in formats if fmt.upper() in Image.SAVE]
+
+# The only metadata public copies keep, EXIF, XMP and comments can carry
+# GPS positions and camera serials
+KEPT_INFO = ("icc_profile", "transparency")
+
+def prepare_for_format(image: Image.Image, fmt: str) -> Image.Image:
+    if fmt == "jpeg":
+        image = image.convert("RGB") if image.mode != "RGB" else image
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    image.info = {key: image.info[key] for key in KEPT_INFO if key in image.info}
+    return image
+
+def open_upright(image: Image.Image) -> Image.Image:
+    # Derivatives are stored the way the photo is meant to be seen, clients
+    # never have to apply the EXIF orientation themselves
+    ImageOps.exif_transpose(image, in_place=True)
+    return image
+
+def generate_variants(source: str, dest_dir: str, widths=None, formats=None, quality: int = VARIANT_QUALITY) -> list:
+    """Write resized copies of source into dest_dir and describe each of them."""
+    widths = widths or VARIANT_WIDTHS
+    formats = supported_formats(formats or VARIANT_FORMATS)
+    dest = Path(dest_dir)
+    dest.mkdir(parents=True, exist_ok=True)
+
+    variants = []
+    with Image.open(source) as opened:
+        image = open_upright(opened)
+        # Never upscale, widths above the original collapse into the original width
+        for width in sorted({min(w, image.width) for w in widths}):
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for fmt in formats:
+                buffer = io.BytesIO()
+                prepare_for_format(resized, fmt).save(buffer, fmt.upper(), quality=quality)
+                encoded = buffer.getvalue()
+                # Named after their bytes, so they can be cached as immutable:
+                # rendering again with other settings or orientation gives a
+                # new name instead of rewriting the file
+                digest = hashlib.sha256(encoded).hexdigest()[:VARIANT_DIGEST_LENGTH]
+                path = dest / f"{width}.{digest}.{FORMAT_EXTENSIONS[fmt]}"
+                if not path.exists():
+                    # Jobs for the same content may render at the same time
+                    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                    tmp_path.write_bytes(encoded)
+                    os.replace(tmp_path, path)
+                variants.append({
+                    "variant_path": f"/{path.as_posix()}",
+                    "width": width,
+                    "height": height,
+                    "format": fmt,
+                    "byte_size": len(encoded),
+                })
+    return variants
+
+def describe(source: str) -> dict:
+    """Dimensions, dominant color and a tiny base64 placeholder of source."""
+    with Image.open(source) as image:
+        width, height = image.size
+        if image.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            # Turned by 90 degrees, the upright photo has its sides swapped
+            width, height = height, width
+        # JPEGs decode straight at a fraction of their size, nothing below
+        # needs more than a small thumbnail
+        image.draft("RGB", (64, 64))
+        small = prepare_for_format(open_upright(image), "jpeg")
+        small.thumbnail((64, 64), Image.Resampling.BOX)
+
+    # Most common color of a 5 color palette, an average would turn to mud
+    palette = small.quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+
+    preview = small.copy()
+    preview.thumbnail((LQIP_SIZE, LQIP_SIZE), Image.Resampling.LANCZOS)
+    fmt = "webp" if supported_formats(["webp"]) else "jpeg"
+    buffer = io.BytesIO()
+    preview.save(buffer, fmt.upper(), quality=50)
+    return {
+        "width": width,
+        "height": height,
+        "aspect_ratio": round(width / height, 4),
+        "dominant_color": f"#{red:02x}{green:02x}{blue:02x}",
+        "lqip": f"data:image/{fmt};base64,{base64.b64encode(buffer.getvalue()).decode()}",
+    }
+
+def exif_text(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    value = str(value).strip("\x00 ") if value is not None else ""
+    return value[:100] or None
+
+def exif_number(value):
+    # Rationals come back as IFDRational, broken ones divide by zero
+    try:
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return number if number == number else None
+
+def gps_degrees(values, ref):
+    try:
+        degrees, minutes, seconds = (float(value) for value in values)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    sign = -1 if exif_text(ref) in ("S", "W") else 1
+    return round(sign * (degrees + minutes / 60 + seconds / 3600), 7)
+
+def read_exif(source: str) -> dict:
+    """Capture date, camera, lens, exposure and GPS position of source."""
+    with Image.open(source) as image:
+        exif = image.getexif()
+    details = exif.get_ifd(ExifTags.IFD.Exif)
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+
+    taken_at = None
+    for value in (details.get(ExifTags.Base.DateTimeOriginal), exif.get(ExifTags.Base.DateTime)):
+        try:
+            taken_at = datetime.strptime(exif_text(value) or "", "%Y:%m:%d %H:%M:%S")
+            break
+        except ValueError:
+            continue
+
+    iso = details.get(ExifTags.Base.ISOSpeedRatings)
+    if isinstance(iso, tuple):
+        iso = iso[0] if iso else None
+    altitude = exif_number(gps.get(ExifTags.GPS.GPSAltitude))
+    if altitude is not None and gps.get(ExifTags.GPS.GPSAltitudeRef) in (1, b"\x01"):
+        altitude = -altitude
+    return {
+        "taken_at": taken_at,
+        "camera_make": exif_text(exif.get(ExifTags.Base.Make)),
+        "camera_model": exif_text(exif.get(ExifTags.Base.Model)),
+        "lens": exif_text(details.get(ExifTags.Base.LensModel)),
+        "exposure_time": exif_number(details.get(ExifTags.Base.ExposureTime)),
+        "f_number": exif_number(details.get(ExifTags.Base.FNumber)),
+        "iso": int(iso) if isinstance(iso, int) else None,
+        "focal_length": exif_number(details.get(ExifTags.Base.FocalLength)),
+        "latitude": gps_degrees(gps.get(ExifTags.GPS.GPSLatitude), gps.get(ExifTags.GPS.GPSLatitudeRef)),
+        "longitude": gps_degrees(gps.get(ExifTags.GPS.GPSLongitude), gps.get(ExifTags.GPS.GPSLongitudeRef)),
+        "altitude": altitude,
+        "orientation": exif.get(ExifTags.Base.Orientation),
+    }
+
+def render(source: str, dest: str, width: int = None, height: int = None, fit: str = "cover", fmt: str = "jpeg", quality: int = VARIANT_QUALITY) -> str:
+    """Resize source to the requested box and write it atomically to dest."""
+    with Image.open(source) as opened:
+        image = open_upright(opened)
+        # A missing side keeps the aspect ratio, nothing is ever upscaled
+        scale = min(1.0, (width or image.width) / image.width, (height or image.height) / image.height)
+        box = (
+            min(width, image.width) if width else max(1, round(image.width * scale)),
+            min(height, image.height) if height else max(1, round(image.height * scale)),
+        )
+        if fit == "cover" and width and height:
+            result = ImageOps.fit(image, box, Image.Resampling.LANCZOS)
+        elif fit == "fill" and width and height:
+            result = image.resize(box, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        else:
+            result = ImageOps.contain(image, box, Image.Resampling.LANCZOS)
+
+        dest_path = Path(dest)
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest_path.with_name(f".{dest_path.name}.{os.getpid()}.tmp")
+        prepare_for_format(result, fmt).save(tmp_path, fmt.upper(), quality=quality)
+        os.replace(tmp_path, dest_path)
+    return dest
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+
+from decouple import config
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import cleanup
+import imaging
+import jobs
+import pages
+from models import Photo, PhotoExif, PhotoVariant
+from storage import variant_dir_for
+
+logger = logging.getLogger(__name__)
+
+# Decimals of the coordinates a blank location is filled with, 2 is about a kilometre
+EXIF_LOCATION_DECIMALS = config("EXIF_LOCATION_DECIMALS", default=2, cast=int)
+
+# EXIF orientations that need more than displaying the pixels as stored
+TURNED = (2, 3, 4, 5, 6, 7, 8)
+
+async def known_variants(db: AsyncSession, hashes) -> dict:
+    """Variants already generated for content we have, keyed by blob hash."""
+    rows = (await db.execute(
+        select(Photo.blob_hash, PhotoVariant)
+        .join(PhotoVariant, PhotoVariant.id_photo == Photo.id_photo)
+        .where(Photo.blob_hash.in_(hashes))
+        .order_by(Photo.blob_hash, PhotoVariant.id_photo, PhotoVariant.width)
+    )).all()
+    variants, owners = {}, {}
+    for blob_hash, variant in rows:
+        # One photo's set is enough, they are identical for the same content
+        if owners.setdefault(blob_hash, variant.id_photo) != variant.id_photo:
+            continue
+        variants.setdefault(blob_hash, []).append({
+            "variant_path": variant.variant_path,
+            "width": variant.width,
+            "height": variant.height,
+            "format": variant.format,
+            "byte_size": variant.byte_size,
+        })
+    return variants
+
+async def render_variants(photo_path: str, blob_hash: str) -> list:
+    # Resized copies for srcset, generated in the image process pool
+    return await imaging.run_in_pool(
+        imaging.generate_variants, photo_path.lstrip("/"), str(variant_dir_for(blob_hash))
+    )
+
+# Filled from imaging.describe, identical content shares them
+PLACEHOLDER_COLUMNS = (Photo.width, Photo.height, Photo.aspect_ratio, Photo.dominant_color, Photo.lqip)
+
+async def known_placeholders(db: AsyncSession, hashes) -> dict:
+    """Dimensions and placeholders already computed for content we have."""
+    rows = await db.execute(
+        select(Photo.blob_hash, *PLACEHOLDER_COLUMNS)
+        .where(Photo.blob_hash.in_(hashes), Photo.width.is_not(None))
+    )
+    return {row.blob_hash: {column.key: getattr(row, column.key) for column in PLACEHOLDER_COLUMNS} for row in rows}
+
+async def describe_photo(photo_path: str) -> dict:
+    return await imaging.run_in_pool(imaging.describe, photo_path.lstrip("/"))
+
+def location_from(exif: dict):
+    if exif["latitude"] is None or exif["longitude"] is None:
+        return None
+    # Locations are public, rounded they tell the area but not the address
+    return f"{exif['latitude']:.{EXIF_LOCATION_DECIMALS}f}, {exif['longitude']:.{EXIF_LOCATION_DECIMALS}f}"
+
+async def read_files(func, paths) -> dict:
+    """Run func on each of paths in the image process pool, failures are logged and left out."""
+    results = await asyncio.gather(
+        *(imaging.run_in_pool(func, path.lstrip("/")) for path in paths),
+        return_exceptions=True,
+    )
+    found = {}
+    for path, result in zip(paths, results):
+        if isinstance(result, Exception):
+            logger.warning("%s of %s failed: %s", func.__name__, path, result)
+        else:
+            found[path] = result
+    return found
+
+async def ingest_photos(db: AsyncSession, photo_ids) -> list:
+    """Store the EXIF of photo_ids and fill in dates and locations left blank.
+
+    Each distinct file is read once. Running it again replaces the stored
+    rows but never overwrites a date or location that is already set.
+    Returns the ids of the photos whose file could be read, their pages are
+    left to the caller.
+    """
+    photos = (await db.scalars(select(Photo).where(Photo.id_photo.in_(photo_ids)))).all()
+    found = await read_files(imaging.read_exif, sorted({photo.photo_path for photo in photos}))
+    photos = [photo for photo in photos if photo.photo_path in found]
+    if not photos:
+        return []
+
+    ids = [photo.id_photo for photo in photos]
+    await db.execute(delete(PhotoExif).where(PhotoExif.id_photo.in_(ids)))
+    await db.execute(insert(PhotoExif), [{"id_photo": photo.id_photo, **found[photo.photo_path]} for photo in photos])
+    for photo in photos:
+        exif = found[photo.photo_path]
+        if photo.date is None and exif["taken_at"] is not None:
+            photo.date = exif["taken_at"].date()
+        if not photo.location and location_from(exif):
+            photo.location = location_from(exif)
+    await db.flush()
+    return ids
+
+async def rebake_photos(db: AsyncSession, photo_ids) -> int:
+    """Render again the variants and placeholders of turned photos.
+
+    For photos whose derivatives were made before orientation was applied.
+    Every photo sharing the content is updated. Returns the number of files
+    rendered.
+    """
+    rows = (await db.execute(
+        select(Photo.blob_hash, Photo.photo_path)
+        .join(PhotoExif, PhotoExif.id_photo == Photo.id_photo)
+        .where(Photo.id_photo.in_(photo_ids), Photo.blob_hash.is_not(None), PhotoExif.orientation.in_(TURNED))
+        .distinct()
+    )).all()
+    if not rows:
+        return 0
+
+    async def render(blob_hash: str, photo_path: str):
+        source = photo_path.lstrip("/")
+        variants = await imaging.run_in_pool(imaging.generate_variants, source, str(variant_dir_for(blob_hash)))
+        return variants, await imaging.run_in_pool(imaging.describe, source)
+
+    results = await asyncio.gather(*(render(blob_hash, photo_path) for blob_hash, photo_path in rows), return_exceptions=True)
+    rendered = 0
+    for (blob_hash, photo_path), result in zip(rows, results):
+        if isinstance(result, Exception):
+            logger.warning("rendering %s failed: %s", photo_path, result)
+            continue
+        variants, placeholder = result
+        photos = (await db.scalars(select(Photo).where(Photo.blob_hash == blob_hash))).all()
+        ids = [photo.id_photo for photo in photos]
+        # The new files carry new names, the ones they replace go once this commits
+        replaced = set(await db.scalars(select(PhotoVariant.variant_path).where(PhotoVariant.id_photo.in_(ids))))
+        await cleanup.schedule_removal(db, paths=replaced - {variant["variant_path"] for variant in variants})
+        await db.execute(delete(PhotoVariant).where(PhotoVariant.id_photo.in_(ids)))
+        await db.execute(insert(PhotoVariant), [{"id_photo": id_photo, **variant} for id_photo in ids for variant in variants])
+        for photo in photos:
+            for key, value in placeholder.items():
+                setattr(photo, key, value)
+        await pages.refresh_affected(db, photo_ids=ids)
+        rendered += 1
+    return rendered
+
+@jobs.handler("photos.process", invalidates=("photos",))
+async def process_photos(db: AsyncSession, payload: dict, progress) -> dict:
+    """Placeholders, variants and EXIF of freshly uploaded photos.
+
+    Content that already has them is copied from the photo holding it,
+    everything else is computed in the image process pool. Rows are
+    replaced, so running the job again changes nothing.
+    """
+    photos = (await db.execute(
+        select(Photo.id_photo, Photo.photo_path, Photo.blob_hash).where(Photo.id_photo.in_(payload["photo_ids"]))
+    )).all()
+    # Files outside the content-addressed tree have no variant directory,
+    # they are left until migrate-storage has moved them
+    skipped = sum(photo.blob_hash is None for photo in photos)
+    photos = [photo for photo in photos if photo.blob_hash is not None]
+    if not photos:
+        # Deleted before the job ran
+        return {"photos": 0, "skipped": skipped}
+    ids = [photo.id_photo for photo in photos]
+    sources = {photo.blob_hash: photo.photo_path for photo in photos}
+
+    variants = await known_variants(db, list(sources))
+    placeholders = await known_placeholders(db, list(sources))
+    await progress(10, "rendering variants")
+    missing = [blob_hash for blob_hash in sources if blob_hash not in variants]
+    variants.update(zip(missing, await asyncio.gather(*(render_variants(sources[blob_hash], blob_hash) for blob_hash in missing))))
+    await progress(70, "computing placeholders")
+    described = [blob_hash for blob_hash in sources if blob_hash not in placeholders]
+    placeholders.update(zip(described, await asyncio.gather(*(describe_photo(sources[blob_hash]) for blob_hash in described))))
+    await progress(80, "reading EXIF")
+
+    await db.execute(delete(PhotoVariant).where(PhotoVariant.id_photo.in_(ids)))
+    await db.execute(insert(PhotoVariant), [
+        {"id_photo": photo.id_photo, **variant} for photo in photos for variant in variants[photo.blob_hash]
+    ])
+    for blob_hash, placeholder in placeholders.items():
+        await db.execute(
+            update(Photo)
+            .where(Photo.id_photo.in_(ids), Photo.blob_hash == blob_hash)
+            .values(**placeholder)
+            .execution_options(synchronize_session=False)
+        )
+    exif = await ingest_photos(db, ids)
+    await pages.refresh_affected(db, photo_ids=ids)
+    return {"photos": len(ids), "rendered": len(missing), "exif": len(exif), "skipped": skipped}
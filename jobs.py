@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from decouple import config
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+from models import Job
+from responsecache import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds an idle worker slot waits before looking for due jobs again
+JOB_POLL_SECONDS = config("JOB_POLL_SECONDS", default=1.0, cast=float)
+# A running job whose worker has not reported for this long is taken over,
+# workers renew the lease of their running jobs three times per period
+JOB_LEASE_SECONDS = config("JOB_LEASE_SECONDS", default=300, cast=int)
+# Retry delays double from JOB_BACKOFF_SECONDS up to JOB_MAX_BACKOFF_SECONDS
+JOB_BACKOFF_SECONDS = config("JOB_BACKOFF_SECONDS", default=5, cast=int)
+JOB_MAX_BACKOFF_SECONDS = config("JOB_MAX_BACKOFF_SECONDS", default=600, cast=int)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=5, cast=int)
+# Worker slots inside the API process, set to 0 when `manage.py worker` runs separately
+JOB_APP_SLOTS = config("JOB_APP_SLOTS", default=1, cast=int)
+
+FINISHED = ("done", "failed")
+
+# kind -> (handler, response cache tags to drop once its writes are committed)
+HANDLERS = {}
+
+def handler(kind: str, invalidates=()):
+    """Register the decorated coroutine as the handler of kind.
+
+    It is called as handler(db, payload, progress) and returns the JSON
+    result. Its writes commit together with the job's completion, so a job
+    interrupted before that runs again from the start and handlers must be
+    idempotent. progress(percent, message) is written from its own session,
+    on SQLite call it before the handler's first write.
+    """
+    def register(func):
+        HANDLERS[kind] = (func, tuple(invalidates))
+        return func
+    return register
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+async def enqueue(db: AsyncSession, kind: str, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> Job:
+    """Add a job to db's transaction, workers see it once that commits."""
+    now = utcnow()
+    job = Job(
+        kind = kind,
+        payload = json.dumps(payload),
+        status = "queued",
+        attempts = 0,
+        max_attempts = max_attempts,
+        run_after = now,
+        progress = 0,
+        created_at = now,
+    )
+    db.add(job)
+    await db.flush()
+    return job
+
+def job_state(job: Job) -> dict:
+    return {
+        "id_job": job.id_job,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at,
+        "run_after": job.run_after,
+        "finished_at": job.finished_at,
+    }
+
+def claimable(now: datetime):
+    return or_(
+        and_(Job.status == "queued", Job.run_after <= now),
+        # Lease ran out, the worker died or hangs
+        and_(Job.status == "running", Job.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS)),
+    )
+
+def backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(JOB_MAX_BACKOFF_SECONDS, JOB_BACKOFF_SECONDS * 2 ** max(0, attempts - 1)))
+
+class JobWorker:
+    """Runs due jobs in `slots` concurrent loops of this process.
+
+    Handlers hand their CPU work to the image process pool, the slots only
+    wait on it and on the database. Any number of workers can share a
+    database, a job is claimed by a conditional UPDATE (and SKIP LOCKED on
+    PostgreSQL) so only one of them runs it. Each claim writes its own
+    token to locked_by, a slot only reports on and completes the claim it
+    holds, not one another worker took over after its lease ran out.
+    """
+
+    def __init__(self, slots: int, name: str = None):
+        self.slots = slots
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = []
+
+    async def claim(self):
+        """(id_job, token) of a due job now running under this worker, None when there is none."""
+        token = f"{self.name[:87]}:{uuid.uuid4().hex[:12]}"
+        async with database.session_scope() as db:
+            while True:
+                now = utcnow()
+                query = select(Job.id_job).where(claimable(now)).order_by(Job.run_after, Job.id_job).limit(1)
+                if database.engine.dialect.name == "postgresql":
+                    query = query.with_for_update(skip_locked=True)
+                id_job = await db.scalar(query)
+                if id_job is None:
+                    await db.commit()
+                    return None
+                claimed = (await db.execute(
+                    update(Job)
+                    .where(Job.id_job == id_job, claimable(now))
+                    .values(status="running", attempts=Job.attempts + 1, locked_by=token, locked_at=now)
+                    .execution_options(synchronize_session=False)
+                )).rowcount
+                await db.commit()
+                if claimed:
+                    return id_job, token
+
+    def reporter(self, id_job: int, token: str):
+        async def progress(percent: int, message: str = None):
+            # Also renews the lease
+            async with database.session_scope() as db:
+                await db.execute(
+                    update(Job)
+                    .where(Job.id_job == id_job, Job.locked_by == token)
+                    .values(progress=percent, message=message, locked_at=utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        return progress
+
+    async def heartbeat(self, id_job: int, token: str):
+        # Keeps the lease of a handler that reports no progress for a while
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                async with database.session_scope() as db:
+                    await db.execute(
+                        update(Job)
+                        .where(Job.id_job == id_job, Job.locked_by == token)
+                        .values(locked_at=utcnow())
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception:
+                # SQLite may be locked by the handler's writes, the next beat tries again
+                logger.warning("renewing the lease of job %s failed", id_job, exc_info=True)
+
+    async def run(self, id_job: int, token: str):
+        lease = asyncio.create_task(self.heartbeat(id_job, token))
+        try:
+            await self.complete(id_job, token)
+        finally:
+            lease.cancel()
+
+    async def complete(self, id_job: int, token: str):
+        async with database.session_scope() as db:
+            job = await db.scalar(select(Job).where(Job.id_job == id_job))
+            if job is None:
+                return
+            kind, attempts, max_attempts = job.kind, job.attempts, job.max_attempts
+            try:
+                if kind not in HANDLERS:
+                    raise LookupError(f"No handler for job kind {kind}")
+                if attempts > max_attempts:
+                    raise RuntimeError(f"Gave up after {max_attempts} attempts")
+                func, tags = HANDLERS[kind]
+                result = await func(db, json.loads(job.payload), self.reporter(id_job, token))
+                # progress() wrote from another session, the loaded row is stale
+                completed = (await db.execute(
+                    update(Job)
+                    .where(Job.id_job == id_job, Job.locked_by == token)
+                    .values(status="done", progress=100, message=None, result=json.dumps(result), locked_by=None, finished_at=utcnow())
+                    .execution_options(synchronize_session=False)
+                )).rowcount
+                if not completed:
+                    # Taken over after the lease ran out, the new claim's writes count
+                    await db.rollback()
+                    logger.warning("job %s (%s) lost its lease, its writes are dropped", id_job, kind)
+                    return
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                logger.exception("job %s (%s) failed on attempt %s", id_job, kind, attempts)
+                values = {"message": f"{type(e).__name__}: {e}"[:1000], "locked_by": None}
+                if attempts >= max_attempts:
+                    values.update(status="failed", finished_at=utcnow())
+                else:
+                    values.update(status="queued", run_after=utcnow() + backoff(attempts))
+                await db.execute(
+                    update(Job)
+                    .where(Job.id_job == id_job, Job.locked_by == token)
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                return
+        if tags:
+            await response_cache.invalidate(*tags)
+
+    async def _slot(self, until_idle: bool):
+        while True:
+            try:
+                claimed = await self.claim()
+            except Exception:
+                logger.exception("claiming a job failed")
+                claimed = None
+            if claimed is not None:
+                try:
+                    await self.run(*claimed)
+                except Exception:
+                    # The job stays running and is taken over once its lease runs out
+                    logger.exception("running job %s failed", claimed[0])
+            elif until_idle:
+                return
+            else:
+                await asyncio.sleep(JOB_POLL_SECONDS)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._slot(False)) for _ in range(self.slots)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def run_until_idle(self):
+        await asyncio.gather(*(self._slot(True) for _ in range(self.slots)))
+
+local_worker = JobWorker(JOB_APP_SLOTS)
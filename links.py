@@ -0,0 +1,107 @@
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+async def missing_ids(db: AsyncSession, key, ids: list) -> list:
+    """Those of ids no row has as key, in the order given."""
+    found = set(await db.scalars(select(key).where(key.in_(ids)))) if ids else set()
+    return [ident for ident in dict.fromkeys(ids) if ident not in found]
+
+async def replace_links(db: AsyncSession, model, column, photo_ids: list, new_ids: list) -> dict:
+    """Make the links of every photo in photo_ids exactly new_ids.
+
+    model is CategoriesAndPhotos or GalleryAndPhotos and column its other key.
+    Only the difference against the current rows is written, with one bulk
+    DELETE and one bulk INSERT. The caller commits.
+    """
+    # Repeated ids would build identical rows
+    photo_ids = list(dict.fromkeys(photo_ids))
+    target = set(new_ids)
+    current = {}
+    for id_photo, id_other in await db.execute(select(model.id_photo, column).where(model.id_photo.in_(photo_ids))):
+        current.setdefault(id_photo, set()).add(id_other)
+
+    removed = 0
+    if any(current.get(id_photo, set()) - target for id_photo in photo_ids):
+        stale = delete(model).where(model.id_photo.in_(photo_ids))
+        if target:
+            stale = stale.where(column.not_in(target))
+        removed = (await db.execute(stale)).rowcount
+
+    rows = [
+        {"id_photo": id_photo, column.key: id_other}
+        for id_photo in photo_ids
+        for id_other in sorted(target - current.get(id_photo, set()))
+    ]
+    await insert_links(db, model, column, rows)
+    return {"added": len(rows), "removed": removed}
+
+# Positions are spaced out so a photo can be moved between two others by
+# writing its own row only
+POSITION_GAP = 1024
+
+async def insert_links(db: AsyncSession, model, column, rows: list):
+    """Insert link rows, each placed after the last photo of its category or gallery."""
+    if not rows:
+        return
+    last = dict((await db.execute(
+        select(column, func.max(model.position))
+        .where(column.in_({row[column.key] for row in rows}))
+        .group_by(column)
+    )).all())
+    for row in rows:
+        owner = row[column.key]
+        last[owner] = (last.get(owner) or 0) + POSITION_GAP
+        row["position"] = last[owner]
+    await db.execute(insert(model), rows)
+
+async def ordered_photo_ids(db: AsyncSession, model, column, owner_id: int) -> list:
+    return (await db.scalars(
+        select(model.id_photo).where(column == owner_id).order_by(model.position, model.id_photo)
+    )).all()
+
+async def apply_order(db: AsyncSession, model, column, owner_id: int, photo_ids: list) -> list:
+    """Put photo_ids first, in that order, the other photos follow in their current order.
+
+    Every row is renumbered by a single UPDATE with a CASE over the photo
+    ids. Returns the new order.
+    """
+    current = await ordered_photo_ids(db, model, column, owner_id)
+    listed = set(photo_ids)
+    order = list(photo_ids) + [id_photo for id_photo in current if id_photo not in listed]
+    if order:
+        positions = {id_photo: (index + 1) * POSITION_GAP for index, id_photo in enumerate(order)}
+        await db.execute(
+            update(model)
+            .where(column == owner_id)
+            .values(position=case(positions, value=model.id_photo))
+            .execution_options(synchronize_session=False)
+        )
+    return order
+
+async def move_link(db: AsyncSession, model, column, owner_id: int, photo_id: int, before: int = None, after: int = None):
+    """Place photo_id right before or right after another photo of the same owner.
+
+    The photo takes the midpoint between its new neighbours. Only when they
+    are adjacent is the whole list renumbered first.
+    """
+    anchor_id = before if before is not None else after
+    for _ in range(2):
+        anchor = await db.scalar(select(model.position).where(column == owner_id, model.id_photo == anchor_id))
+        others = (column == owner_id) & (model.id_photo != photo_id)
+        if before is not None:
+            neighbour = await db.scalar(select(func.max(model.position)).where(others, model.position < anchor))
+            position = anchor - POSITION_GAP if neighbour is None else (neighbour + anchor) // 2
+        else:
+            neighbour = await db.scalar(select(func.min(model.position)).where(others, model.position > anchor))
+            position = anchor + POSITION_GAP if neighbour is None else (neighbour + anchor) // 2
+        # Photos sharing the anchor's position would end up on either side
+        shared = await db.scalar(select(func.count()).where(others, model.position == anchor))
+        if position not in (anchor, neighbour) and shared == 1:
+            break
+        await apply_order(db, model, column, owner_id, [])
+    await db.execute(
+        update(model)
+        .where(column == owner_id, model.id_photo == photo_id)
+        .values(position=position)
+        .execution_options(synchronize_session=False)
+    )
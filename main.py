@@ -1,35 +1,46 @@
 from fastapi import FastAPI, HTTPException, Depends
 from starlette.middleware.cors import CORSMiddleware
-from database import SessionLocal
-from sqlalchemy.orm import Session
 from schemas import UserRegisterSchema
 import services
 import fastapi.security as _security
-from routers import admin, photos, adminPhotos, adminGallery, adminCategory, adminServices
-from fastapi.staticfiles import StaticFiles
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from routers import admin, photos, adminPhotos, adminGallery, adminCategory, adminServices, adminFeatured, adminJobs
+from storage import UploadFiles, UploadSizeLimitMiddleware, UPLOAD_DIR, UPLOAD_MAX_REQUEST_BYTES, BULK_MAX_REQUEST_BYTES, UPLOADS_OFFLOAD, UPLOADS_ACCEL_PREFIX
+from stats import dashboard_stats
+from featured import featured_snapshot
+from jobs import local_worker
 
 def start_application():
     app = FastAPI()
     origins = ["http://localhost:3000"]
+    app.add_middleware(
+        UploadSizeLimitMiddleware,
+        max_bytes=UPLOAD_MAX_REQUEST_BYTES,
+        path_limits={"/admin/photos/bulk": BULK_MAX_REQUEST_BYTES},
+    )
     app.add_middleware(
         CORSMiddleware,
         allow_origins=origins,
         allow_credentials=True,
-        allow_methods=["GET", "POST", "PUT", "DELETE"],
+        allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
         allow_headers=["*"],
     )
     return app
 
 app = start_application()
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+@app.on_event("startup")
+async def start_background_tasks():
+    dashboard_stats.start()
+    featured_snapshot.start()
+    local_worker.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await dashboard_stats.stop()
+    await featured_snapshot.stop()
+    await local_worker.stop()
+
+app.mount("/uploads", UploadFiles(UPLOAD_DIR, offload=UPLOADS_OFFLOAD, accel_prefix=UPLOADS_ACCEL_PREFIX), name="uploads")
 
 app.include_router(admin.router)
 app.include_router(photos.router)
@@ -37,6 +48,8 @@ app.include_router(adminCategory.router)
 app.include_router(adminPhotos.router)
 app.include_router(adminGallery.router)
 app.include_router(adminServices.router)
+app.include_router(adminFeatured.router)
+app.include_router(adminJobs.router)
 
 @app.get("/")
 async def root():
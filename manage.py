@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import os
+import shutil
+from pathlib import Path
+
+import cleanup
+import database
+import imaging
+import jobs
+from database import SessionLocal
+from dbreport import report
+from ingest import ingest_photos, rebake_photos
+from jobs import JobWorker
+from models import Category, FeaturedPhoto, Gallery, Photo, PhotoBlob
+from pages import page_key, refresh_affected, refresh_pages
+from search import install_search
+from sqlalchemy import bindparam, select, update
+from storage import blob_path_for, detect_extension, hash_file
+import versions  # writes below bump the table versions too
+
+BATCH_SIZE = 500
+
+def migrate_storage(args):
+    """Move legacy photo files into the content-addressed tree."""
+    db = SessionLocal()
+    moved = deduplicated = missing = 0
+    last_id = 0
+    migrated = []
+    try:
+        while True:
+            photos = (
+                db.query(Photo)
+                .filter(Photo.blob_hash.is_(None), Photo.id_photo > last_id)
+                .order_by(Photo.id_photo)
+                .limit(BATCH_SIZE)
+                .all()
+            )
+            if not photos:
+                break
+            last_id = photos[-1].id_photo
+
+            for photo in photos:
+                source = Path(photo.photo_path.lstrip("/"))
+                if not source.is_file():
+                    print(f"missing: photo {photo.id_photo} -> {photo.photo_path}")
+                    missing += 1
+                    continue
+                with source.open("rb") as buffer:
+                    extension = detect_extension(buffer.read(16)) or source.suffix.lstrip(".").lower()
+                sha256 = hash_file(source)
+                target = blob_path_for(sha256, extension)
+
+                blob = db.query(PhotoBlob).filter(PhotoBlob.sha256 == sha256).first()
+                if blob is None:
+                    blob = PhotoBlob(sha256=sha256, blob_path=f"/{target.as_posix()}", byte_size=source.stat().st_size, ref_count=0)
+                    db.add(blob)
+                    db.flush()
+                    moved += 1
+                else:
+                    deduplicated += 1
+                blob.ref_count += 1
+
+                if not args.dry_run:
+                    # Other legacy rows may still point at the same file, only
+                    # move it away once this is the last one
+                    shared = db.query(Photo).filter(
+                        Photo.photo_path == photo.photo_path,
+                        Photo.blob_hash.is_(None),
+                        Photo.id_photo != photo.id_photo,
+                    ).count()
+                    if not target.exists():
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        if shared:
+                            shutil.copy2(source, target)
+                        else:
+                            os.replace(source, target)
+                    elif not shared and source != target:
+                        source.unlink()
+
+                photo.blob_hash = sha256
+                photo.photo_path = blob.blob_path
+                if not args.dry_run:
+                    db.commit()
+                    migrated.append(photo.id_photo)
+
+            if args.dry_run:
+                db.rollback()
+    finally:
+        db.close()
+    if migrated:
+        # Processing skips photos outside the tree, now they get their variants
+        asyncio.run(queue_processing(migrated))
+    print(f"new blobs: {moved}, duplicates: {deduplicated}, missing files: {missing}")
+
+async def queue_processing(photo_ids):
+    async with database.session_scope() as db:
+        for start in range(0, len(photo_ids), BATCH_SIZE):
+            await jobs.enqueue(db, "photos.process", {"photo_ids": photo_ids[start:start + BATCH_SIZE]})
+        await db.commit()
+
+async def rebuild_all_pages():
+    async with database.session_scope() as db:
+        keys = {page_key("category", ident) for ident in await db.scalars(select(Category.id_category))}
+        keys |= {page_key("gallery", ident) for ident in await db.scalars(select(Gallery.id_gallery))}
+        keys |= {page_key("featured", name) for name in await db.scalars(select(FeaturedPhoto.featured_type).distinct())}
+        await refresh_pages(db, keys)
+        await db.commit()
+        print(f"category, gallery and featured pages: {len(keys)}")
+
+        photo_ids = (await db.scalars(select(Photo.id_photo).order_by(Photo.id_photo))).all()
+        for start in range(0, len(photo_ids), BATCH_SIZE):
+            await refresh_pages(db, {page_key("photo", ident) for ident in photo_ids[start:start + BATCH_SIZE]})
+            await db.commit()
+        print(f"photo pages: {len(photo_ids)}")
+
+def rebuild_pages(args):
+    """Build every public page from scratch, e.g. after a restore."""
+    asyncio.run(rebuild_all_pages())
+
+async def describe_photos(limit):
+    """Fill dimensions and placeholders of photos that have none, BATCH_SIZE at a time.
+
+    Each distinct file is decoded once, spread over the image process pool.
+    """
+    described = failed = 0
+    last_id = 0
+    async with database.session_scope() as db:
+        while limit is None or described + failed < limit:
+            size = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - described - failed)
+            photos = (await db.execute(
+                select(Photo.id_photo, Photo.photo_path)
+                .where(Photo.width.is_(None), Photo.id_photo > last_id)
+                .order_by(Photo.id_photo)
+                .limit(size)
+            )).all()
+            if not photos:
+                break
+            last_id = photos[-1].id_photo
+
+            paths = sorted({photo_path for _, photo_path in photos})
+            results = await asyncio.gather(
+                *(imaging.run_in_pool(imaging.describe, path.lstrip("/")) for path in paths),
+                return_exceptions=True,
+            )
+            placeholders = {}
+            for path, result in zip(paths, results):
+                if isinstance(result, Exception):
+                    print(f"failed: {path}: {result}")
+                else:
+                    placeholders[path] = result
+
+            rows = [
+                {"b_id": id_photo, **{f"b_{key}": value for key, value in placeholders[photo_path].items()}}
+                for id_photo, photo_path in photos if photo_path in placeholders
+            ]
+            failed += len(photos) - len(rows)
+            if rows:
+                photos_table = Photo.__table__
+                await db.execute(
+                    update(photos_table)
+                    .where(photos_table.c.id_photo == bindparam("b_id"))
+                    .values({key[2:]: bindparam(key) for key in rows[0] if key != "b_id"}),
+                    rows,
+                )
+                # Listings are prebuilt, the pages of these photos carry the new fields
+                await refresh_affected(db, photo_ids=[row["b_id"] for row in rows])
+                await db.commit()
+                described += len(rows)
+            print(f"described {described} photos, {failed} failed")
+
+def backfill_placeholders(args):
+    """Compute dimensions, dominant color and LQIP for photos uploaded before they existed."""
+    asyncio.run(describe_photos(args.limit))
+
+async def ingest_all(rebake: bool):
+    ingested = unreadable = rendered = 0
+    last_id = 0
+    async with database.session_scope() as db:
+        while True:
+            photo_ids = (await db.scalars(
+                select(Photo.id_photo)
+                .where(~Photo.exif.has(), Photo.id_photo > last_id)
+                .order_by(Photo.id_photo)
+                .limit(BATCH_SIZE)
+            )).all()
+            if not photo_ids:
+                break
+            last_id = photo_ids[-1]
+            ids = await ingest_photos(db, photo_ids)
+            await refresh_affected(db, photo_ids=ids)
+            if rebake:
+                rendered += await rebake_photos(db, ids)
+            await db.commit()
+            ingested += len(ids)
+            unreadable += len(photo_ids) - len(ids)
+            print(f"ingested {ingested} photos, {unreadable} unreadable, {rendered} files rendered again")
+
+def ingest_exif(args):
+    """Read the EXIF of photos uploaded before the ingest stage existed."""
+    asyncio.run(ingest_all(args.rebake))
+
+async def run_forever(job_worker):
+    job_worker.start()
+    await asyncio.Event().wait()
+
+def worker(args):
+    """Run queued jobs until stopped, or until none is due with --until-idle."""
+    job_worker = JobWorker(args.slots)
+    print(f"worker {job_worker.name} running {args.slots} slots")
+    asyncio.run(job_worker.run_until_idle() if args.until_idle else run_forever(job_worker))
+
+def reconcile_storage(args):
+    """Report orphaned files, rows whose file is missing and disk usage, optionally purge."""
+    asyncio.run(cleanup.reconcile(args.purge and not args.dry_run, args.min_age, BATCH_SIZE))
+    if args.purge and args.dry_run:
+        print("dry run, nothing was removed")
+
+def setup_search(args):
+    """Create the full-text index on an existing database and fill it."""
+    with database.engine.begin() as connection:
+        install_search(connection)
+    print(f"search index ready on {database.engine.dialect.name}")
+
+def db_report(args):
+    """Index usage and plans of the hot queries on the configured database."""
+    report(database.engine)
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate-storage", help="rehash legacy photo files into the sharded content-addressed tree")
+    migrate.add_argument("--dry-run", action="store_true", help="report what would change without touching files or rows")
+    migrate.set_defaults(func=migrate_storage)
+
+    rebuild = commands.add_parser("rebuild-pages", help="rebuild the precomputed public gallery, category, featured and photo pages")
+    rebuild.set_defaults(func=rebuild_pages)
+
+    backfill = commands.add_parser("backfill-placeholders", help="compute dimensions, dominant color and LQIP for photos without them, in parallel")
+    backfill.add_argument("--limit", type=int, default=None, help="stop after this many photos")
+    backfill.set_defaults(func=backfill_placeholders)
+
+    exif = commands.add_parser("ingest-exif", help="read EXIF of photos without it and fill in blank dates and locations")
+    exif.add_argument("--rebake", action="store_true", help="also render variants and placeholders of turned photos again with their orientation applied")
+    exif.set_defaults(func=ingest_exif)
+
+    work = commands.add_parser("worker", help="run queued jobs (photo processing) on the image process pool")
+    work.add_argument("--slots", type=int, default=imaging.IMAGE_WORKERS or os.cpu_count(), help="jobs run at the same time, defaults to the image pool size")
+    work.add_argument("--until-idle", action="store_true", help="exit once no job is due")
+    work.set_defaults(func=worker)
+
+    reconcile = commands.add_parser("reconcile-storage", help="compare the uploads directory with the database: orphaned files, dangling rows and sizes")
+    reconcile.add_argument("--purge", action="store_true", help="remove orphans and unreferenced blobs, queue missing variants for rendering")
+    reconcile.add_argument("--dry-run", action="store_true", help="with --purge, only report what would be removed")
+    reconcile.add_argument("--min-age", type=int, default=3600, help="seconds an unreferenced file must be old to count as orphaned")
+    reconcile.set_defaults(func=reconcile_storage)
+
+    search = commands.add_parser("setup-search", help="create the full-text search index (tsvector or FTS5) for existing photos")
+    search.set_defaults(func=setup_search)
+
+    dbreport = commands.add_parser("db-report", help="report index usage and slow-query candidates against SQLALCHEMY_DATABASE_URL")
+    dbreport.set_defaults(func=db_report)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
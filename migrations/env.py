@@ -0,0 +1,57 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from database import engine
+from models import Base
+
+if context.config.config_file_name is not None:
+    fileConfig(context.config.config_file_name)
+
+# Tables owned by the search index rather than the models
+IGNORED_TABLES = {"photos_fts", "photos_fts_config", "photos_fts_data", "photos_fts_docsize", "photos_fts_idx"}
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table" and name in IGNORED_TABLES:
+        return False
+    if type_ == "column" and name == "search_vector":
+        return False
+    return True
+
+def run_migrations_offline():
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=Base.metadata,
+        literal_binds=True,
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        sqlite = connection.dialect.name == "sqlite"
+        if sqlite:
+            # Batch operations copy a table and drop the old one, with the
+            # foreign keys the engine turns on that would cascade into every
+            # link row. The pragma only takes effect outside a transaction.
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.commit()
+        context.configure(
+            connection=connection,
+            target_metadata=Base.metadata,
+            include_object=include_object,
+            # SQLite can only alter most columns by copying the table
+            render_as_batch=sqlite,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+            if sqlite:
+                violations = connection.exec_driver_sql("PRAGMA foreign_key_check").all()
+                if violations:
+                    raise RuntimeError(f"Foreign key violations after migrating: {violations[:10]}")
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
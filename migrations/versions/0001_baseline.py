@@ -0,0 +1,92 @@
+"""baseline, the schema as it was before migrations
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18 09:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_baseline"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "users",
+        sa.Column("id_user", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(200), nullable=False),
+        sa.Column("email", sa.String(200), nullable=False),
+        sa.Column("password", sa.String(200), nullable=False),
+        sa.Column("description", sa.Text()),
+        sa.Column("photo_path", sa.String(500)),
+        sa.Column("instagram_url", sa.String(500)),
+        sa.Column("facebook_url", sa.String(500)),
+        sa.Column("linkedin_url", sa.String(500)),
+    )
+    op.create_index("ix_users_id_user", "users", ["id_user"])
+
+    op.create_table(
+        "photos",
+        sa.Column("id_photo", sa.Integer(), primary_key=True),
+        sa.Column("photo_path", sa.String(300), nullable=False),
+        sa.Column("title", sa.String(300)),
+        sa.Column("description", sa.String(300)),
+        sa.Column("location", sa.String(300)),
+        sa.Column("date", sa.Date()),
+    )
+    op.create_index("ix_photos_id_photo", "photos", ["id_photo"])
+
+    op.create_table(
+        "categories",
+        sa.Column("id_category", sa.Integer(), primary_key=True),
+        sa.Column("category_name", sa.String(100), nullable=False),
+    )
+    op.create_index("ix_categories_id_category", "categories", ["id_category"])
+
+    op.create_table(
+        "categories_and_photos",
+        sa.Column("id_category", sa.Integer(), sa.ForeignKey("categories.id_category", ondelete="CASCADE"), primary_key=True),
+        sa.Column("id_photo", sa.Integer(), sa.ForeignKey("photos.id_photo", ondelete="CASCADE"), primary_key=True),
+    )
+
+    op.create_table(
+        "featured_photos",
+        sa.Column("id_photo", sa.Integer(), sa.ForeignKey("photos.id_photo", ondelete="CASCADE"), primary_key=True),
+        sa.Column("featured_type", sa.String(20), primary_key=True),
+    )
+
+    op.create_table(
+        "services",
+        sa.Column("id_service", sa.Integer(), primary_key=True),
+        sa.Column("service_name", sa.String(300), nullable=False),
+        sa.Column("description", sa.Text()),
+    )
+    op.create_index("ix_services_id_service", "services", ["id_service"])
+
+    op.create_table(
+        "gallery",
+        sa.Column("id_gallery", sa.Integer(), primary_key=True),
+        sa.Column("gallery_name", sa.String(200)),
+    )
+    op.create_index("ix_gallery_id_gallery", "gallery", ["id_gallery"])
+
+    op.create_table(
+        "gallery_and_photos",
+        sa.Column("id_gallery", sa.Integer(), sa.ForeignKey("gallery.id_gallery", ondelete="CASCADE"), primary_key=True),
+        sa.Column("id_photo", sa.Integer(), sa.ForeignKey("photos.id_photo", ondelete="CASCADE"), primary_key=True),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ("gallery_and_photos", "gallery", "services", "featured_photos", "categories_and_photos", "categories", "photos", "users"):
+        op.drop_table(table)
@@ -0,0 +1,100 @@
+"""content-addressed blobs, variants, change tracking, public pages and search
+
+Revision ID: 0002_feature_tables
+Revises: 0001_baseline
+Create Date: 2026-10-18 09:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from search import install_search
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_feature_tables"
+down_revision: Union[str, Sequence[str], None] = "0001_baseline"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UPDATED_TABLES = ("photos", "categories", "services", "gallery")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "photo_blobs",
+        sa.Column("sha256", sa.String(64), primary_key=True),
+        sa.Column("blob_path", sa.String(300), nullable=False),
+        sa.Column("byte_size", sa.BigInteger(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+    )
+
+    op.create_table(
+        "photo_variants",
+        sa.Column("id_variant", sa.Integer(), primary_key=True),
+        sa.Column("id_photo", sa.Integer(), sa.ForeignKey("photos.id_photo", ondelete="CASCADE"), nullable=False),
+        sa.Column("variant_path", sa.String(500), nullable=False),
+        sa.Column("width", sa.Integer(), nullable=False),
+        sa.Column("height", sa.Integer(), nullable=False),
+        sa.Column("format", sa.String(10), nullable=False),
+        sa.Column("byte_size", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_photo_variants_id_variant", "photo_variants", ["id_variant"])
+    op.create_index("ix_photo_variants_id_photo", "photo_variants", ["id_photo"])
+
+    op.create_table(
+        "table_versions",
+        sa.Column("table_name", sa.String(100), primary_key=True),
+        sa.Column("version", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+    )
+
+    op.create_table(
+        "public_pages",
+        sa.Column("page_key", sa.String(100), primary_key=True),
+        sa.Column("document", sa.Text(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+    )
+
+    with op.batch_alter_table("users") as batch:
+        batch.add_column(sa.Column("token_version", sa.Integer(), nullable=False, server_default="0"))
+
+    with op.batch_alter_table("photos") as batch:
+        batch.add_column(sa.Column("blob_hash", sa.String(64), nullable=True))
+        batch.create_foreign_key("fk_photos_blob_hash_photo_blobs", "photo_blobs", ["blob_hash"], ["sha256"])
+        batch.create_index("ix_photos_blob_hash", ["blob_hash"])
+
+    for table in UPDATED_TABLES:
+        with op.batch_alter_table(table) as batch:
+            batch.add_column(sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()))
+
+    # After the batch operations, copying photos on SQLite would drop the triggers
+    install_search(op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == "sqlite":
+        for trigger in ("photos_fts_insert", "photos_fts_delete", "photos_fts_update"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS photos_fts")
+    elif bind.dialect.name == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_photos_search_vector")
+        op.execute("ALTER TABLE photos DROP COLUMN IF EXISTS search_vector")
+
+    for table in UPDATED_TABLES:
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("updated_at")
+    with op.batch_alter_table("photos") as batch:
+        batch.drop_index("ix_photos_blob_hash")
+        batch.drop_constraint("fk_photos_blob_hash_photo_blobs", type_="foreignkey")
+        batch.drop_column("blob_hash")
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("token_version")
+
+    for table in ("public_pages", "table_versions", "photo_variants", "photo_blobs"):
+        op.drop_table(table)
@@ -0,0 +1,46 @@
+"""indexes for photo ordering, login, featured lookups and reverse link lookups
+
+Revision ID: 0003_performance_indexes
+Revises: 0002_feature_tables
+Create Date: 2026-10-18 09:20:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_performance_indexes"
+down_revision: Union[str, Sequence[str], None] = "0002_feature_tables"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT email, count(*) FROM users GROUP BY email HAVING count(*) > 1"
+    )).all()
+    if duplicates:
+        listed = ", ".join(f"{email} ({count})" for email, count in duplicates)
+        raise RuntimeError(f"users.email must be unique before upgrading, duplicates: {listed}")
+
+    # Keyset pagination orders by (date, id_photo)
+    op.create_index("ix_photos_date_id_photo", "photos", ["date", "id_photo"])
+    # Every login looks the user up by email, the unique index doubles as the constraint
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.create_index("ix_featured_photos_featured_type", "featured_photos", ["featured_type"])
+    # The primary keys lead with the category/gallery, lookups by photo need their own index
+    op.create_index("ix_categories_and_photos_id_photo", "categories_and_photos", ["id_photo"])
+    op.create_index("ix_gallery_and_photos_id_photo", "gallery_and_photos", ["id_photo"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_gallery_and_photos_id_photo", "gallery_and_photos")
+    op.drop_index("ix_categories_and_photos_id_photo", "categories_and_photos")
+    op.drop_index("ix_featured_photos_featured_type", "featured_photos")
+    op.drop_index("ix_users_email", "users")
+    op.drop_index("ix_photos_date_id_photo", "photos")
@@ -0,0 +1,48 @@
+"""order featured photos within their type
+
+Revision ID: 0004_featured_position
+Revises: 0003_performance_indexes
+Create Date: 2026-10-18 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_featured_position"
+down_revision: Union[str, Sequence[str], None] = "0003_performance_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("featured_photos") as batch:
+        batch.add_column(sa.Column("position", sa.Integer(), nullable=False, server_default="0"))
+    # Existing lists keep the order they were shown in, by photo date with
+    # undated photos last, numbered in one pass (SQLite 3.33+ for UPDATE FROM)
+    op.execute(
+        """UPDATE featured_photos SET position = ranked.position
+        FROM (
+            SELECT featured.featured_type, featured.id_photo, row_number() OVER (
+                PARTITION BY featured.featured_type
+                ORDER BY CASE WHEN photo.date IS NULL THEN 1 ELSE 0 END, photo.date, featured.id_photo
+            ) - 1 AS position
+            FROM featured_photos AS featured
+            JOIN photos AS photo ON photo.id_photo = featured.id_photo
+        ) AS ranked
+        WHERE featured_photos.featured_type = ranked.featured_type AND featured_photos.id_photo = ranked.id_photo"""
+    )
+    op.drop_index("ix_featured_photos_featured_type", "featured_photos")
+    op.create_index("ix_featured_photos_type_position", "featured_photos", ["featured_type", "position"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_featured_photos_type_position", "featured_photos")
+    op.create_index("ix_featured_photos_featured_type", "featured_photos", ["featured_type"])
+    with op.batch_alter_table("featured_photos") as batch:
+        batch.drop_column("position")
@@ -0,0 +1,39 @@
+"""dimensions, dominant color and inline placeholder per photo
+
+Revision ID: 0005_photo_placeholders
+Revises: 0004_featured_position
+Create Date: 2026-10-18 10:20:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_photo_placeholders"
+down_revision: Union[str, Sequence[str], None] = "0004_featured_position"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing photos stay NULL until `python manage.py backfill-placeholders`
+    with op.batch_alter_table("photos") as batch:
+        batch.add_column(sa.Column("width", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("height", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("aspect_ratio", sa.Float(), nullable=True))
+        batch.add_column(sa.Column("dominant_color", sa.String(7), nullable=True))
+        batch.add_column(sa.Column("lqip", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("photos") as batch:
+        batch.drop_column("lqip")
+        batch.drop_column("dominant_color")
+        batch.drop_column("aspect_ratio")
+        batch.drop_column("height")
+        batch.drop_column("width")
@@ -0,0 +1,44 @@
+"""EXIF details read from the original of each photo
+
+Revision ID: 0006_photo_exif
+Revises: 0005_photo_placeholders
+Create Date: 2026-10-18 10:40:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_photo_exif"
+down_revision: Union[str, Sequence[str], None] = "0005_photo_placeholders"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Filled for existing photos by `python manage.py ingest-exif`
+    op.create_table(
+        "photo_exif",
+        sa.Column("id_photo", sa.Integer(), sa.ForeignKey("photos.id_photo", ondelete="CASCADE"), primary_key=True),
+        sa.Column("taken_at", sa.DateTime(), nullable=True),
+        sa.Column("camera_make", sa.String(100), nullable=True),
+        sa.Column("camera_model", sa.String(100), nullable=True),
+        sa.Column("lens", sa.String(100), nullable=True),
+        sa.Column("exposure_time", sa.Float(), nullable=True),
+        sa.Column("f_number", sa.Float(), nullable=True),
+        sa.Column("iso", sa.Integer(), nullable=True),
+        sa.Column("focal_length", sa.Float(), nullable=True),
+        sa.Column("latitude", sa.Float(), nullable=True),
+        sa.Column("longitude", sa.Float(), nullable=True),
+        sa.Column("altitude", sa.Float(), nullable=True),
+        sa.Column("orientation", sa.Integer(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("photo_exif")
@@ -0,0 +1,31 @@
+"""indexes on stored file paths for storage reconciliation
+
+Revision ID: 0008_upload_path_indexes
+Revises: 0007_jobs
+Create Date: 2026-10-18 11:40:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008_upload_path_indexes"
+down_revision: Union[str, Sequence[str], None] = "0007_jobs"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Files found on disk are looked up by path, a batch at a time
+    op.create_index("ix_photos_photo_path", "photos", ["photo_path"])
+    op.create_index("ix_photo_variants_variant_path", "photo_variants", ["variant_path"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_photo_variants_variant_path", "photo_variants")
+    op.drop_index("ix_photos_photo_path", "photos")
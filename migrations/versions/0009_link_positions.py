@@ -0,0 +1,56 @@
+"""order photos within categories and galleries
+
+Revision ID: 0009_link_positions
+Revises: 0008_upload_path_indexes
+Create Date: 2026-10-18 12:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009_link_positions"
+down_revision: Union[str, Sequence[str], None] = "0008_upload_path_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# links.POSITION_GAP at the time of writing
+POSITION_GAP = 1024
+
+LINK_TABLES = (
+    ("categories_and_photos", "id_category", "ix_categories_and_photos_category_position"),
+    ("gallery_and_photos", "id_gallery", "ix_gallery_and_photos_gallery_position"),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table, owner, index in LINK_TABLES:
+        with op.batch_alter_table(table) as batch:
+            batch.add_column(sa.Column("position", sa.Integer(), nullable=False, server_default="0"))
+        # Existing lists keep the order they were shown in, by photo date with
+        # undated photos last, numbered in one pass (SQLite 3.33+ for UPDATE FROM)
+        op.execute(
+            f"""UPDATE {table} SET position = ranked.position
+            FROM (
+                SELECT link.{owner}, link.id_photo, {POSITION_GAP} * row_number() OVER (
+                    PARTITION BY link.{owner}
+                    ORDER BY CASE WHEN photo.date IS NULL THEN 1 ELSE 0 END, photo.date, link.id_photo
+                ) AS position
+                FROM {table} AS link
+                JOIN photos AS photo ON photo.id_photo = link.id_photo
+            ) AS ranked
+            WHERE {table}.{owner} = ranked.{owner} AND {table}.id_photo = ranked.id_photo"""
+        )
+        op.create_index(index, table, [owner, "position"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, owner, index in LINK_TABLES:
+        op.drop_index(index, table)
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("position")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Date, Text
+from sqlalchemy import BigInteger, Column, DateTime, Float, ForeignKey, Index, Integer, String, Date, Text, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -9,28 +9,95 @@ class User(Base):
     
     id_user = Column(Integer, primary_key=True, index=True)
     username = Column(String(200), nullable=False)
-    email = Column(String(200), nullable=False)
+    email = Column(String(200), nullable=False, unique=True, index=True)
     password = Column(String(200), nullable=False)
     description = Column(Text)
     photo_path = Column(String(500))
     instagram_url = Column(String(500))
     facebook_url = Column(String(500))
     linkedin_url = Column(String(500))
+    # Bumped to revoke every token issued before, e.g. on password change
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
 class Photo(Base):
     __tablename__ = "photos"
+    # Listings are ordered by (date, id_photo)
+    __table_args__ = (Index("ix_photos_date_id_photo", "date", "id_photo"),)
     
     id_photo = Column(Integer, primary_key=True, index=True)
-    photo_path = Column(String(300), nullable=False)
+    # Indexed for storage reconciliation, which looks files up by path
+    photo_path = Column(String(300), nullable=False, index=True)
+    blob_hash = Column(String(64), ForeignKey('photo_blobs.sha256'), index=True)
     title = Column(String(300))
     description = Column(String(300))
     location = Column(String(300))
     date = Column(Date)
+    # Known at upload so clients can lay out grids and paint a placeholder
+    # before the image arrives, lqip is a data URI
+    width = Column(Integer)
+    height = Column(Integer)
+    aspect_ratio = Column(Float)
+    dominant_color = Column(String(7))
+    lqip = Column(Text)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
     
     # Relationships
-    categories = relationship("CategoriesAndPhotos", back_populates="photo", cascade="all, delete")
-    featured_photos = relationship("FeaturedPhoto", back_populates="photo", cascade="all, delete")
-    galleries = relationship("GalleryAndPhotos", back_populates="photo", cascade="all, delete")
+    # Deletes are left to ON DELETE CASCADE, the ORM never loads children to remove them
+    categories = relationship("CategoriesAndPhotos", back_populates="photo", cascade="all, delete", passive_deletes=True)
+    featured_photos = relationship("FeaturedPhoto", back_populates="photo", cascade="all, delete", passive_deletes=True)
+    galleries = relationship("GalleryAndPhotos", back_populates="photo", cascade="all, delete", passive_deletes=True)
+    variants = relationship("PhotoVariant", back_populates="photo", cascade="all, delete", passive_deletes=True, lazy="selectin", order_by="PhotoVariant.width")
+    blob = relationship("PhotoBlob", back_populates="photos")
+    exif = relationship("PhotoExif", back_populates="photo", uselist=False, cascade="all, delete", passive_deletes=True)
+
+
+class PhotoBlob(Base):
+    __tablename__ = "photo_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    blob_path = Column(String(300), nullable=False)
+    byte_size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    
+    # Relationships
+    photos = relationship("Photo", back_populates="blob")
+
+
+class PhotoExif(Base):
+    __tablename__ = "photo_exif"
+    
+    # Read from the original by the ingest stage after upload
+    id_photo = Column(Integer, ForeignKey('photos.id_photo', ondelete='CASCADE'), primary_key=True)
+    taken_at = Column(DateTime)
+    camera_make = Column(String(100))
+    camera_model = Column(String(100))
+    lens = Column(String(100))
+    exposure_time = Column(Float)
+    f_number = Column(Float)
+    iso = Column(Integer)
+    focal_length = Column(Float)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    altitude = Column(Float)
+    orientation = Column(Integer)
+    
+    # Relationships
+    photo = relationship("Photo", back_populates="exif")
+
+
+class PhotoVariant(Base):
+    __tablename__ = "photo_variants"
+    
+    id_variant = Column(Integer, primary_key=True, index=True)
+    id_photo = Column(Integer, ForeignKey('photos.id_photo', ondelete='CASCADE'), nullable=False, index=True)
+    variant_path = Column(String(500), nullable=False, index=True)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    format = Column(String(10), nullable=False)
+    byte_size = Column(Integer, nullable=False)
+    
+    # Relationships
+    photo = relationship("Photo", back_populates="variants")
 
 
 class Category(Base):
@@ -38,16 +105,22 @@ class Category(Base):
     
     id_category = Column(Integer, primary_key=True, index=True)
     category_name = Column(String(100), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
     
     # Relationships
-    photos = relationship("CategoriesAndPhotos", back_populates="category")
+    photos = relationship("CategoriesAndPhotos", back_populates="category", passive_deletes=True)
 
 
 class CategoriesAndPhotos(Base):
     __tablename__ = "categories_and_photos"
+    # Photos of a category are listed by position
+    __table_args__ = (Index("ix_categories_and_photos_category_position", "id_category", "position"),)
     
     id_category = Column(Integer, ForeignKey('categories.id_category', ondelete='CASCADE'), primary_key=True)
-    id_photo = Column(Integer, ForeignKey('photos.id_photo', ondelete='CASCADE'), primary_key=True)
+    # The primary key leads with id_category, lookups by photo need their own index
+    id_photo = Column(Integer, ForeignKey('photos.id_photo', ondelete='CASCADE'), primary_key=True, index=True)
+    # Spaced out by links.POSITION_GAP, moving a photo only rewrites its own row
+    position = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     category = relationship("Category", back_populates="photos")
@@ -56,9 +129,12 @@ class CategoriesAndPhotos(Base):
 
 class FeaturedPhoto(Base):
     __tablename__ = "featured_photos"
+    # Each type is read as one list in position order
+    __table_args__ = (Index("ix_featured_photos_type_position", "featured_type", "position"),)
     
     id_photo = Column(Integer, ForeignKey('photos.id_photo', ondelete='CASCADE'), primary_key=True)
     featured_type = Column(String(20), primary_key=True)
+    position = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     photo = relationship("Photo", back_populates="featured_photos")
@@ -70,6 +146,7 @@ class Service(Base):
     id_service = Column(Integer, primary_key=True, index=True)
     service_name = Column(String(300), nullable=False)
     description = Column(Text)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
 
 class Gallery(Base):
@@ -77,17 +154,61 @@ class Gallery(Base):
     
     id_gallery = Column(Integer, primary_key=True, index=True)
     gallery_name = Column(String(200))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
     
     # Relationships
-    photos = relationship("GalleryAndPhotos", back_populates="gallery")
+    photos = relationship("GalleryAndPhotos", back_populates="gallery", passive_deletes=True)
 
 
 class GalleryAndPhotos(Base):
     __tablename__ = "gallery_and_photos"
+    # Photos of a gallery are listed by position
+    __table_args__ = (Index("ix_gallery_and_photos_gallery_position", "id_gallery", "position"),)
     
     id_gallery = Column(Integer, ForeignKey('gallery.id_gallery', ondelete='CASCADE'), primary_key=True)
-    id_photo = Column(Integer, ForeignKey('photos.id_photo', ondelete='CASCADE'), primary_key=True)
+    id_photo = Column(Integer, ForeignKey('photos.id_photo', ondelete='CASCADE'), primary_key=True, index=True)
+    position = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     gallery = relationship("Gallery", back_populates="photos")
     photo = relationship("Photo", back_populates="galleries")
+
+
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+
+    # One row per table, bumped in the same transaction as every write to it
+    table_name = Column(String(100), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class PublicPage(Base):
+    __tablename__ = "public_pages"
+
+    # Denormalized JSON served as is by the public API, keyed like "gallery:3"
+    page_key = Column(String(100), primary_key=True)
+    document = Column(Text, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    # Workers pick the oldest due job of a status
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+    id_job = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    # JSON, handlers must cope with running more than once for the same payload
+    payload = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime(timezone=True), nullable=False)
+    progress = Column(Integer, nullable=False, default=0)
+    message = Column(Text)
+    result = Column(Text)
+    locked_by = Column(String(100))
+    locked_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True))
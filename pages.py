@@ -0,0 +1,176 @@
+import json
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from models import Category, CategoriesAndPhotos, FeaturedPhoto, Gallery, GalleryAndPhotos, Photo, PublicPage
+
+def page_key(kind: str, ident) -> str:
+    return f"{kind}:{ident}"
+
+def photo_summary(photo: Photo) -> dict:
+    return {
+        "id_photo": photo.id_photo,
+        "title": photo.title,
+        "description": photo.description,
+        "location": photo.location,
+        "date": photo.date,
+        # The stored original keeps its full EXIF, GPS and serial numbers
+        # included, public documents point at a rendition without it
+        "photo_path": f"/photos/{photo.id_photo}/render",
+        "width": photo.width,
+        "height": photo.height,
+        "aspect_ratio": photo.aspect_ratio,
+        "dominant_color": photo.dominant_color,
+        "lqip": photo.lqip,
+        "variants": [
+            {"variant_path": variant.variant_path, "width": variant.width, "height": variant.height, "format": variant.format}
+            for variant in photo.variants
+        ],
+    }
+
+# GPS coordinates and the original file are not published, the location is
+# what the photographer chose to publish or a rounded EXIF position
+PUBLIC_EXIF = ("taken_at", "camera_make", "camera_model", "lens", "exposure_time", "f_number", "iso", "focal_length")
+
+# Photos already in the session may hold collections loaded before the
+# write, the builders below always reload them (populate_existing)
+
+async def build_photo_pages(db: AsyncSession, photo_ids) -> dict:
+    photos = (await db.scalars(select(Photo).where(Photo.id_photo.in_(photo_ids)).options(
+        selectinload(Photo.categories).selectinload(CategoriesAndPhotos.category),
+        selectinload(Photo.galleries).selectinload(GalleryAndPhotos.gallery),
+        selectinload(Photo.exif),
+    ).execution_options(populate_existing=True))).all()
+    return {
+        page_key("photo", photo.id_photo): {
+            **photo_summary(photo),
+            "categories": [
+                {"id_category": link.category.id_category, "category_name": link.category.category_name}
+                for link in photo.categories
+            ],
+            "galleries": [
+                {"id_gallery": link.gallery.id_gallery, "gallery_name": link.gallery.gallery_name}
+                for link in photo.galleries
+            ],
+            "exif": {key: getattr(photo.exif, key) for key in PUBLIC_EXIF} if photo.exif else None,
+        }
+        for photo in photos
+    }
+
+async def build_collection_pages(db: AsyncSession, kind: str, id_column, name_column, link_column, ids) -> dict:
+    """Pages for categories or galleries, each with every photo linked to it in position order."""
+    names = dict((await db.execute(select(id_column, name_column).where(id_column.in_(ids)))).all())
+    pages = {
+        ident: {id_column.key: ident, name_column.key: name, "photos": []}
+        for ident, name in names.items()
+    }
+    link = link_column.class_
+    rows = await db.execute(
+        select(link_column, Photo)
+        .join(Photo, Photo.id_photo == link.id_photo)
+        .where(link_column.in_(pages))
+        .order_by(link_column, link.position, link.id_photo)
+        .execution_options(populate_existing=True)
+    )
+    for ident, photo in rows:
+        pages[ident]["photos"].append(photo_summary(photo))
+    return {page_key(kind, ident): page for ident, page in pages.items()}
+
+async def build_featured_pages(db: AsyncSession, featured_types) -> dict:
+    pages = {featured_type: {"featured_type": featured_type, "photos": []} for featured_type in featured_types}
+    rows = await db.execute(
+        select(FeaturedPhoto.featured_type, Photo)
+        .join(Photo, Photo.id_photo == FeaturedPhoto.id_photo)
+        .where(FeaturedPhoto.featured_type.in_(pages))
+        .order_by(FeaturedPhoto.featured_type, FeaturedPhoto.position, FeaturedPhoto.id_photo)
+        .execution_options(populate_existing=True)
+    )
+    for featured_type, photo in rows:
+        pages[featured_type]["photos"].append(photo_summary(photo))
+    return {page_key("featured", featured_type): page for featured_type, page in pages.items()}
+
+async def affected_pages(db: AsyncSession, photo_ids=(), category_ids=(), gallery_ids=(), featured_types=()) -> set:
+    """Keys of every page that shows one of the given rows.
+
+    A photo appears on its own page and on the pages of its categories,
+    galleries and featured lists. Categories and galleries appear on their
+    own page and, by name, on the pages of their photos.
+    """
+    keys = {page_key("category", ident) for ident in category_ids}
+    keys |= {page_key("gallery", ident) for ident in gallery_ids}
+    keys |= {page_key("featured", featured_type) for featured_type in featured_types}
+
+    if category_ids:
+        keys |= {page_key("photo", ident) for ident in await db.scalars(
+            select(CategoriesAndPhotos.id_photo).where(CategoriesAndPhotos.id_category.in_(category_ids))
+        )}
+    if gallery_ids:
+        keys |= {page_key("photo", ident) for ident in await db.scalars(
+            select(GalleryAndPhotos.id_photo).where(GalleryAndPhotos.id_gallery.in_(gallery_ids))
+        )}
+
+    if photo_ids:
+        keys |= {page_key("photo", ident) for ident in photo_ids}
+        for kind, column, link_column in (
+            ("category", CategoriesAndPhotos.id_category, CategoriesAndPhotos.id_photo),
+            ("gallery", GalleryAndPhotos.id_gallery, GalleryAndPhotos.id_photo),
+            ("featured", FeaturedPhoto.featured_type, FeaturedPhoto.id_photo),
+        ):
+            keys |= {page_key(kind, ident) for ident in await db.scalars(
+                select(column).where(link_column.in_(photo_ids)).distinct()
+            )}
+    return keys
+
+async def refresh_pages(db: AsyncSession, keys):
+    """Rebuild the pages in keys, pages whose row no longer exists are dropped."""
+    if not keys:
+        return
+    wanted = defaultdict(list)
+    for key in keys:
+        kind, ident = key.split(":", 1)
+        wanted[kind].append(ident if kind == "featured" else int(ident))
+
+    documents = {}
+    if wanted["photo"]:
+        documents.update(await build_photo_pages(db, wanted["photo"]))
+    if wanted["category"]:
+        documents.update(await build_collection_pages(
+            db, "category", Category.id_category, Category.category_name, CategoriesAndPhotos.id_category, wanted["category"]
+        ))
+    if wanted["gallery"]:
+        documents.update(await build_collection_pages(
+            db, "gallery", Gallery.id_gallery, Gallery.gallery_name, GalleryAndPhotos.id_gallery, wanted["gallery"]
+        ))
+    if wanted["featured"]:
+        documents.update(await build_featured_pages(db, wanted["featured"]))
+
+    await db.execute(delete(PublicPage).where(PublicPage.page_key.in_(keys)).execution_options(synchronize_session=False))
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"page_key": key, "document": json.dumps(jsonable_encoder(document), separators=(",", ":")), "updated_at": now}
+        for key, document in documents.items()
+    ]
+    if rows:
+        await db.execute(insert(PublicPage), rows)
+
+async def refresh_affected(db: AsyncSession, **ids):
+    await db.flush()
+    await refresh_pages(db, await affected_pages(db, **ids))
+
+@asynccontextmanager
+async def refreshing(db: AsyncSession, **ids):
+    """Rebuild the pages touched by the writes in the block, before commit.
+
+    Pages are collected before and after the block so a photo leaving a
+    gallery updates the old gallery as well as the new one.
+    """
+    keys = await affected_pages(db, **ids)
+    yield
+    await db.flush()
+    await refresh_pages(db, keys | await affected_pages(db, **ids))
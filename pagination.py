@@ -0,0 +1,25 @@
+import base64
+import json
+from datetime import date
+
+from fastapi import HTTPException
+
+# Cursors are opaque to clients: a url-safe base64 encoded JSON list holding
+# the sort key of the last row of the previous page.
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(
+        [value.isoformat() if isinstance(value, date) else value for value in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
@@ -0,0 +1,35 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PeriodicRefresh:
+    """Runs refresh() every interval seconds in a background task.
+
+    Subclasses keep their own snapshot and make refresh() cheap when
+    nothing changed, failures are logged and retried on the next tick.
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._task = None
+
+    async def refresh(self, force: bool = False):
+        raise NotImplementedError
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("periodic refresh of %s failed", type(self).__name__)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
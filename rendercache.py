@@ -0,0 +1,90 @@
+import asyncio
+import os
+from pathlib import Path
+
+from decouple import config
+from starlette.concurrency import run_in_threadpool
+
+RENDER_CACHE_DIR = Path(config("RENDER_CACHE_DIR", default="./uploads/cache"))
+RENDER_CACHE_MAX_BYTES = config("RENDER_CACHE_MAX_BYTES", default=1024 * 1024 * 1024, cast=int)
+
+class RenderCache:
+    """Content-keyed on-disk cache of rendered images with a byte cap.
+
+    File modification times double as the LRU clock: hits touch the file and
+    eviction removes the oldest files first until the cache fits again.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._pending = {}
+
+    def path_for(self, key: str, extension: str) -> Path:
+        return self.directory / key[:2] / f"{key}.{extension}"
+
+    async def get_or_render(self, key: str, extension: str, render) -> Path:
+        path = self.path_for(key, extension)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        # Identical concurrent requests wait on the same render
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(key, path, render))
+            self._pending[key] = task
+        return await asyncio.shield(task)
+
+    async def _render(self, key: str, path: Path, render) -> Path:
+        try:
+            await render(path)
+            await self._account(path)
+            return path
+        finally:
+            self._pending.pop(key, None)
+
+    async def _account(self, added: Path):
+        if self._size is None:
+            self._size = await run_in_threadpool(self._disk_usage)
+        else:
+            self._size += added.stat().st_size
+        if self._size > self.max_bytes:
+            self._size = await run_in_threadpool(self._evict, added)
+
+    def _entries(self):
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and not entry.name.startswith("."):
+                        yield entry
+
+    def _disk_usage(self) -> int:
+        if not self.directory.exists():
+            return 0
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self, keep: Path) -> int:
+        # Trim to 90% of the cap so we don't evict again on the next render,
+        # the file that is about to be served is never a candidate
+        entries = sorted(
+            ((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._entries())
+        )
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for _, entry_size, entry_path in entries:
+            if size <= target:
+                break
+            if entry_path == str(keep):
+                continue
+            try:
+                os.remove(entry_path)
+                size -= entry_size
+            except FileNotFoundError:
+                pass
+        return size
+
+render_cache = RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from decouple import config
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# "memory" keeps entries in this process, "redis" shares them between workers
+RESPONSE_CACHE_BACKEND = config("RESPONSE_CACHE_BACKEND", default="memory")
+RESPONSE_CACHE_URL = config("RESPONSE_CACHE_URL", default="redis://localhost:6379/0")
+RESPONSE_CACHE_MAX_ENTRIES = config("RESPONSE_CACHE_MAX_ENTRIES", default=1024, cast=int)
+# Seconds, 0 keeps entries until they are evicted or invalidated
+RESPONSE_CACHE_TTL = config("RESPONSE_CACHE_TTL", default=300, cast=int)
+
+class MemoryBackend:
+    """Bounded LRU of rendered bodies plus the tag version counters."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        body, expires = entry
+        if expires and expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return body
+
+    async def set(self, key: str, body: bytes, ttl: int):
+        self._entries[key] = (body, time.monotonic() + ttl if ttl else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def versions(self, tags) -> list:
+        return [self._versions.get(tag, 0) for tag in tags]
+
+    async def bump(self, tags):
+        for tag in tags:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+
+class RedisBackend:
+    """Shared backend, eviction is left to the server's maxmemory policy."""
+
+    def __init__(self, url: str):
+        # Only needed when the shared backend is configured
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+
+    def __len__(self):
+        return 0
+
+    async def get(self, key: str):
+        return await self._redis.get(f"response:{key}")
+
+    async def set(self, key: str, body: bytes, ttl: int):
+        await self._redis.set(f"response:{key}", body, ex=ttl or None)
+
+    async def versions(self, tags) -> list:
+        values = await self._redis.mget([f"response-tag:{tag}" for tag in tags])
+        return [int(value or 0) for value in values]
+
+    async def bump(self, tags):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(f"response-tag:{tag}")
+            await pipe.execute()
+
+class ResponseCache:
+    """Read-through cache of JSON responses keyed by route and query string.
+
+    Every key embeds the current version of its tags, invalidating a tag
+    bumps the version so older entries are never read again and age out of
+    the backend. A load that races an invalidation stores under the old
+    version and cannot serve stale data afterwards.
+    """
+
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def key_for(self, request: Request, tags, etag: str = None) -> str:
+        query = "&".join(sorted(f"{name}={value}" for name, value in request.query_params.multi_items()))
+        versions = await self.backend.versions(tags)
+        tag_part = ",".join(f"{tag}:{version}" for tag, version in zip(tags, versions))
+        return f"{request.url.path}?{query}|{tag_part}|{etag or ''}"
+
+    async def get_or_load(self, request: Request, tags, load, headers: dict = None) -> Response:
+        """Serve request from the cache, calling load() to build it on a miss.
+
+        load returns anything jsonable_encoder accepts, tags name the entity
+        types the response is built from. headers are added to the response,
+        their ETag is part of the key: the table versions it comes from also
+        change on writes whose invalidation never reaches this process, such
+        as those of a separate worker or another API process.
+        """
+        key = await self.key_for(request, tags, (headers or {}).get("ETag"))
+        body = await self.backend.get(key)
+        if body is not None:
+            self.hits += 1
+            return self._response(body, "HIT", headers)
+
+        # Identical concurrent misses wait on the same load
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, load))
+            self._pending[key] = task
+        else:
+            self.coalesced += 1
+        return self._response(await asyncio.shield(task), "MISS", headers)
+
+    async def _load(self, key: str, load) -> bytes:
+        try:
+            body = JSONResponse(jsonable_encoder(await load())).body
+            await self.backend.set(key, body, self.ttl)
+            return body
+        finally:
+            self._pending.pop(key, None)
+
+    async def invalidate(self, *tags):
+        """Drop every cached response built from any of tags, call after commit."""
+        self.invalidations += 1
+        await self.backend.bump(tags)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+        }
+
+    @staticmethod
+    def _response(body: bytes, status: str, headers: dict = None) -> Response:
+        return Response(body, media_type="application/json", headers={**(headers or {}), "X-Cache": status})
+
+def make_backend():
+    if RESPONSE_CACHE_BACKEND == "redis":
+        return RedisBackend(RESPONSE_CACHE_URL)
+    return MemoryBackend(RESPONSE_CACHE_MAX_ENTRIES)
+
+response_cache = ResponseCache(make_backend(), RESPONSE_CACHE_TTL)
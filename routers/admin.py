@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException
 from starlette.middleware.cors import CORSMiddleware
-from database import SessionLocal
-from sqlalchemy.orm import Session
+from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import UserChangePassword, UserEditSchema, UserRegisterSchema, AdminDetails
 import services
 import fastapi.security as _security
@@ -12,16 +13,12 @@ import shutil
 from pathlib import Path
 from typing import Annotated
 from PIL import Image
-import passlib.hash as _hash
+from storage import UPLOAD_DIR, save_upload
+from cleanup import schedule_removal
+from responsecache import response_cache
+from stats import dashboard_stats
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 router = APIRouter(
     prefix="/admin",
     tags=["admin"],
@@ -30,28 +27,9 @@ router = APIRouter(
 
 user_dependencies = Annotated[dict, Depends(services.get_current_user)]
 
-# Set up the upload directory
-UPLOAD_DIR = Path("./uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {"jpeg", "jpg", "png", "gif"}
-
-# Utility function to check file type
-def check_file_type(file: UploadFile) -> bool:
-    try:
-        # Open the file using PIL to check if it is a valid image
-        image = Image.open(file.file)
-        if image.format.lower() in ALLOWED_EXTENSIONS:
-            file.file.seek(0)  # Reset file pointer to the beginning
-            return True
-    except Exception:
-        return False
-    return False
-
 @router.post("/register") # for registration, adds new user to db, returns token
 async def create_user(
-    user: UserRegisterSchema, db: Session = Depends(get_db)
+    user: UserRegisterSchema, db: AsyncSession = Depends(get_db)
 ):
     db_user = await services.get_user_by_email(user.username, db)
     if db_user:
@@ -64,7 +42,7 @@ async def create_user(
 @router.post("/login") # for admin login
 async def generate_token(
     form_data: _security.OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(services.get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await services.authenticate_user(form_data.username, form_data.password, db)
     if not user:
@@ -78,8 +56,8 @@ async def get_user(user: AdminDetails = Depends(services.get_current_user)):
     return user
 
 @router.put("/update/{user_id}")
-async def update_user(user_id: int, user: UserEditSchema, db: Session = Depends(get_db), user2: AdminDetails = Depends(services.get_current_user)):
-    new_user = db.query(User).filter(User.id_user == user_id).first()
+async def update_user(user_id: int, user: UserEditSchema, db: AsyncSession = Depends(get_db), user2: AdminDetails = Depends(services.get_current_user)):
+    new_user = await db.scalar(select(User).where(User.id_user == user_id))
     if not new_user:
         raise HTTPException(status_code=404, detail="User not found")
     new_user.username = user.username
@@ -88,58 +66,65 @@ async def update_user(user_id: int, user: UserEditSchema, db: Session = Depends(
     new_user.instagram_url = user.instagram_url
     new_user.facebook_url  = user.facebook_url
     new_user.linkedin_url = user.linkedin_url
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    services.invalidate_user(new_user.id_user)
     return new_user
 
 @router.put('/update/password/{user_id}')
 async def update_user_password(
     user_id: int, 
     changeDetails: UserChangePassword, 
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_db), 
     user: AdminDetails = Depends(services.get_current_user)
 ):
-    new_user = db.query(User).filter(User.id_user == user_id).first()
+    new_user = await db.scalar(select(User).where(User.id_user == user_id))
     if not new_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Verify current password
-    if not _hash.bcrypt.verify(changeDetails.current_password, new_user.password):
+    verified, _ = await services.verify_password(changeDetails.current_password, new_user.password)
+    if not verified:
         raise HTTPException(status_code=401, detail="Invalid password")
     
     # Update password
-    new_user.password = _hash.bcrypt.hash(changeDetails.new_password)
-    db.commit()
-    db.refresh(new_user)
+    new_user.password = await services.hash_password(changeDetails.new_password)
+    new_user.token_version = (new_user.token_version or 0) + 1
+    await db.commit()
+    await db.refresh(new_user)
+    services.invalidate_user(new_user.id_user, new_user.token_version)
     return {"msg": "Password updated successfully"}
 
 @router.put('/update/photo/{user_id}')
 async def update_user_photo(
     user: user_dependencies,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    new_user = db.query(User).filter(User.id_user == user.id_user).first()
+    new_user = await db.scalar(select(User).where(User.id_user == user.id_user))
     if not new_user:
         raise HTTPException(status_code=404, detail="User not found")
-    if not check_file_type(file):
-        raise HTTPException(status_code=400, detail="Error: Images Only!")
-    
-    photo_name = "admin" + str(new_user.id_user) + Path(file.filename).suffix
-    
-    # Ensure file path is saved as a string
-    file_path = UPLOAD_DIR / photo_name
 
-    # Save the file
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stream the file to disk, rejects anything that is not an image
+    stored = await save_upload(file, UPLOAD_DIR, "admin" + str(new_user.id_user))
+    file_path = stored.path
 
     # Convert file_path to a relative path string with the desired format
     relative_path = f"/{file_path.as_posix()}"
+    if new_user.photo_path and new_user.photo_path != relative_path:
+        # A different extension leaves the previous picture behind
+        await schedule_removal(db, paths=[new_user.photo_path])
     new_user.photo_path = relative_path
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    services.invalidate_user(new_user.id_user)
     
     return new_user
 
+@router.get("/stats") # dashboard totals, per category/gallery/month counts and storage bytes
+async def get_stats(user: user_dependencies):
+    return await dashboard_stats.get()
 
+@router.get("/cache/stats") # hit/miss counters of the response cache in this worker
+async def get_cache_stats(user: user_dependencies):
+    return response_cache.stats()
@@ -1,25 +1,23 @@
 from typing import Annotated
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException, Request
 from starlette.middleware.cors import CORSMiddleware
-from database import SessionLocal
-from sqlalchemy.orm import Session
+from database import get_db
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import UserRegisterSchema, CategoryUpload
 import services
 import fastapi.security as _security
 from models import Photo, CategoriesAndPhotos, Category
-from schemas import PhotoUpload, CategoriesAndPhotoUpload
+from schemas import PhotoUpload, CategoriesAndPhotoUpload, PhotoMove, PhotoOrderUpdate
+from links import apply_order, move_link, ordered_photo_ids
 from fastapi.responses import JSONResponse
+from responsecache import response_cache
+from versions import conditional_on
+import pages
 import shutil
 from pathlib import Path
 from PIL import Image
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 router = APIRouter(
     prefix="/admin/category",
     tags=["admin category"],
@@ -29,40 +27,80 @@ router = APIRouter(
 user_dependencies = Annotated[dict, Depends(services.get_current_user)]
 
 @router.get('/all')
-async def get_all_categories(user: user_dependencies, db: SessionLocal = Depends(get_db)):
-    categories = db.query(Category).all()
-    return categories
+async def get_all_categories(request: Request, user: user_dependencies, validator: dict = Depends(conditional_on("categories")), db: AsyncSession = Depends(get_db)):
+    async def load():
+        return (await db.scalars(select(Category))).all()
+    return await response_cache.get_or_load(request, ("categories",), load, validator)
 
 @router.get('/count')
-async def get_count_categories(db: SessionLocal = Depends(get_db)):
-    categories = db.query(Category).count()
+async def get_count_categories(validator: dict = Depends(conditional_on("categories")), db: AsyncSession = Depends(get_db)):
+    categories = await db.scalar(select(func.count()).select_from(Category))
     return categories
 
 @router.post("/add")
-async def add_category(category: CategoryUpload, user: user_dependencies,  db: SessionLocal = Depends(get_db)):
+async def add_category(category: CategoryUpload, user: user_dependencies,  db: AsyncSession = Depends(get_db)):
     new_category = Category(
         category_name = category.category_name
     )
     db.add(new_category)
-    db.commit()
-    db.refresh(new_category)
+    await db.flush()
+    await pages.refresh_affected(db, category_ids=[new_category.id_category])
+    await db.commit()
+    await response_cache.invalidate("categories")
+    await db.refresh(new_category)
     return {"id_category": new_category.id_category}
 
 @router.put("/update/{category_id}")
-async def update_category(category_id: int, categoryUpload: CategoryUpload, user: user_dependencies, db: SessionLocal = Depends(get_db)):
-    category = db.query(Category).filter(Category.id_category == category_id).first()
+async def update_category(category_id: int, categoryUpload: CategoryUpload, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    category = await db.scalar(select(Category).where(Category.id_category == category_id))
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    category.category_name = categoryUpload.category_name
-    db.commit()
-    db.refresh(category)
+    async with pages.refreshing(db, category_ids=[category_id]):
+        category.category_name = categoryUpload.category_name
+    await db.commit()
+    await response_cache.invalidate("categories")
+    await db.refresh(category)
     return category
 
 @router.delete("/delete/{category_id}")
-async def delete_category(category_id: int, user: user_dependencies, db: SessionLocal = Depends(get_db)):
-    category = db.query(Category).filter(Category.id_category == category_id).first()
+async def delete_category(category_id: int, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    category = await db.scalar(select(Category).where(Category.id_category == category_id))
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    db.delete(category)
-    db.commit()
-    return {"message": "Category deleted successfully"}
\ No newline at end of file
+    async with pages.refreshing(db, category_ids=[category_id]):
+        await db.delete(category)
+    await db.commit()
+    # Links to the category go with it
+    await response_cache.invalidate("categories", "photos")
+    return {"message": "Category deleted successfully"}
+
+async def reordered(db: AsyncSession, category_id: int) -> dict:
+    # The category page is rebuilt in the same transaction
+    await pages.refresh_affected(db, category_ids=[category_id])
+    await db.commit()
+    await response_cache.invalidate("categories")
+    return {"id_category": category_id, "photo_ids": await ordered_photo_ids(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, category_id)}
+
+@router.put("/{category_id}/order")
+async def set_category_order(category_id: int, request: PhotoOrderUpdate, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    if not await db.scalar(select(Category.id_category).where(Category.id_category == category_id)):
+        raise HTTPException(status_code=404, detail="Category not found")
+    photo_ids = list(dict.fromkeys(request.photo_ids))
+    current = set(await ordered_photo_ids(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, category_id))
+    missing = [photo_id for photo_id in photo_ids if photo_id not in current]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Photos not in the category: {missing}")
+    await apply_order(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, category_id, photo_ids)
+    return await reordered(db, category_id)
+
+@router.put("/{category_id}/order/{photo_id}")
+async def move_category_photo(category_id: int, photo_id: int, request: PhotoMove, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    # One drag in the UI, only the moved photo's row is written
+    anchor_id = request.before if request.before is not None else request.after
+    if anchor_id == photo_id:
+        raise HTTPException(status_code=400, detail="A photo cannot be moved next to itself")
+    found = set(await db.scalars(select(CategoriesAndPhotos.id_photo).where(CategoriesAndPhotos.id_category == category_id, CategoriesAndPhotos.id_photo.in_([photo_id, anchor_id]))))
+    if len(found) < 2:
+        raise HTTPException(status_code=404, detail="Photo not in the category")
+    await move_link(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, category_id, photo_id, before=request.before, after=request.after)
+    return await reordered(db, category_id)
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, HTTPException, Depends, Path
+from database import get_db
+from models import FeaturedPhoto, Photo
+from schemas import FeaturedPhotosUpdate
+from featured import featured_snapshot
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated
+import services
+import pages
+
+router = APIRouter(
+    prefix="/admin/featured",
+    tags=["admin featured"],
+    responses={404: {"description": "Not found"}},
+)
+
+user_dependencies = Annotated[dict, Depends(services.get_current_user)]
+featured_type_path = Path(..., min_length=1, max_length=20)
+
+async def featured_ids(db: AsyncSession, featured_type: str) -> list:
+    return (await db.scalars(
+        select(FeaturedPhoto.id_photo)
+        .where(FeaturedPhoto.featured_type == featured_type)
+        .order_by(FeaturedPhoto.position, FeaturedPhoto.id_photo)
+    )).all()
+
+async def save_featured(db: AsyncSession, featured_type: str):
+    # The featured page is rebuilt in the same transaction, the snapshot of
+    # this worker right after commit, other workers follow on their next check
+    await pages.refresh_affected(db, featured_types=[featured_type])
+    await db.commit()
+    await featured_snapshot.refresh(force=True)
+    return {"featured_type": featured_type, "photo_ids": await featured_ids(db, featured_type)}
+
+@router.get("/{featured_type}")
+async def get_featured(user: user_dependencies, featured_type: str = featured_type_path, db: AsyncSession = Depends(get_db)):
+    return {"featured_type": featured_type, "photo_ids": await featured_ids(db, featured_type)}
+
+@router.put("/{featured_type}")
+async def set_featured(user: user_dependencies, request: FeaturedPhotosUpdate, featured_type: str = featured_type_path, db: AsyncSession = Depends(get_db)):
+    # Replaces the whole list, sending the same ids in another order reorders it
+    photo_ids = list(dict.fromkeys(request.photo_ids))
+    if photo_ids:
+        found = set(await db.scalars(select(Photo.id_photo).where(Photo.id_photo.in_(photo_ids))))
+        missing = [photo_id for photo_id in photo_ids if photo_id not in found]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Photos not found: {missing}")
+
+    await db.execute(delete(FeaturedPhoto).where(FeaturedPhoto.featured_type == featured_type))
+    if photo_ids:
+        await db.execute(insert(FeaturedPhoto), [
+            {"id_photo": photo_id, "featured_type": featured_type, "position": position}
+            for position, photo_id in enumerate(photo_ids)
+        ])
+    return await save_featured(db, featured_type)
+
+@router.post("/{featured_type}/{photo_id}")
+async def add_featured(user: user_dependencies, photo_id: int, featured_type: str = featured_type_path, db: AsyncSession = Depends(get_db)):
+    if not await db.scalar(select(Photo.id_photo).where(Photo.id_photo == photo_id)):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    exists = await db.scalar(select(FeaturedPhoto.id_photo).where(
+        FeaturedPhoto.featured_type == featured_type, FeaturedPhoto.id_photo == photo_id
+    ))
+    if exists:
+        return {"featured_type": featured_type, "photo_ids": await featured_ids(db, featured_type)}
+
+    # Appended after the current last photo
+    last = await db.scalar(select(func.max(FeaturedPhoto.position)).where(FeaturedPhoto.featured_type == featured_type))
+    await db.execute(insert(FeaturedPhoto), [
+        {"id_photo": photo_id, "featured_type": featured_type, "position": 0 if last is None else last + 1}
+    ])
+    return await save_featured(db, featured_type)
+
+@router.delete("/{featured_type}/{photo_id}")
+async def remove_featured(user: user_dependencies, photo_id: int, featured_type: str = featured_type_path, db: AsyncSession = Depends(get_db)):
+    removed = (await db.execute(delete(FeaturedPhoto).where(
+        FeaturedPhoto.featured_type == featured_type, FeaturedPhoto.id_photo == photo_id
+    ))).rowcount
+    if not removed:
+        raise HTTPException(status_code=404, detail="Featured photo not found")
+    return await save_featured(db, featured_type)
+
+@router.delete("/{featured_type}")
+async def clear_featured(user: user_dependencies, featured_type: str = featured_type_path, db: AsyncSession = Depends(get_db)):
+    await db.execute(delete(FeaturedPhoto).where(FeaturedPhoto.featured_type == featured_type))
+    return await save_featured(db, featured_type)
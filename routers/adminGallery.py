@@ -1,20 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException
-from database import SessionLocal
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException, Query, Request
+from database import get_db
 from models import Gallery, Photo, CategoriesAndPhotos, Category, GalleryAndPhotos
-from schemas import GalleryAndPhotosBase, GalleryUpload, PhotoUpload, CategoriesAndPhotoUpload, GalleryAndPhotoUpload
+from schemas import GalleryAndPhotosBase, GalleryUpload, PhotoUpload, CategoriesAndPhotoUpload, GalleryAndPhotoUpload, PhotoMove, PhotoOrderUpdate
+from links import apply_order, move_link, ordered_photo_ids
 import services
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 import shutil
 from pathlib import Path
 from PIL import Image
-from sqlalchemy.orm import Session
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from pagination import encode_cursor, decode_cursor
+from responsecache import response_cache
+from versions import conditional_on
+import pages
 
 router = APIRouter(
     prefix="/admin/gallery",
@@ -24,53 +24,155 @@ router = APIRouter(
 
 user_dependencies = Annotated[dict, Depends(services.get_current_user)]
 
-@router.get("/all-photos-and-gallery", response_model=List[GalleryAndPhotosBase]) # returns all photos and gallery but needs fixed
-def get_all_photos_and_galleries(user: user_dependencies, db: Session = Depends(get_db)):
-    photos = (
-        db.query(GalleryAndPhotos)
+@router.get("/all-photos-and-gallery", response_model=List[GalleryAndPhotosBase], deprecated=True) # one row per link, use /with-photos
+async def get_all_photos_and_galleries(
+    user: user_dependencies,
+    validator: dict = Depends(conditional_on("gallery", "gallery_and_photos", "photos", "photo_variants")),
+    db: AsyncSession = Depends(get_db)):
+    photos = (await db.scalars(
+        select(GalleryAndPhotos)
         .join(Gallery, GalleryAndPhotos.id_gallery == Gallery.id_gallery)
         .outerjoin(Photo, GalleryAndPhotos.id_photo == Photo.id_photo)
-        .all()
-    )
+        .options(selectinload(GalleryAndPhotos.gallery), selectinload(GalleryAndPhotos.photo))
+    )).all()
 
     return photos  # This will automatically convert using Pydantic
 
 
+@router.get("/with-photos")
+async def get_galleries_with_photos(
+    request: Request,
+    user: user_dependencies,
+    limit: int = Query(20, ge=1, le=100),
+    photos_per_gallery: int = Query(12, ge=0, le=100),
+    cursor: Optional[str] = None,
+    validator: dict = Depends(conditional_on("gallery", "gallery_and_photos", "photos", "photo_variants")),
+    db: AsyncSession = Depends(get_db)):
+    """Galleries by id, each once with its first photos and how many it has."""
+    query = select(Gallery).order_by(Gallery.id_gallery).limit(limit + 1)
+    if cursor:
+        try:
+            last_id = int(decode_cursor(cursor, 1)[0])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(Gallery.id_gallery > last_id)
+
+    async def load():
+        galleries = (await db.scalars(query)).all()
+        next_cursor = None
+        if len(galleries) > limit:
+            galleries = galleries[:limit]
+            next_cursor = encode_cursor([galleries[-1].id_gallery])
+        items = {
+            gallery.id_gallery: {"id_gallery": gallery.id_gallery, "gallery_name": gallery.gallery_name, "photo_count": 0, "photos": []}
+            for gallery in galleries
+        }
+        if not items:
+            return {"items": [], "next_cursor": None}
+
+        # Photos are numbered within their gallery in position order, only the
+        # first photos_per_gallery of each leave the database, the window
+        # count carries the total along
+        ranked = (
+            select(
+                GalleryAndPhotos.id_gallery,
+                GalleryAndPhotos.id_photo,
+                func.row_number().over(partition_by=GalleryAndPhotos.id_gallery, order_by=(GalleryAndPhotos.position, GalleryAndPhotos.id_photo)).label("rank"),
+                func.count().over(partition_by=GalleryAndPhotos.id_gallery).label("total"),
+            )
+            .join(Photo, Photo.id_photo == GalleryAndPhotos.id_photo)
+            .where(GalleryAndPhotos.id_gallery.in_(items))
+            .subquery()
+        )
+        rows = await db.execute(
+            select(ranked.c.id_gallery, ranked.c.total, Photo)
+            .join(Photo, Photo.id_photo == ranked.c.id_photo)
+            .where(ranked.c.rank <= max(photos_per_gallery, 1))
+            .order_by(ranked.c.id_gallery, ranked.c.rank)
+        )
+        for id_gallery, total, photo in rows:
+            items[id_gallery]["photo_count"] = total
+            if photos_per_gallery:
+                items[id_gallery]["photos"].append(pages.photo_summary(photo))
+        return {"items": list(items.values()), "next_cursor": next_cursor}
+
+    return await response_cache.get_or_load(request, ("galleries", "photos"), load, validator)
+
 @router.get('/all')
-async def get_all_galleries(user: user_dependencies, db: Session = Depends(get_db)):
-    gallery = db.query(Gallery).all()
-    return gallery
+async def get_all_galleries(http_request: Request, user: user_dependencies, validator: dict = Depends(conditional_on("gallery")), db: AsyncSession = Depends(get_db)):
+    async def load():
+        return (await db.scalars(select(Gallery))).all()
+    return await response_cache.get_or_load(http_request, ("galleries",), load, validator)
 
 @router.get('/count')
-async def get_count_galleries( db: Session = Depends(get_db)):
-    gallery = db.query(Gallery).count()
+async def get_count_galleries(validator: dict = Depends(conditional_on("gallery")), db: AsyncSession = Depends(get_db)):
+    gallery = await db.scalar(select(func.count()).select_from(Gallery))
     return gallery
 
 @router.post('/add')
-def add_gallery(user: user_dependencies, request: GalleryUpload, db: Session = Depends(get_db)):
+async def add_gallery(user: user_dependencies, request: GalleryUpload, db: AsyncSession = Depends(get_db)):
     new_gallery = Gallery(
         gallery_name = request.gallery_name
     )
     db.add(new_gallery)
-    db.commit()
-    db.refresh(new_gallery)
+    await db.flush()
+    await pages.refresh_affected(db, gallery_ids=[new_gallery.id_gallery])
+    await db.commit()
+    await response_cache.invalidate("galleries")
+    await db.refresh(new_gallery)
     return new_gallery
 
 @router.put('/update/{gallery_id}')
-def update_gallery(user: user_dependencies, gallery_id: int, request: GalleryUpload, db: Session = Depends(get_db)):
-    gallery = db.query(Gallery).filter(Gallery.id_gallery == gallery_id).first()
+async def update_gallery(user: user_dependencies, gallery_id: int, request: GalleryUpload, db: AsyncSession = Depends(get_db)):
+    gallery = await db.scalar(select(Gallery).where(Gallery.id_gallery == gallery_id))
     if not gallery:
         raise HTTPException(status_code=404, detail="Gallery not found")
-    gallery.gallery_name = request.gallery_name
-    db.commit()
-    db.refresh(gallery)
+    async with pages.refreshing(db, gallery_ids=[gallery_id]):
+        gallery.gallery_name = request.gallery_name
+    await db.commit()
+    await response_cache.invalidate("galleries")
+    await db.refresh(gallery)
     return gallery
 
 @router.delete('/delete/{gallery_id}')
-def delete_gallery(user: user_dependencies, gallery_id: int, db: Session = Depends(get_db)):
-    gallery = db.query(Gallery).filter(Gallery.id_gallery == gallery_id).first()
+async def delete_gallery(user: user_dependencies, gallery_id: int, db: AsyncSession = Depends(get_db)):
+    gallery = await db.scalar(select(Gallery).where(Gallery.id_gallery == gallery_id))
     if not gallery:
         raise HTTPException(status_code=404, detail="Gallery not found")
-    db.delete(gallery)
-    db.commit()
-    return {"message": "Gallery deleted successfully"}
\ No newline at end of file
+    async with pages.refreshing(db, gallery_ids=[gallery_id]):
+        await db.delete(gallery)
+    await db.commit()
+    # Links to the gallery go with it
+    await response_cache.invalidate("galleries", "photos")
+    return {"message": "Gallery deleted successfully"}
+
+async def reordered(db: AsyncSession, gallery_id: int) -> dict:
+    # The gallery page is rebuilt in the same transaction
+    await pages.refresh_affected(db, gallery_ids=[gallery_id])
+    await db.commit()
+    await response_cache.invalidate("galleries")
+    return {"id_gallery": gallery_id, "photo_ids": await ordered_photo_ids(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, gallery_id)}
+
+@router.put("/{gallery_id}/order")
+async def set_gallery_order(gallery_id: int, request: PhotoOrderUpdate, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    if not await db.scalar(select(Gallery.id_gallery).where(Gallery.id_gallery == gallery_id)):
+        raise HTTPException(status_code=404, detail="Gallery not found")
+    photo_ids = list(dict.fromkeys(request.photo_ids))
+    current = set(await ordered_photo_ids(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, gallery_id))
+    missing = [photo_id for photo_id in photo_ids if photo_id not in current]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Photos not in the gallery: {missing}")
+    await apply_order(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, gallery_id, photo_ids)
+    return await reordered(db, gallery_id)
+
+@router.put("/{gallery_id}/order/{photo_id}")
+async def move_gallery_photo(gallery_id: int, photo_id: int, request: PhotoMove, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    # One drag in the UI, only the moved photo's row is written
+    anchor_id = request.before if request.before is not None else request.after
+    if anchor_id == photo_id:
+        raise HTTPException(status_code=400, detail="A photo cannot be moved next to itself")
+    found = set(await db.scalars(select(GalleryAndPhotos.id_photo).where(GalleryAndPhotos.id_gallery == gallery_id, GalleryAndPhotos.id_photo.in_([photo_id, anchor_id]))))
+    if len(found) < 2:
+        raise HTTPException(status_code=404, detail="Photo not in the gallery")
+    await move_link(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, gallery_id, photo_id, before=request.before, after=request.after)
+    return await reordered(db, gallery_id)
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from database import get_db, session_scope
+from models import Job
+from jobs import FINISHED, JOB_POLL_SECONDS, job_state
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated
+import services
+import asyncio
+import json
+
+router = APIRouter(
+    prefix="/admin/jobs",
+    tags=["admin jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+user_dependencies = Annotated[dict, Depends(services.get_current_user)]
+
+async def load_job(db: AsyncSession, id_job: int):
+    return await db.scalar(select(Job).where(Job.id_job == id_job))
+
+@router.get("/{id_job}")
+async def get_job(id_job: int, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    job = await load_job(db, id_job)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_state(job)
+
+@router.get("/{id_job}/events")
+async def job_events(id_job: int, request: Request, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    """Server-sent events with the job's state, sent on every change until it finishes."""
+    if not await load_job(db, id_job):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last = None
+        while not await request.is_disconnected():
+            # A short session per poll, the stream may stay open for minutes
+            async with session_scope() as poll_db:
+                job = await load_job(poll_db, id_job)
+            if job is None:
+                return
+            state = jsonable_encoder(job_state(job))
+            if state != last:
+                yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+                last = state
+            if job.status in FINISHED:
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,22 +1,35 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException
-from sqlalchemy import asc
-from database import SessionLocal
+from fastapi import APIRouter, HTTPException, Depends, File, Form, UploadFile, HTTPException, Query, Request
+from sqlalchemy import asc, and_, or_, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from database import get_db
 from models import Gallery, Photo, CategoriesAndPhotos, Category, GalleryAndPhotos
-from schemas import PhotoUpload, CategoriesAndPhotoUpload, GalleryAndPhotoUpload
-from sqlalchemy.orm import Session, joinedload
+from schemas import PhotoUpload, CategoriesAndPhotoUpload, GalleryAndPhotoUpload, BulkPhotoMetadata, split_ids, parse_date
+from schemas import CategoriesAndPhotoUpdate, GalleryAndPhotoUpdate, PhotosCategoriesUpdate, PhotosGalleriesUpdate, BulkPhotoSelection, BulkPhotoUpdate
+from links import insert_links, missing_ids, replace_links
+import pages
+from sqlalchemy.orm import selectinload
+from pagination import encode_cursor, decode_cursor
+from responsecache import response_cache
+from versions import conditional_on
+import jobs
+import ingest  # registers the photos.process job handler
+from cleanup import schedule_removal
+from storage import add_blobs, save_blob, store_content, release_blob, release_blobs, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE
 import services
-from typing import Annotated
+from collections import Counter
+from datetime import date
+from decouple import config
+from typing import Annotated, List, Optional
+import asyncio
+import json
 import shutil
+import tempfile
+import time
+import zipfile
 from pathlib import Path
 from PIL import Image
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 router = APIRouter(
     prefix="/admin/photos",
     tags=["admin photos"],
@@ -25,24 +38,17 @@ router = APIRouter(
 
 user_dependencies = Annotated[dict, Depends(services.get_current_user)]
 
-# Set up the upload directory
-UPLOAD_DIR = Path("./uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {"jpeg", "jpg", "png", "gif"}
+BULK_CONCURRENCY = config("BULK_CONCURRENCY", default=4, cast=int)
+# Bulk edits rebuild the pages of every photo they touch within the request
+BULK_EDIT_MAX_PHOTOS = config("BULK_EDIT_MAX_PHOTOS", default=10000, cast=int)
+ZIP_MAGIC = b"PK\x03\x04"
+# Tables a serialized photo is built from, for conditional GETs
+PHOTO_TABLES = ("photos", "photo_variants", "photo_exif", "categories_and_photos", "categories", "gallery_and_photos", "gallery")
 
-# Utility function to check file type
-def check_file_type(file: UploadFile) -> bool:
-    try:
-        # Open the file using PIL to check if it is a valid image
-        image = Image.open(file.file)
-        if image.format.lower() in ALLOWED_EXTENSIONS:
-            file.file.seek(0)  # Reset file pointer to the beginning
-            return True
-    except Exception:
-        return False
-    return False
+async def check_ids(db: AsyncSession, key, ids: list, label: str, status_code: int = 404):
+    missing = await missing_ids(db, key, ids)
+    if missing:
+        raise HTTPException(status_code=status_code, detail=f"{label} not found: {missing}")
 
 # Endpoint to upload an image
 @router.post("/upload")
@@ -52,159 +58,445 @@ async def upload_file(
     request: PhotoUpload = Depends(),
     categories: CategoriesAndPhotoUpload = Depends(),
     gallery: GalleryAndPhotoUpload = Depends(),
-    db: SessionLocal = Depends(get_db)):
-    # Check if the file is a valid image
-    if not check_file_type(file):
-        raise HTTPException(status_code=400, detail="Error: Images Only!")
-    
-    # Generate a unique file name
-    file_extension = Path(file.filename).suffix
-    
-    # path where file is saved is '/uploads/<file_name>' :
-    file_name = f"{file.filename.split('.')[0]}-{Path(file.filename).stem}-{Path(file.filename).suffix}"
-    file_path = UPLOAD_DIR / file_name
-
-    # Save the file
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    db: AsyncSession = Depends(get_db)):
+    category_ids = list(dict.fromkeys(split_ids(categories.list_id_category)))
+    gallery_ids = list(dict.fromkeys(split_ids(gallery.list_id_gallery)))
+    # Checked before the file is stored, unknown ids would fail on the foreign keys
+    await check_ids(db, Category.id_category, category_ids, "Categories", 400)
+    await check_ids(db, Gallery.id_gallery, gallery_ids, "Galleries", 400)
+
+    # Store the file under its content hash, identical bytes are only kept once
+    blob, created = await save_blob(file, db)
 
     new_photo = Photo(
-        photo_path = f"/uploads/{file_name}",
+        photo_path = blob.blob_path,
+        blob_hash = blob.sha256,
         title = request.title,
         description = request.description,
         location = request.location,
-        date = request.date
+        date = parse_date(request.date)
     )
     db.add(new_photo)
-    db.commit()
-    db.refresh(new_photo)
-
-    if categories.list_id_category:  # Ensure it's not empty
-        categoriesList = categories.list_id_category.split(",")
-
-        for id_category in categoriesList:
-            new_category_and_photo = CategoriesAndPhotos(
-                id_photo = new_photo.id_photo,
-                id_category = int(id_category)
-            )
-            db.add(new_category_and_photo)
-            db.commit()
-            db.refresh(new_category_and_photo)
-
-    if gallery.list_id_gallery:  # Ensure it's not empty
-        galleryList = gallery.list_id_gallery.split(",")
-
-        for id_gallery in galleryList:
-            new_gallery_and_photo = GalleryAndPhotos(
-                id_photo = new_photo.id_photo,
-                id_gallery = int(id_gallery)
-            )
-            db.add(new_gallery_and_photo)
-            db.commit()
-            db.refresh(new_gallery_and_photo)
-
-    return {"id_photo": new_photo.id_photo}
+    await db.flush()
+
+    # Links and the processing job go into the same transaction as the photo
+    await insert_links(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, [
+        {"id_photo": new_photo.id_photo, "id_category": id_category}
+        for id_category in category_ids
+    ])
+    await insert_links(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, [
+        {"id_photo": new_photo.id_photo, "id_gallery": id_gallery}
+        for id_gallery in gallery_ids
+    ])
+    # Variants, placeholders and EXIF are left to a worker, the request
+    # returns as soon as the original is stored
+    job = await jobs.enqueue(db, "photos.process", {"photo_ids": [new_photo.id_photo]})
+    await pages.refresh_affected(db, photo_ids=[new_photo.id_photo])
+    await db.commit()
+    await response_cache.invalidate("photos")
+
+    return {"id_photo": new_photo.id_photo, "id_job": job.id_job}
+
+def extract_zip(archive) -> list:
+    """Copy the images of a ZIP archive into spooled files, skipping folders."""
+    entries = []
+    with zipfile.ZipFile(archive) as zip_file:
+        for info in zip_file.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or Path(name).name.startswith("."):
+                continue
+            if info.file_size > UPLOAD_MAX_BYTES:
+                entries.append((Path(name).name, HTTPException(status_code=413, detail="File too large")))
+                continue
+            spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE)
+            with zip_file.open(info) as member:
+                shutil.copyfileobj(member, spool, UPLOAD_CHUNK_SIZE)
+            spool.seek(0)
+            entries.append((Path(name).name, UploadFile(file=spool, filename=Path(name).name)))
+    return entries
+
+def bulk_metadata_for(metadata, index: int, filename: str, shared: BulkPhotoMetadata) -> BulkPhotoMetadata:
+    # Per-file metadata is a list in upload order or an object keyed by file name
+    entry = None
+    if isinstance(metadata, list) and index < len(metadata):
+        entry = metadata[index]
+    elif isinstance(metadata, dict):
+        entry = metadata.get(filename)
+    if not entry:
+        return shared
+    return shared.copy(update=BulkPhotoMetadata(**entry).dict(exclude_unset=True))
+
+def linked_ids(metadata, shared: BulkPhotoMetadata) -> tuple:
+    """Every category and gallery id a bulk upload links to, shared or per file."""
+    entries = metadata if isinstance(metadata, list) else list(metadata.values()) if isinstance(metadata, dict) else []
+    category_ids, gallery_ids = set(shared.list_id_category), set(shared.list_id_gallery)
+    for entry in entries:
+        try:
+            details = BulkPhotoMetadata(**entry)
+        except (ValueError, TypeError):
+            # Reported as that file's failure
+            continue
+        category_ids.update(details.list_id_category)
+        gallery_ids.update(details.list_id_gallery)
+    return sorted(category_ids), sorted(gallery_ids)
+
+@router.post("/bulk")
+async def bulk_upload(
+    user: user_dependencies,
+    files: List[UploadFile] = File(...),
+    metadata: Optional[str] = Form(None),
+    request: PhotoUpload = Depends(),
+    categories: CategoriesAndPhotoUpload = Depends(),
+    gallery: GalleryAndPhotoUpload = Depends(),
+    db: AsyncSession = Depends(get_db)):
+    started = time.perf_counter()
+    try:
+        metadata = json.loads(metadata) if metadata else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="metadata must be JSON")
+    shared = BulkPhotoMetadata(
+        **request.dict(),
+        list_id_category = categories.list_id_category,
+        list_id_gallery = gallery.list_id_gallery
+    )
+    # One unknown id would fail the whole batch on the foreign keys, after
+    # every file was written
+    category_ids, gallery_ids = linked_ids(metadata, shared)
+    await check_ids(db, Category.id_category, category_ids, "Categories", 400)
+    await check_ids(db, Gallery.id_gallery, gallery_ids, "Galleries", 400)
+
+    # ZIP archives are expanded in place, everything else is taken as an image
+    entries = []
+    for file in files:
+        head = await file.read(len(ZIP_MAGIC))
+        await file.seek(0)
+        if head == ZIP_MAGIC:
+            try:
+                entries.extend(await run_in_threadpool(extract_zip, file.file))
+            except zipfile.BadZipFile:
+                entries.append((file.filename, HTTPException(status_code=400, detail="Invalid ZIP archive")))
+        else:
+            entries.append((file.filename, file))
+
+    results = [{"filename": filename, "status": "pending"} for filename, _ in entries]
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def store(index: int, filename: str, upload):
+        result = results[index]
+        async with semaphore:
+            try:
+                if isinstance(upload, HTTPException):
+                    raise upload
+                details = bulk_metadata_for(metadata, index, filename, shared)
+                result["metadata"] = details
+                result["date"] = parse_date(details.date)
+                result["categories"] = details.list_id_category
+                result["galleries"] = details.list_id_gallery
+                result["stored"] = await store_content(upload)
+            except HTTPException as e:
+                result.update(status="failed", detail=e.detail)
+            except (ValueError, TypeError) as e:
+                result.update(status="failed", detail=str(e))
+            finally:
+                if isinstance(upload, UploadFile):
+                    await upload.close()
+
+    await asyncio.gather(*(store(index, filename, upload) for index, (filename, upload) in enumerate(entries)))
+    stored = [result for result in results if result["status"] == "pending"]
+
+    hashes = {result["stored"].sha256: result["stored"] for result in stored}
+
+    if stored:
+        # All rows are written with batched INSERTs in a single transaction
+        references = Counter(result["stored"].sha256 for result in stored)
+        # Content already stored only gains references
+        await db.execute(add_blobs(), [
+            {
+                "sha256": blob_hash,
+                "blob_path": f"/{hashes[blob_hash].path.as_posix()}",
+                "byte_size": hashes[blob_hash].byte_size,
+                "ref_count": count,
+            }
+            for blob_hash, count in sorted(references.items())
+        ])
+
+        photo_ids = (await db.scalars(
+            insert(Photo).returning(Photo.id_photo, sort_by_parameter_order=True),
+            [
+                {
+                    "photo_path": f"/{result['stored'].path.as_posix()}",
+                    "blob_hash": result["stored"].sha256,
+                    "title": result["metadata"].title,
+                    "description": result["metadata"].description,
+                    "location": result["metadata"].location,
+                    "date": result["date"],
+                }
+                for result in stored
+            ],
+        )).all()
+
+        category_links, gallery_links, by_content = [], [], {}
+        for result, id_photo in zip(stored, photo_ids):
+            result.update(status="created", id_photo=id_photo)
+            category_links += [{"id_photo": id_photo, "id_category": id_category} for id_category in set(result["categories"])]
+            gallery_links += [{"id_photo": id_photo, "id_gallery": id_gallery} for id_gallery in set(result["galleries"])]
+            by_content.setdefault(result["stored"].sha256, []).append(id_photo)
+        await insert_links(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, category_links)
+        await insert_links(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, gallery_links)
+        # One processing job per distinct content, so it is rendered once
+        # and the jobs spread over the workers
+        job_ids = {}
+        for blob_hash, ids in by_content.items():
+            job_ids[blob_hash] = (await jobs.enqueue(db, "photos.process", {"photo_ids": ids})).id_job
+        for result in stored:
+            result["id_job"] = job_ids[result["stored"].sha256]
+        await pages.refresh_affected(db, photo_ids=photo_ids)
+        await db.commit()
+        await response_cache.invalidate("photos")
+
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(result["stored"].byte_size for result in stored)
+    report = [
+        {"filename": result["filename"], "status": "created", "id_photo": result["id_photo"], "sha256": result["stored"].sha256, "id_job": result["id_job"]}
+        if result["status"] == "created" else
+        {"filename": result["filename"], "status": "failed", "detail": result["detail"]}
+        for result in results
+    ]
+    created = len(stored)
+    return {
+        "results": report,
+        "summary": {
+            "files": len(results),
+            "created": created,
+            "failed": len(results) - created,
+            "bytes": total_bytes,
+            "seconds": round(elapsed, 3),
+            "files_per_second": round(created / elapsed, 2) if elapsed else None,
+            "megabytes_per_second": round(total_bytes / elapsed / 1024 / 1024, 2) if elapsed else None,
+        },
+    }
 
 @router.put("/photo/update-details/{photo_id}")
-async def update_photo(photo_id: int, request: PhotoUpload, db: SessionLocal = Depends(get_db)):
-    photo = db.query(Photo).filter(Photo.id_photo == photo_id).first()
+async def update_photo(photo_id: int, request: PhotoUpload, db: AsyncSession = Depends(get_db)):
+    photo = await db.scalar(select(Photo).where(Photo.id_photo == photo_id))
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
-    photo.title = request.title
-    photo.description = request.description
-    photo.location = request.location
-    photo.date = request.date
-    db.commit()
+    async with pages.refreshing(db, photo_ids=[photo_id]):
+        photo.title = request.title
+        photo.description = request.description
+        photo.location = request.location
+        photo.date = parse_date(request.date)
+    await db.commit()
+    await response_cache.invalidate("photos")
     return {"message": "Photo updated successfully"}
 
-@router.put("/update-category/{photo_id}")
-async def update_photo(photo_id: int, categories: CategoriesAndPhotoUpload, user: user_dependencies, db: SessionLocal = Depends(get_db)):
-    photo = db.query(Photo).filter(Photo.id_photo == photo_id).first()
-    if not photo:
-        raise HTTPException(status_code=404, detail="Photo not found")
-    db.query(CategoriesAndPhotos).filter_by(id_photo=photo_id).delete()
-    db.commit()
-
-    if len(categories.list_id_category) == 0:  # Ensure it's not empty
-        return {"message": "Photo updated successfully"}
-
-    categoriesList = categories.list_id_category.split(",")
-
-    
-    for category_id in categoriesList:
-        new_category_and_photo = CategoriesAndPhotos(
-            id_photo = photo_id,
-            id_category = category_id
-        )
-        db.add(new_category_and_photo)
-        db.commit()
-        db.refresh(new_category_and_photo)
+async def check_link_targets(db: AsyncSession, photo_ids: list, key, ids: list, label: str):
+    # Unknown ids on either side would fail on the foreign keys
+    await check_ids(db, Photo.id_photo, photo_ids, "Photos")
+    await check_ids(db, key, ids, label)
 
+@router.put("/update-category/{photo_id}")
+async def update_photo(photo_id: int, categories: CategoriesAndPhotoUpdate, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    await check_link_targets(db, [photo_id], Category.id_category, categories.list_id_category, "Categories")
+    async with pages.refreshing(db, photo_ids=[photo_id]):
+        await replace_links(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, [photo_id], categories.list_id_category)
+    await db.commit()
+    await response_cache.invalidate("photos")
     return {"message": "Photo updated successfully"}
 
 @router.put('/update-gallery/{photo_id}')
-async def update_photo(photo_id: int, galleries: GalleryAndPhotoUpload, user: user_dependencies, db: SessionLocal = Depends(get_db)):
-    galleriesList = galleries.list_id_gallery.split(",")
-
-    db.query(GalleryAndPhotos).filter_by(id_photo=photo_id).delete()
-    db.commit()
-
-    if galleries.list_id_gallery == "":  # Ensure it's not empty
-        return {"message": "Photo updated successfully"}
-    
-    for gallery_id in galleriesList:
-        new_gallery_and_photo = GalleryAndPhotos(
-            id_photo = photo_id,
-            id_gallery = gallery_id
-        )
-        db.add(new_gallery_and_photo)
-        db.commit()
-        db.refresh(new_gallery_and_photo)
-        
+async def update_photo(photo_id: int, galleries: GalleryAndPhotoUpdate, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    await check_link_targets(db, [photo_id], Gallery.id_gallery, galleries.list_id_gallery, "Galleries")
+    async with pages.refreshing(db, photo_ids=[photo_id]):
+        await replace_links(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, [photo_id], galleries.list_id_gallery)
+    await db.commit()
+    await response_cache.invalidate("photos")
     return {"message": "Photo updated successfully"}
 
+@router.put("/update-category")
+async def update_photos_categories(request: PhotosCategoriesUpdate, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    await check_link_targets(db, request.photo_ids, Category.id_category, request.list_id_category, "Categories")
+    async with pages.refreshing(db, photo_ids=request.photo_ids):
+        changes = await replace_links(db, CategoriesAndPhotos, CategoriesAndPhotos.id_category, request.photo_ids, request.list_id_category)
+    await db.commit()
+    await response_cache.invalidate("photos")
+    return {"message": "Photos updated successfully", **changes}
+
+@router.put("/update-gallery")
+async def update_photos_galleries(request: PhotosGalleriesUpdate, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    await check_link_targets(db, request.photo_ids, Gallery.id_gallery, request.list_id_gallery, "Galleries")
+    async with pages.refreshing(db, photo_ids=request.photo_ids):
+        changes = await replace_links(db, GalleryAndPhotos, GalleryAndPhotos.id_gallery, request.photo_ids, request.list_id_gallery)
+    await db.commit()
+    await response_cache.invalidate("photos")
+    return {"message": "Photos updated successfully", **changes}
+
+async def selected_photos(db: AsyncSession, selection: BulkPhotoSelection) -> list:
+    """(id_photo, photo_path, blob_hash) of the photos a bulk request targets."""
+    if selection.photo_ids is not None:
+        criteria = [Photo.id_photo.in_(selection.photo_ids)]
+    else:
+        criteria = photo_filters(**selection.filter.dict())
+    rows = (await db.execute(
+        select(Photo.id_photo, Photo.photo_path, Photo.blob_hash)
+        .where(*criteria)
+        .order_by(Photo.id_photo)
+        .limit(BULK_EDIT_MAX_PHOTOS + 1)
+    )).all()
+    if len(rows) > BULK_EDIT_MAX_PHOTOS:
+        raise HTTPException(status_code=413, detail=f"More than {BULK_EDIT_MAX_PHOTOS} photos selected")
+    return rows
+
+def bulk_summary(selection: BulkPhotoSelection, ids: list, started: float, **counts) -> dict:
+    missing = sorted(set(selection.photo_ids) - set(ids)) if selection.photo_ids is not None else []
+    return {"matched": len(ids), **counts, "missing": missing, "seconds": round(time.perf_counter() - started, 3)}
+
+@router.patch("/bulk")
+async def bulk_update_photos(request: BulkPhotoUpdate, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    # One UPDATE for the whole selection, only the fields sent are changed
+    started = time.perf_counter()
+    ids = [row.id_photo for row in await selected_photos(db, request)]
+    changes = request.changes.dict(exclude_unset=True)
+    if "date" in changes:
+        changes["date"] = parse_date(changes["date"])
+    updated = 0
+    if ids:
+        async with pages.refreshing(db, photo_ids=ids):
+            updated = (await db.execute(
+                update(Photo).where(Photo.id_photo.in_(ids)).values(**changes).execution_options(synchronize_session=False)
+            )).rowcount
+        await db.commit()
+        await response_cache.invalidate("photos")
+    return bulk_summary(request, ids, started, updated=updated)
+
+@router.delete("/bulk")
+async def bulk_delete_photos(request: BulkPhotoSelection, user: user_dependencies, db: AsyncSession = Depends(get_db)):
+    # One DELETE, links, featured entries, variants and EXIF go with it
+    # through ON DELETE CASCADE
+    started = time.perf_counter()
+    rows = await selected_photos(db, request)
+    ids = [row.id_photo for row in rows]
+    deleted, released = 0, []
+    if ids:
+        async with pages.refreshing(db, photo_ids=ids):
+            deleted = (await db.execute(
+                delete(Photo).where(Photo.id_photo.in_(ids)).execution_options(synchronize_session=False)
+            )).rowcount
+        released = await release_blobs(db, Counter(row.blob_hash for row in rows if row.blob_hash))
+        # Files are removed in the background once nothing points at them
+        await schedule_removal(db, paths=[row.photo_path for row in rows if row.blob_hash is None], blobs=released)
+        await db.commit()
+        await response_cache.invalidate("photos")
+    return bulk_summary(request, ids, started, deleted=deleted, blobs_released=len(released))
+
 @router.get('/count')
-async def get_count_photos(db: SessionLocal = Depends(get_db)):
-    photos = db.query(Photo).count()
+async def get_count_photos(validator: dict = Depends(conditional_on("photos")), db: AsyncSession = Depends(get_db)):
+    photos = await db.scalar(select(func.count()).select_from(Photo))
     return photos
 
 @router.delete("/photo/delete/{photo_id}")
-async def delete_photo(photo_id: int, db: SessionLocal = Depends(get_db)):
-    photo = db.query(Photo).filter(Photo.id_photo == photo_id).first()
+async def delete_photo(photo_id: int, db: AsyncSession = Depends(get_db)):
+    photo = await db.scalar(select(Photo).where(Photo.id_photo == photo_id))
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
-    db.delete(photo)
-    db.commit()
+    async with pages.refreshing(db, photo_ids=[photo_id]):
+        # Files are removed in the background once nothing points at them
+        if photo.blob_hash is None:
+            await schedule_removal(db, paths=[photo.photo_path])
+        elif await release_blob(db, photo.blob_hash):
+            await schedule_removal(db, blobs=[photo.blob_hash])
+        await db.delete(photo)
+    await db.commit()
+    await response_cache.invalidate("photos")
     return {"message": "Photo deleted successfully"}
 
-@router.get("/all")
-async def get_all_photos(db: SessionLocal = Depends(get_db)):
+# Keyset pagination over (date, id_photo), photos without a date come last
+def photos_after(last_date: Optional[date], last_id: int):
+    if last_date is None:
+        return and_(Photo.date.is_(None), Photo.id_photo > last_id)
+    return or_(
+        Photo.date > last_date,
+        and_(Photo.date == last_date, Photo.id_photo > last_id),
+        Photo.date.is_(None),
+    )
 
-    photos = db.query(Photo).options(
-        joinedload(Photo.categories).joinedload(CategoriesAndPhotos.category),
-        joinedload(Photo.galleries).joinedload(GalleryAndPhotos.gallery)
-    ).order_by(asc(Photo.date)).all()
-    return photos
+def photo_filters(
+    category: Optional[int] = None,
+    gallery: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    location: Optional[str] = None,
+):
+    filters = []
+    if category is not None:
+        filters.append(Photo.categories.any(CategoriesAndPhotos.id_category == category))
+    if gallery is not None:
+        filters.append(Photo.galleries.any(GalleryAndPhotos.id_gallery == gallery))
+    if date_from is not None:
+        filters.append(Photo.date >= date_from)
+    if date_to is not None:
+        filters.append(Photo.date <= date_to)
+    if location:
+        filters.append(Photo.location.ilike(f"%{location}%"))
+    return filters
+
+@router.get("/all")
+async def get_all_photos(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    filters: list = Depends(photo_filters),
+    validator: dict = Depends(conditional_on(*PHOTO_TABLES)),
+    db: AsyncSession = Depends(get_db)):
+
+    query = select(Photo).where(*filters)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, 2)
+        try:
+            last_date = date.fromisoformat(last_date) if last_date is not None else None
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(photos_after(last_date, last_id))
+
+    async def load():
+        # Relationships are loaded with one IN query per level for the page only
+        photos = (await db.scalars(query.options(
+            selectinload(Photo.categories).selectinload(CategoriesAndPhotos.category),
+            selectinload(Photo.galleries).selectinload(GalleryAndPhotos.gallery)
+        ).order_by(asc(Photo.date).nulls_last(), asc(Photo.id_photo)).limit(limit + 1))).all()
+
+        next_cursor = None
+        if len(photos) > limit:
+            photos = photos[:limit]
+            next_cursor = encode_cursor([photos[-1].date, photos[-1].id_photo])
+        return {"items": photos, "next_cursor": next_cursor}
+
+    # Items embed their category and gallery names
+    return await response_cache.get_or_load(request, ("photos", "categories", "galleries"), load, validator)
 
 @router.get("/{photo_id}")
-async def get_all_photos(photo_id: int, db: SessionLocal = Depends(get_db)):
+async def get_all_photos(photo_id: int, validator: dict = Depends(conditional_on(*PHOTO_TABLES)), db: AsyncSession = Depends(get_db)):
 
-    photos = db.query(Photo).filter(Photo.id_photo == photo_id).options(
-        joinedload(Photo.categories).joinedload(CategoriesAndPhotos.category),
-        joinedload(Photo.galleries).joinedload(GalleryAndPhotos.gallery)
-    ).order_by(asc(Photo.date)).first()
+    photos = await db.scalar(select(Photo).where(Photo.id_photo == photo_id).options(
+        selectinload(Photo.categories).selectinload(CategoriesAndPhotos.category),
+        selectinload(Photo.galleries).selectinload(GalleryAndPhotos.gallery),
+        selectinload(Photo.exif)
+    ))
     return photos
 
 @router.put("/update-details/{photo_id}")
-async def update_photo(photo_id: int, request: PhotoUpload, db: SessionLocal = Depends(get_db)):
-    photo = db.query(Photo).filter(Photo.id_photo == photo_id).first()
+async def update_photo(photo_id: int, request: PhotoUpload, db: AsyncSession = Depends(get_db)):
+    photo = await db.scalar(select(Photo).where(Photo.id_photo == photo_id))
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
-    photo.title = request.title
-    photo.description = request.description
-    photo.location = request.location
-    photo.date = request.date
-    db.commit()
+    async with pages.refreshing(db, photo_ids=[photo_id]):
+        photo.title = request.title
+        photo.description = request.description
+        photo.location = request.location
+        photo.date = parse_date(request.date)
+    await db.commit()
+    await response_cache.invalidate("photos")
     return {"message": "Photo updated successfully"}
 
 
@@ -1,20 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException
-from database import SessionLocal
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, HTTPException, Request
+from database import get_db
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Service
 from schemas import ServicesRequest
+from responsecache import response_cache
+from versions import conditional_on
 import services
 from typing import Annotated
 import shutil
 from pathlib import Path
 from PIL import Image
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 router = APIRouter(
     prefix="/admin/services",
     tags=["admin services"],
@@ -24,42 +21,46 @@ router = APIRouter(
 user_dependencies = Annotated[dict, Depends(services.get_current_user)]
 
 @router.get('/count')
-async def get_count_services(db: SessionLocal = Depends(get_db)):
-    services = db.query(Service).count()
+async def get_count_services(validator: dict = Depends(conditional_on("services")), db: AsyncSession = Depends(get_db)):
+    services = await db.scalar(select(func.count()).select_from(Service))
     return services
 
 @router.get('/all')
-async def get_all_services(db: SessionLocal = Depends(get_db)):
-    services = db.query(Service).all()
-    return services
+async def get_all_services(request: Request, validator: dict = Depends(conditional_on("services")), db: AsyncSession = Depends(get_db)):
+    async def load():
+        return (await db.scalars(select(Service))).all()
+    return await response_cache.get_or_load(request, ("services",), load, validator)
 
 @router.post('/create')
-async def create_service(service: ServicesRequest, user: user_dependencies, db: SessionLocal = Depends(get_db)):
+async def create_service(service: ServicesRequest, user: user_dependencies, db: AsyncSession = Depends(get_db)):
     new_service = Service(
         service_name = service.service_name,
         description = service.description,
     )
     db.add(new_service)
-    db.commit()
-    db.refresh(new_service)
+    await db.commit()
+    await response_cache.invalidate("services")
+    await db.refresh(new_service)
     return new_service
 
 @router.put('/update/{service_id}')
-async def update_service(service_id: int, user: user_dependencies, service: ServicesRequest, db: SessionLocal = Depends(get_db)):
-    new_service = db.query(Service).filter(Service.id_service == service_id).first()
+async def update_service(service_id: int, user: user_dependencies, service: ServicesRequest, db: AsyncSession = Depends(get_db)):
+    new_service = await db.scalar(select(Service).where(Service.id_service == service_id))
     if not new_service:
         raise HTTPException(status_code=404, detail="Service not found")
     new_service.service_name = service.service_name
     new_service.description = service.description
-    db.commit()
-    db.refresh(new_service)
+    await db.commit()
+    await response_cache.invalidate("services")
+    await db.refresh(new_service)
     return new_service
 
 @router.delete('/delete/{service_id}')
-async def delete_service(service_id: int, db: SessionLocal = Depends(get_db)):
-    service = db.query(Service).filter(Service.id_service == service_id).first()
+async def delete_service(service_id: int, db: AsyncSession = Depends(get_db)):
+    service = await db.scalar(select(Service).where(Service.id_service == service_id))
     if not service:
         raise HTTPException(status_code=404, detail="Service not found")
-    db.delete(service)
-    db.commit()
+    await db.delete(service)
+    await db.commit()
+    await response_cache.invalidate("services")
     return service
\ No newline at end of file
@@ -1,12 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
-from database import SessionLocal
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import FileResponse
+from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Photo, PublicPage
+from pages import page_key, photo_summary
+from search import search_photos
+from featured import featured_snapshot
+from rendercache import render_cache
+from typing import Literal, Optional
+from pathlib import Path
+import hashlib
+import imaging
 
 router = APIRouter(
     prefix="/photos",
@@ -14,5 +19,107 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+async def page_response(db: AsyncSession, key: str):
+    # Pages are prebuilt on write, serving one is a single primary key lookup
+    document = await db.scalar(select(PublicPage.document).where(PublicPage.page_key == key))
+    if document is None:
+        return None
+    return Response(document, media_type="application/json")
+
+@router.get("/gallery/{id_gallery}")
+async def get_gallery_page(id_gallery: int, db: AsyncSession = Depends(get_db)):
+    page = await page_response(db, page_key("gallery", id_gallery))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Gallery not found")
+    return page
+
+@router.get("/category/{id_category}")
+async def get_category_page(id_category: int, db: AsyncSession = Depends(get_db)):
+    page = await page_response(db, page_key("category", id_category))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return page
+
+@router.get("/featured/{featured_type}")
+async def get_featured_page(featured_type: str):
+    # Served from memory, the homepage does not touch the database
+    return Response(await featured_snapshot.get(featured_type), media_type="application/json")
+
+@router.get("/search")
+async def search(
+    q: Optional[str] = Query(None, max_length=200),
+    category: Optional[int] = None,
+    gallery: Optional[int] = None,
+    year: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)):
+    results = await search_photos(db, q, category, gallery, year, limit, offset)
+    return {
+        "total": results["total"],
+        "items": [{**photo_summary(photo), "rank": rank} for photo, rank in results["hits"]],
+        "facets": results["facets"],
+    }
+
+@router.get("/{id_photo}")
+async def get_photo_page(id_photo: int, db: AsyncSession = Depends(get_db)):
+    page = await page_response(db, page_key("photo", id_photo))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    return page
+
+# Part of every render key, bumped when render() output changes for the
+# same parameters (2: EXIF orientation applied)
+RENDER_VERSION = 2
+
+# Formats picked from the Accept header, best first
+NEGOTIATED_FORMATS = ("avif", "webp")
+
+def negotiate_format(accept: str) -> str:
+    supported = imaging.supported_formats(NEGOTIATED_FORMATS)
+    for fmt in NEGOTIATED_FORMATS:
+        if fmt in supported and f"image/{fmt}" in accept:
+            return fmt
+    return "jpeg"
+
+@router.get("/{id_photo}/render")
+async def render_photo(
+    id_photo: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=4096),
+    h: Optional[int] = Query(None, ge=1, le=4096),
+    fit: Literal["cover", "contain", "fill"] = "cover",
+    fmt: Optional[Literal["jpeg", "png", "webp", "avif"]] = None,
+    q: int = Query(imaging.VARIANT_QUALITY, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)):
+    photo = (await db.execute(select(Photo.photo_path, Photo.blob_hash).where(Photo.id_photo == id_photo))).first()
+    if not photo:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    photo_path, blob_hash = photo
+    source = Path(photo_path.lstrip("/"))
+    try:
+        stat = source.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Photo file not found")
+
+    fmt = fmt or negotiate_format(request.headers.get("accept", ""))
+    if fmt not in imaging.supported_formats([fmt]):
+        raise HTTPException(status_code=400, detail=f"Format {fmt} is not supported")
+
+    # The key changes whenever the source bytes or any render parameter change,
+    # content-addressed photos are identified by their hash alone
+    source_id = blob_hash or f"{photo_path}|{stat.st_size}|{stat.st_mtime_ns}"
+    key = hashlib.sha256(f"{RENDER_VERSION}|{source_id}|{w}|{h}|{fit}|{fmt}|{q}".encode()).hexdigest()
+    headers = {
+        "ETag": f'"{key}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept",
+    }
+    if f'"{key}"' in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
 
+    async def render(path: Path):
+        await imaging.run_in_pool(imaging.render, str(source), str(path), w, h, fit, fmt, q)
 
+    path = await render_cache.get_or_render(key, imaging.FORMAT_EXTENSIONS[fmt], render)
+    return FileResponse(path, media_type=f"image/{fmt}", headers=headers)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, EmailStr, constr, root_validator, validator
 from datetime import date
-from typing import Optional
+from typing import List, Optional, Union
 
 class UserRegisterSchema(BaseModel):
     username: str
@@ -26,12 +26,35 @@ class UserEditSchema(BaseModel):
     class Config:
         orm_mode = True
 
+def parse_date(value: Optional[str]) -> Optional[date]:
+    # Photo dates arrive as ISO strings, empty means no date
+    return date.fromisoformat(value) if value else None
+
 class PhotoUpload(BaseModel):
     title: str | None = None
     description: str | None = None
     location: str | None = None
     date: Optional[str] = None
 
+    @validator("date")
+    def check_date(cls, value):
+        parse_date(value)
+        return value or None
+
+def split_ids(value: Union[List[int], str, None]) -> List[int]:
+    # Id lists arrive either as JSON integer lists or as "1,2,3" strings
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [int(item) for item in value.split(",") if item.strip()]
+    return [int(item) for item in value]
+
+class BulkPhotoMetadata(PhotoUpload):
+    list_id_category: List[int] = []
+    list_id_gallery: List[int] = []
+
+    _split_ids = validator("list_id_category", "list_id_gallery", pre=True, allow_reuse=True)(split_ids)
+
 class CategoryUpload(BaseModel):
     category_name: str
 
@@ -44,6 +67,74 @@ class GalleryUpload(BaseModel):
 class GalleryAndPhotoUpload(BaseModel):
     list_id_gallery: str
 
+class CategoriesAndPhotoUpdate(BaseModel):
+    list_id_category: List[int] = []
+
+    _split_ids = validator("list_id_category", pre=True, allow_reuse=True)(split_ids)
+
+class GalleryAndPhotoUpdate(BaseModel):
+    list_id_gallery: List[int] = []
+
+    _split_ids = validator("list_id_gallery", pre=True, allow_reuse=True)(split_ids)
+
+class PhotosCategoriesUpdate(CategoriesAndPhotoUpdate):
+    photo_ids: List[int]
+
+class PhotosGalleriesUpdate(GalleryAndPhotoUpdate):
+    photo_ids: List[int]
+
+class PhotoFilter(BaseModel):
+    # Same criteria as the /admin/photos/all listing
+    category: Optional[int] = None
+    gallery: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    location: Optional[str] = None
+
+class BulkPhotoSelection(BaseModel):
+    # Either explicit ids or a filter, a filter without criteria is refused
+    # so an empty body never selects every photo
+    photo_ids: Optional[List[int]] = None
+    filter: Optional[PhotoFilter] = None
+
+    @root_validator(skip_on_failure=True)
+    def one_selection(cls, values):
+        photo_ids, photo_filter = values.get("photo_ids"), values.get("filter")
+        if (photo_ids is None) == (photo_filter is None):
+            raise ValueError("Give exactly one of photo_ids or filter")
+        if photo_filter is not None and not photo_filter.dict(exclude_none=True):
+            raise ValueError("filter needs at least one criterion")
+        return values
+
+class BulkPhotoUpdate(BulkPhotoSelection):
+    # Only the fields present are changed
+    changes: PhotoUpload
+
+    @validator("changes")
+    def some_changes(cls, value):
+        if not value.dict(exclude_unset=True):
+            raise ValueError("changes needs at least one field")
+        return value
+
+class FeaturedPhotosUpdate(BaseModel):
+    # Ordered, the first id is shown first
+    photo_ids: List[int]
+
+class PhotoOrderUpdate(BaseModel):
+    # Ordered, photos left out keep their order after the listed ones
+    photo_ids: List[int]
+
+class PhotoMove(BaseModel):
+    # Exactly one of them, the id of the photo to be placed next to
+    before: Optional[int] = None
+    after: Optional[int] = None
+
+    @root_validator(skip_on_failure=True)
+    def one_anchor(cls, values):
+        if (values.get("before") is None) == (values.get("after") is None):
+            raise ValueError("Give exactly one of before or after")
+        return values
+
 class AdminDetails(BaseModel):
     id_user: int
     username: str
@@ -63,6 +154,16 @@ class ServicesRequest(BaseModel):
     description: str | None = None
 
 
+class PhotoVariantBase(BaseModel):
+    variant_path: str
+    width: int
+    height: int
+    format: str
+    byte_size: int
+
+    class Config:
+        orm_mode = True
+
 class PhotoBase(BaseModel):
     id_photo: int
     photo_path: str
@@ -70,6 +171,12 @@ class PhotoBase(BaseModel):
     description: Optional[str]
     location: Optional[str]
     date: Optional[date]
+    width: Optional[int] = None
+    height: Optional[int] = None
+    aspect_ratio: Optional[float] = None
+    dominant_color: Optional[str] = None
+    lqip: Optional[str] = None
+    variants: List[PhotoVariantBase] = []
 
     class Config:
         orm_mode = True
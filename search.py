@@ -0,0 +1,165 @@
+import re
+
+from decouple import config
+from sqlalchemy import Float, Integer, String, cast, column, event, extract, func, literal, literal_column, null, select, table, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+from models import Category, CategoriesAndPhotos, Gallery, GalleryAndPhotos, Photo
+
+# Text search configuration for PostgreSQL, "simple" does no stemming and
+# works for any language
+SEARCH_TEXT_CONFIG = config("SEARCH_TEXT_CONFIG", default="simple")
+
+POSTGRES_DDL = (
+    f"""ALTER TABLE photos ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(location, '')), 'B') ||
+        setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(description, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_photos_search_vector ON photos USING GIN (search_vector)",
+)
+
+# External content FTS5 table, the triggers keep it in step with photos
+SQLITE_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS photos_fts USING fts5(
+        title, description, location,
+        content='photos', content_rowid='id_photo', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS photos_fts_insert AFTER INSERT ON photos BEGIN
+        INSERT INTO photos_fts(rowid, title, description, location)
+        VALUES (new.id_photo, new.title, new.description, new.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS photos_fts_delete AFTER DELETE ON photos BEGIN
+        INSERT INTO photos_fts(photos_fts, rowid, title, description, location)
+        VALUES ('delete', old.id_photo, old.title, old.description, old.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS photos_fts_update AFTER UPDATE OF title, description, location ON photos BEGIN
+        INSERT INTO photos_fts(photos_fts, rowid, title, description, location)
+        VALUES ('delete', old.id_photo, old.title, old.description, old.location);
+        INSERT INTO photos_fts(rowid, title, description, location)
+        VALUES (new.id_photo, new.title, new.description, new.location);
+    END""",
+    "INSERT INTO photos_fts(photos_fts) VALUES ('rebuild')",
+)
+
+def install_search(connection):
+    """Create the search index for connection's dialect, safe to run again."""
+    statements = {"postgresql": POSTGRES_DDL, "sqlite": SQLITE_DDL}.get(connection.dialect.name, ())
+    for statement in statements:
+        connection.execute(text(statement))
+
+@event.listens_for(Photo.__table__, "after_create")
+def _install_after_create(target, connection, **kw):
+    install_search(connection)
+
+photos_fts = table("photos_fts", column("rowid", Integer))
+
+def has_terms(q) -> bool:
+    # Punctuation alone makes no FTS5 query, it is searched like no q at all
+    return bool(q and re.search(r"\w", q))
+
+def fts5_query(q: str) -> str:
+    # Every word must match as a prefix, quoting keeps FTS5 syntax out of user input
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", q))
+
+def matching_photos(q: str):
+    """(id_photo, rank) of photos matching q, higher rank is better."""
+    dialect = database.engine.dialect.name
+    if dialect == "postgresql":
+        vector = literal_column("photos.search_vector")
+        query = func.websearch_to_tsquery(SEARCH_TEXT_CONFIG, q)
+        return select(Photo.id_photo, func.ts_rank_cd(vector, query).label("rank")).where(vector.op("@@")(query))
+    if dialect == "sqlite":
+        return (
+            # Column weights follow the PostgreSQL ones: title, description, location
+            select(photos_fts.c.rowid.label("id_photo"), (-func.bm25(literal_column("photos_fts"), 10.0, 2.0, 5.0)).label("rank"))
+            .select_from(photos_fts)
+            .where(literal_column("photos_fts").op("MATCH")(fts5_query(q)))
+        )
+    # No full-text index on this database, fall back to substring matching
+    pattern = f"%{q}%"
+    return select(Photo.id_photo, literal(1.0).label("rank")).where(
+        Photo.title.ilike(pattern) | Photo.description.ilike(pattern) | Photo.location.ilike(pattern)
+    )
+
+def facet_row(name: str, key, label, value):
+    # Hits, the total and every facet share one column layout so they can
+    # come back from a single UNION ALL
+    return (
+        literal(name).label("facet"),
+        cast(key, Integer).label("key"),
+        cast(label, String).label("label"),
+        cast(value, Float).label("value"),
+    )
+
+async def search_photos(db: AsyncSession, q, category, gallery, year, limit: int, offset: int) -> dict:
+    """Ranked matches plus facet counts per category, gallery and year.
+
+    The page of hits, the total and every facet come back from a single
+    statement over a shared CTE of the filtered matches.
+    """
+    year_of = extract("year", Photo.date)
+    matches = select(Photo.id_photo, year_of.label("year"))
+    if has_terms(q):
+        found = matching_photos(q).subquery("found")
+        matches = matches.add_columns(found.c.rank).join(found, found.c.id_photo == Photo.id_photo)
+    else:
+        matches = matches.add_columns(literal(0.0).label("rank"))
+    if category is not None:
+        matches = matches.where(Photo.categories.any(CategoriesAndPhotos.id_category == category))
+    if gallery is not None:
+        matches = matches.where(Photo.galleries.any(GalleryAndPhotos.id_gallery == gallery))
+    if year is not None:
+        matches = matches.where(year_of == year)
+    matches = matches.cte("matches")
+
+    page = (
+        select(matches.c.id_photo, matches.c.rank)
+        .order_by(matches.c.rank.desc(), matches.c.id_photo.desc())
+        .limit(limit).offset(offset)
+        .subquery("page")
+    )
+    statement = union_all(
+        select(*facet_row("hit", page.c.id_photo, null(), page.c.rank)),
+        select(*facet_row("total", null(), null(), func.count())).select_from(matches),
+        select(*facet_row("category", Category.id_category, Category.category_name, func.count()))
+            .select_from(matches)
+            .join(CategoriesAndPhotos, CategoriesAndPhotos.id_photo == matches.c.id_photo)
+            .join(Category, Category.id_category == CategoriesAndPhotos.id_category)
+            .group_by(Category.id_category, Category.category_name),
+        select(*facet_row("gallery", Gallery.id_gallery, Gallery.gallery_name, func.count()))
+            .select_from(matches)
+            .join(GalleryAndPhotos, GalleryAndPhotos.id_photo == matches.c.id_photo)
+            .join(Gallery, Gallery.id_gallery == GalleryAndPhotos.id_gallery)
+            .group_by(Gallery.id_gallery, Gallery.gallery_name),
+        select(*facet_row("year", matches.c.year, null(), func.count()))
+            .where(matches.c.year.is_not(None))
+            .group_by(matches.c.year),
+    )
+
+    hits, total, facets = [], 0, {"category": [], "gallery": [], "year": []}
+    for name, key, label, value in await db.execute(statement):
+        if name == "hit":
+            hits.append((key, value))
+        elif name == "total":
+            total = int(value)
+        else:
+            facets[name].append((key, label, int(value)))
+
+    # UNION ALL keeps no order, restore the ranking of the page
+    hits.sort(key=lambda hit: (-hit[1], -hit[0]))
+    photos = {}
+    if hits:
+        photos = {photo.id_photo: photo for photo in await db.scalars(
+            select(Photo).where(Photo.id_photo.in_([key for key, _ in hits]))
+        )}
+    return {
+        "total": total,
+        "hits": [(photos[key], rank) for key, rank in hits if key in photos],
+        "facets": {
+            "categories": [{"id_category": key, "category_name": label, "count": count} for key, label, count in sorted(facets["category"])],
+            "galleries": [{"id_gallery": key, "gallery_name": label, "count": count} for key, label, count in sorted(facets["gallery"])],
+            "years": [{"year": key, "count": count} for key, _, count in sorted(facets["year"], reverse=True)],
+        },
+    }
@@ -1,54 +1,106 @@
 import fastapi
 import database as _database, models as _models, schemas as _schemas
-import sqlalchemy.orm as _orm
-import passlib.hash as _hash
+import sqlalchemy as _sql
+from sqlalchemy.ext.asyncio import AsyncSession
+import passlib.context as _passlib_context
 import fastapi.security as _security
 import datetime as _dt
 from decouple import config
 import jwt as _jwt
+import time as _time
+import asyncio as _asyncio
+import concurrent.futures as _futures
 
 oauth2schema = _security.OAuth2PasswordBearer(tokenUrl="/admin/login")
 JWT_SECRET = config("JWT_SECRET")
 
-def get_db():
-    db = _database.SessionLocal()
+# Seconds an authenticated principal is served from memory before the user row is read again
+AUTH_CACHE_TTL = config("AUTH_CACHE_TTL", default=60, cast=int)
+# Build the principal from the signed token claims alone, no SQL per request
+AUTH_TRUST_CLAIMS = config("AUTH_TRUST_CLAIMS", default=False, cast=bool)
+
+# bcrypt cost factor, hashes made with a lower cost are upgraded on login
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", default=12, cast=int)
+# Threads running bcrypt (it releases the GIL) and how many calls may wait for one
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=2, cast=int)
+PASSWORD_HASH_QUEUE_DEPTH = config("PASSWORD_HASH_QUEUE_DEPTH", default=16, cast=int)
+PASSWORD_HASH_RETRY_AFTER = config("PASSWORD_HASH_RETRY_AFTER", default=1, cast=int)
+
+pwd_context = _passlib_context.CryptContext(
+    schemes=["bcrypt"],
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+_hash_pool = _futures.ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = 0
+
+# id_user -> (expires_at, token_version, AdminDetails)
+_principal_cache = {}
+# id_user -> lowest token version this process still accepts
+_token_versions = {}
+
+async def _run_hasher(func, *args):
+    # Bounded queue in front of the pool, excess work is turned away with a 503
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_DEPTH:
+        raise fastapi.HTTPException(
+            status_code=503,
+            detail="Too many password operations, try again shortly",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
+    _hash_pending += 1
     try:
-        yield db
+        return await _asyncio.get_running_loop().run_in_executor(_hash_pool, func, *args)
     finally:
-        db.close()
+        _hash_pending -= 1
+
+async def hash_password(password: str) -> str:
+    return await _run_hasher(pwd_context.hash, password)
 
-async def get_user_by_email(email: str, db: _orm.Session):
-    return db.query(_models.User).filter(_models.User.email == email).first()
+async def verify_password(password: str, hashed: str) -> tuple:
+    """Returns whether password matches and, if the hash is outdated, its replacement."""
+    return await _run_hasher(pwd_context.verify_and_update, password, hashed)
 
-async def create_user(request: _schemas.UserRegisterSchema, db: _orm.Session):
+async def get_user_by_email(email: str, db: AsyncSession):
+    return await db.scalar(_sql.select(_models.User).where(_models.User.email == email).limit(1))
+
+async def create_user(request: _schemas.UserRegisterSchema, db: AsyncSession):
     new_user = _models.User(
         username = request.username,
         email = request.email,
-        password = _hash.bcrypt.hash(request.password),
+        password = await hash_password(request.password),
         photo_path = request.photo_path,
         instagram_url = request.instagram_url,
         facebook_url = request.facebook_url,
         linkedin_url = request.linkedin_url
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
-async def authenticate_user(email: str, password: str, db: _orm.Session):
+async def authenticate_user(email: str, password: str, db: AsyncSession):
     user = await get_user_by_email(db=db, email=email)
 
     if not user:
         return False
 
-    if not _hash.bcrypt.verify(password, user.password):
+    verified, new_hash = await verify_password(password, user.password)
+    if not verified:
         return False
+    if new_hash:
+        # Transparently move old hashes to the current cost factor
+        user.password = new_hash
+        await db.commit()
+        await db.refresh(user)
     return user
 
 async def create_token(user: _models.User):
     user_obj = {"sub": user.username, 
                 "email": user.email,
                 "id": user.id_user, 
+                "ver": user.token_version or 0,
+                "profile": admin_details(user).dict(exclude={"id_user"}),
                 "exp": _dt.datetime.utcnow() + _dt.timedelta(minutes=20),
                 "iat": _dt.datetime.utcnow()} 
     
@@ -56,27 +108,59 @@ async def create_token(user: _models.User):
     
     return dict(access_token=token, token_type="bearer")
 
+def admin_details(user: _models.User) -> _schemas.AdminDetails:
+    return _schemas.AdminDetails(
+        id_user=user.id_user,
+        username = user.username,
+        email = user.email,
+        description=user.description,
+        photo_path = user.photo_path,
+        instagram_url = user.instagram_url,
+        facebook_url = user.facebook_url,
+        linkedin_url = user.linkedin_url
+    )
+
+def invalidate_user(user_id: int, token_version: int = None):
+    """Drop the cached principal, a new token_version revokes older tokens."""
+    _principal_cache.pop(user_id, None)
+    if token_version is not None:
+        _token_versions[user_id] = token_version
+
+async def load_principal(user_id: int) -> tuple:
+    cached = _principal_cache.get(user_id)
+    now = _time.monotonic()
+    if cached and cached[0] > now:
+        return cached[1], cached[2]
+
+    # Only a cache miss checks out a connection
+    async with _database.session_scope() as db:
+        user = await db.get(_models.User, user_id)
+        if user is None:
+            raise ValueError("User not found")
+        principal = (user.token_version or 0, admin_details(user))
+    _principal_cache[user_id] = (now + AUTH_CACHE_TTL, *principal)
+    _token_versions[user_id] = max(_token_versions.get(user_id, 0), principal[0])
+    return principal
+
 async def get_current_user(
-    db: _orm.Session = fastapi.Depends(get_db),
     token: str = fastapi.Depends(oauth2schema),
 ):
     try:
         payload = _jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user = db.query(_models.User).get(payload["id"])
-        
-        userReturn = _schemas.AdminDetails(
-            id_user=user.id_user,
-            username = user.username,
-            email = user.email,
-            description=user.description,
-            photo_path = user.photo_path,
-            instagram_url = user.instagram_url,
-            facebook_url = user.facebook_url,
-            linkedin_url = user.linkedin_url
-        )
-        print("do user ", userReturn.id_user)
+        user_id = payload["id"]
+        version = payload.get("ver", 0)
+        if version < _token_versions.get(user_id, 0):
+            raise ValueError("Token revoked")
+
+        # Signed claims are trusted as is, profile changes show up with the next token
+        if AUTH_TRUST_CLAIMS and "profile" in payload:
+            return _schemas.AdminDetails(id_user=user_id, **payload["profile"])
+
+        current_version, userReturn = await load_principal(user_id)
+        if version != current_version:
+            raise ValueError("Token revoked")
         return userReturn
     except Exception as e:
         raise fastapi.HTTPException(
             status_code=401, detail=f"Error: {e}"
-        )
\ No newline at end of file
+        )
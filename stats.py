@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime, timezone
+
+from decouple import config
+from sqlalchemy import extract, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+from models import Category, CategoriesAndPhotos, Gallery, GalleryAndPhotos, Photo, PhotoBlob, PhotoVariant, Service
+from periodic import PeriodicRefresh
+from versions import read_versions
+
+# Seconds between checks of the table versions, counters are only
+# recomputed when one of them moved
+STATS_REFRESH_SECONDS = config("STATS_REFRESH_SECONDS", default=30, cast=int)
+
+STATS_TABLES = (
+    "photos", "categories", "gallery", "services",
+    "categories_and_photos", "gallery_and_photos", "photo_blobs", "photo_variants",
+)
+
+def count_of(model):
+    return select(func.count()).select_from(model).scalar_subquery()
+
+async def compute_stats(db: AsyncSession) -> dict:
+    stored_variants = select(PhotoVariant.variant_path, PhotoVariant.byte_size).distinct().subquery("stored_variants")
+    totals = (await db.execute(select(
+        count_of(Photo).label("photos"),
+        count_of(Category).label("categories"),
+        count_of(Gallery).label("galleries"),
+        count_of(Service).label("services"),
+        select(func.coalesce(func.sum(PhotoBlob.byte_size), 0)).where(PhotoBlob.ref_count > 0).scalar_subquery().label("original_bytes"),
+        # Photos of the same content share their variant files, each counts once
+        select(func.coalesce(func.sum(stored_variants.c.byte_size), 0)).scalar_subquery().label("variant_bytes"),
+    ))).one()
+
+    per_category = (await db.execute(
+        select(Category.id_category, Category.category_name, func.count(CategoriesAndPhotos.id_photo))
+        .outerjoin(CategoriesAndPhotos, CategoriesAndPhotos.id_category == Category.id_category)
+        .group_by(Category.id_category, Category.category_name)
+        .order_by(Category.id_category)
+    )).all()
+
+    per_gallery = (await db.execute(
+        select(Gallery.id_gallery, Gallery.gallery_name, func.count(GalleryAndPhotos.id_photo))
+        .outerjoin(GalleryAndPhotos, GalleryAndPhotos.id_gallery == Gallery.id_gallery)
+        .group_by(Gallery.id_gallery, Gallery.gallery_name)
+        .order_by(Gallery.id_gallery)
+    )).all()
+
+    year, month = extract("year", Photo.date), extract("month", Photo.date)
+    per_month = (await db.execute(
+        select(year, month, func.count())
+        .where(Photo.date.is_not(None))
+        .group_by(year, month)
+        .order_by(year, month)
+    )).all()
+
+    return {
+        "totals": {
+            "photos": totals.photos,
+            "categories": totals.categories,
+            "galleries": totals.galleries,
+            "services": totals.services,
+        },
+        "storage_bytes": {
+            "originals": int(totals.original_bytes),
+            "variants": int(totals.variant_bytes),
+            "total": int(totals.original_bytes) + int(totals.variant_bytes),
+        },
+        "photos_per_category": [
+            {"id_category": id_category, "category_name": name, "photos": count}
+            for id_category, name, count in per_category
+        ],
+        "photos_per_gallery": [
+            {"id_gallery": id_gallery, "gallery_name": name, "photos": count}
+            for id_gallery, name, count in per_gallery
+        ],
+        "photos_per_month": [
+            {"month": f"{int(y):04d}-{int(m):02d}", "photos": count}
+            for y, m, count in per_month
+        ],
+    }
+
+class DashboardStats(PeriodicRefresh):
+    """Dashboard counters held in memory and refreshed in the background.
+
+    Requests only read the snapshot. The refresher compares the table
+    versions every interval and reruns the aggregates when they changed.
+    """
+
+    def __init__(self, interval: int):
+        super().__init__(interval)
+        self.snapshot = None
+        self.refreshed_at = None
+        self._versions = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, force: bool = False):
+        async with self._lock:
+            async with database.session_scope() as db:
+                versions = sorted(await read_versions(db, STATS_TABLES), key=lambda row: row[0])
+                versions = [(table_name, version) for table_name, version, _ in versions]
+                if force or versions != self._versions or self.snapshot is None:
+                    self.snapshot = await compute_stats(db)
+                    self._versions = versions
+                    self.refreshed_at = datetime.now(timezone.utc)
+
+    async def get(self) -> dict:
+        if self.snapshot is None:
+            await self.refresh()
+        return {**self.snapshot, "refreshed_at": self.refreshed_at}
+
+dashboard_stats = DashboardStats(STATS_REFRESH_SECONDS)
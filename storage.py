@@ -0,0 +1,317 @@
+import hashlib
+import io
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from email.utils import formatdate
+from mimetypes import guess_type
+from urllib.parse import quote
+from pathlib import Path
+from typing import Optional
+
+from decouple import config
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+from models import PhotoBlob
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, PlainTextResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+UPLOAD_DIR = Path("./uploads")
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+UPLOAD_MAX_BYTES = config("UPLOAD_MAX_BYTES", default=64 * 1024 * 1024, cast=int)
+UPLOAD_MAX_PIXELS = config("UPLOAD_MAX_PIXELS", default=60_000_000, cast=int)
+UPLOAD_CHUNK_SIZE = config("UPLOAD_CHUNK_SIZE", default=1024 * 1024, cast=int)
+# Whole request body, leaves room for the multipart envelope and form fields
+UPLOAD_MAX_REQUEST_BYTES = config("UPLOAD_MAX_REQUEST_BYTES", default=UPLOAD_MAX_BYTES + 1024 * 1024, cast=int)
+BULK_MAX_REQUEST_BYTES = config("BULK_MAX_REQUEST_BYTES", default=2 * 1024 * 1024 * 1024, cast=int)
+
+# How files under /uploads reach the client: "app" sends them from the worker,
+# "x-accel" hands them to nginx with X-Accel-Redirect and "x-sendfile" to
+# Apache or lighttpd with X-Sendfile, the app then only resolves the path
+UPLOADS_OFFLOAD = config("UPLOADS_OFFLOAD", default="app")
+# nginx location marked internal and aliased to the uploads directory
+UPLOADS_ACCEL_PREFIX = config("UPLOADS_ACCEL_PREFIX", default="/protected-uploads/")
+
+# Pillow refuses to decode anything much larger than this (decompression bombs)
+Image.MAX_IMAGE_PIXELS = UPLOAD_MAX_PIXELS
+
+# Leading bytes of the image formats we accept and the extension we store them with
+MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+@dataclass
+class StoredUpload:
+    path: Optional[Path]
+    extension: str
+    byte_size: int
+    sha256: str
+
+def detect_extension(head: bytes) -> Optional[str]:
+    for magic, extension in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return extension
+    return None
+
+def check_pixels(source) -> bool:
+    """Raise when the image header announces too many pixels.
+
+    Returns False when the header could not be parsed from source, so the
+    caller can retry once more bytes are available.
+    """
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Image dimensions too large")
+    except Exception:
+        return False
+    if width * height > UPLOAD_MAX_PIXELS:
+        raise HTTPException(status_code=413, detail="Image dimensions too large")
+    return True
+
+def blob_path_for(sha256: str, extension: str) -> Path:
+    # Two levels of sharding keep directories small: ab/cd/abcd....jpg
+    return UPLOAD_DIR / sha256[:2] / sha256[2:4] / f"{sha256}.{extension}"
+
+def variant_dir_for(sha256: str) -> Path:
+    return UPLOAD_DIR / "variants" / sha256[:2] / sha256[2:4] / sha256
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as buffer:
+        for chunk in iter(lambda: buffer.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def scan_upload(file: UploadFile) -> StoredUpload:
+    """Validate and hash an upload without writing anything.
+
+    The first chunk is checked for magic bytes and, when its header can be
+    parsed, for the pixel count. Reading stops as soon as the size limit is
+    exceeded. The file is rewound afterwards so it can be copied.
+    """
+    first = await file.read(UPLOAD_CHUNK_SIZE)
+    extension = detect_extension(first)
+    if extension is None:
+        raise HTTPException(status_code=400, detail="Error: Images Only!")
+    header_checked = await run_in_threadpool(check_pixels, io.BytesIO(first))
+
+    digest = hashlib.sha256()
+    size = 0
+    chunk = first
+    while chunk:
+        size += len(chunk)
+        if size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="File too large")
+        await run_in_threadpool(digest.update, chunk)
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+
+    if not header_checked:
+        await file.seek(0)
+        if not await run_in_threadpool(check_pixels, file.file):
+            raise HTTPException(status_code=400, detail="Error: Images Only!")
+    await file.seek(0)
+    return StoredUpload(path=None, extension=extension, byte_size=size, sha256=digest.hexdigest())
+
+async def write_upload(file: UploadFile, path: Path):
+    """Copy an upload to path in chunks, the file only appears once complete."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f".{uuid.uuid4().hex}.part"
+    buffer = await run_in_threadpool(tmp_path.open, "wb")
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await run_in_threadpool(buffer.write, chunk)
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(os.replace, tmp_path, path)
+    except BaseException:
+        buffer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+async def save_upload(file: UploadFile, directory: Path, stem: str) -> StoredUpload:
+    """Validate an uploaded image and stream it to directory/stem.<ext>."""
+    stored = await scan_upload(file)
+    stored.path = directory / f"{stem}.{stored.extension}"
+    await write_upload(file, stored.path)
+    return stored
+
+async def store_content(file: UploadFile) -> StoredUpload:
+    """Validate an upload and write it into the content-addressed tree.
+
+    Bytes that are already on disk are not written again.
+    """
+    stored = await scan_upload(file)
+    stored.path = blob_path_for(stored.sha256, stored.extension)
+    if not await run_in_threadpool(stored.path.exists):
+        await write_upload(file, stored.path)
+    return stored
+
+async def save_blob(file: UploadFile, db: AsyncSession) -> tuple:
+    """Store an uploaded image under its content hash.
+
+    Returns the PhotoBlob, with its reference taken, and whether its bytes
+    were new. Known content only bumps the reference count.
+    """
+    stored = await store_content(file)
+    created = await db.scalar(select(PhotoBlob.sha256).where(PhotoBlob.sha256 == stored.sha256)) is None
+    blob = await db.scalar(
+        add_blobs().values(
+            sha256 = stored.sha256,
+            blob_path = f"/{stored.path.as_posix()}",
+            byte_size = stored.byte_size,
+            ref_count = 1
+        ).returning(PhotoBlob),
+        execution_options={"populate_existing": True},
+    )
+    return blob, created
+
+def add_blobs():
+    """INSERT of blob rows that adds their ref_count to content already stored.
+
+    Concurrent uploads of the same new content would otherwise both insert
+    it and the second one fail on the primary key.
+    """
+    dialect = {"postgresql": postgresql, "sqlite": sqlite}.get(database.engine.dialect.name)
+    if dialect is None:
+        # No upsert on this database, concurrent first uploads of the same content can conflict
+        return insert(PhotoBlob)
+    statement = dialect.insert(PhotoBlob)
+    return statement.on_conflict_do_update(
+        index_elements=[PhotoBlob.sha256],
+        set_={"ref_count": PhotoBlob.ref_count + statement.excluded.ref_count},
+    )
+
+async def release_blobs(db: AsyncSession, references: dict) -> list:
+    """Drop references to blobs, references maps sha256 to how many.
+
+    Returns the hashes left without any. Their files stay until the caller
+    schedules their removal with cleanup.schedule_removal.
+    """
+    if not references:
+        return []
+    blobs = PhotoBlob.__table__
+    await db.execute(
+        update(blobs).where(blobs.c.sha256 == bindparam("b_sha256")).values(ref_count=blobs.c.ref_count - bindparam("b_count")),
+        [{"b_sha256": sha256, "b_count": count} for sha256, count in references.items()],
+    )
+    return (await db.scalars(
+        select(PhotoBlob.sha256).where(PhotoBlob.sha256.in_(list(references)), PhotoBlob.ref_count <= 0)
+    )).all()
+
+async def release_blob(db: AsyncSession, sha256: str) -> bool:
+    """Drop a reference to a blob, True when it was the last one."""
+    return bool(await release_blobs(db, {sha256: 1}))
+
+class UploadSizeLimitMiddleware:
+    """Reject request bodies above max_bytes before they are read.
+
+    Requests announcing a larger Content-Length get a 413 straight away,
+    bodies without one are counted as they stream in. path_limits overrides
+    the cap for specific paths such as bulk uploads.
+    """
+
+    def __init__(self, app, max_bytes: int, path_limits: dict = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            response = PlainTextResponse("Request body too large", status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        return await self.app(scope, limited_receive, send)
+
+# File names holding a digest mark content-addressed files, whose bytes
+# never change: blobs and rendered images are named after a sha256,
+# variants carry a short digest of their encoded output
+DIGEST_NAME_PART = re.compile(r"[0-9a-f]{12}|[0-9a-f]{64}")
+
+OFFLOAD_HEADERS = {"x-accel": "X-Accel-Redirect", "x-sendfile": "X-Sendfile"}
+
+def is_content_addressed(relative_path: str) -> bool:
+    # Only the name counts, variants named by width alone sit in a
+    # directory named after the blob but were rewritten in place
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(DIGEST_NAME_PART.fullmatch(part) for part in name.split(".")[:-1])
+
+def upload_headers(relative_path: str, stat_result: os.stat_result) -> dict:
+    """Caching headers and a strong ETag for a file under uploads."""
+    if is_content_addressed(relative_path):
+        # The name identifies the bytes, mtime is not used as rendered
+        # images get touched on every cache hit
+        tag = hashlib.sha1(relative_path.encode()).hexdigest()[:20]
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        # Files overwritten in place, such as profile photos, are revalidated
+        tag = f"{stat_result.st_mtime_ns:x}"
+        cache_control = "public, no-cache"
+    return {
+        "ETag": f'"{tag}-{stat_result.st_size:x}"',
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+
+class UploadFiles(StaticFiles):
+    """StaticFiles for the uploads directory.
+
+    Content-addressed files are cached for a year, every file gets a strong
+    ETag. FileResponse answers Range and If-Range requests and uses the
+    server's zero-copy pathsend extension when it offers one. With offload
+    set, the response only carries the headers and the front proxy sends
+    the file.
+    """
+
+    def __init__(self, directory, offload: str = "app", accel_prefix: str = "/protected-uploads/"):
+        super().__init__(directory=directory)
+        if offload != "app" and offload not in OFFLOAD_HEADERS:
+            raise ValueError(f"Unknown uploads offload mode: {offload}")
+        self.offload = offload
+        self.accel_prefix = accel_prefix.rstrip("/") + "/"
+        self.root = os.path.realpath(directory)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200):
+        relative_path = Path(os.path.relpath(full_path, self.root)).as_posix()
+        headers = upload_headers(relative_path, stat_result)
+        if self.offload == "app":
+            response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        else:
+            target = self.accel_prefix + quote(relative_path) if self.offload == "x-accel" else str(full_path)
+            response = Response(
+                status_code=status_code,
+                headers={**headers, OFFLOAD_HEADERS[self.offload]: target},
+                media_type=guess_type(str(full_path))[0] or "application/octet-stream",
+            )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
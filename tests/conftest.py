@@ -0,0 +1,77 @@
+import asyncio
+import io
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+WORK_DIR = Path(tempfile.mkdtemp(prefix="photos-tests-"))
+
+# Settings are read when the modules are imported, uploads go to ./uploads
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{WORK_DIR / 'test.db'}")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.chdir(WORK_DIR)
+sys.path.insert(0, str(ROOT))
+
+import database  # noqa: E402
+import search  # noqa: E402  installs the FTS5 table and triggers with the tables
+import services  # noqa: E402
+from featured import featured_snapshot  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from jobs import JobWorker  # noqa: E402
+from main import app  # noqa: E402
+from models import Base  # noqa: E402
+from PIL import Image  # noqa: E402
+from responsecache import MemoryBackend, RESPONSE_CACHE_MAX_ENTRIES, response_cache  # noqa: E402
+from stats import dashboard_stats  # noqa: E402
+
+Base.metadata.create_all(database.engine)
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Every test starts from empty tables, caches and uploads."""
+    with database.engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    # Table versions start over, cached bodies keyed on them would match again
+    response_cache.backend = MemoryBackend(RESPONSE_CACHE_MAX_ENTRIES)
+    services._principal_cache.clear()
+    services._token_versions.clear()
+    featured_snapshot.documents = featured_snapshot._versions = None
+    dashboard_stats.snapshot = dashboard_stats._versions = None
+    for path in sorted(Path("uploads").rglob("*"), reverse=True):
+        path.rmdir() if path.is_dir() else path.unlink()
+    yield
+
+@pytest.fixture
+def client():
+    # Not entered as a context manager, the background loops stay off and
+    # tests run queued jobs with run_jobs()
+    return TestClient(app)
+
+@pytest.fixture
+def auth(client):
+    client.post("/admin/register", json={"username": "admin", "email": "admin@example.com", "password": "secret"})
+    token = client.post("/admin/login", data={"username": "admin@example.com", "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def image_bytes(color=(200, 30, 40), size=(640, 480)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def upload(client, auth, color=(200, 30, 40), categories="", galleries="", **details) -> dict:
+    response = client.post(
+        "/admin/photos/upload",
+        headers=auth,
+        files={"file": ("photo.jpg", image_bytes(color), "image/jpeg")},
+        params={"list_id_category": categories, "list_id_gallery": galleries, **details},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def run_jobs(slots: int = 2):
+    asyncio.run(JobWorker(slots, name="tests").run_until_idle())
@@ -0,0 +1,50 @@
+from routers import adminPhotos
+
+from conftest import run_jobs, upload
+
+def titles(client, auth) -> dict:
+    items = client.get("/admin/photos/all", headers=auth).json()["items"]
+    return {item["id_photo"]: item["title"] for item in items}
+
+def test_selections_above_the_limit_change_nothing(client, auth, monkeypatch):
+    monkeypatch.setattr(adminPhotos, "BULK_EDIT_MAX_PHOTOS", 2)
+    ids = [upload(client, auth, (index * 60, 0, 0), title="before", date=f"2024-01-0{index + 1}")["id_photo"] for index in range(3)]
+
+    for selection in ({"photo_ids": ids}, {"filter": {"date_from": "2024-01-01"}}):
+        response = client.patch("/admin/photos/bulk", headers=auth, json={**selection, "changes": {"title": "after"}})
+        assert (response.status_code, response.json()["detail"]) == (413, "More than 2 photos selected")
+        assert client.request("DELETE", "/admin/photos/bulk", headers=auth, json=selection).status_code == 413
+    assert set(titles(client, auth).values()) == {"before"}
+
+    response = client.patch("/admin/photos/bulk", headers=auth, json={"photo_ids": [ids[0], 999, ids[2]], "changes": {"title": "after"}})
+    assert response.status_code == 200
+    assert {key: response.json()[key] for key in ("matched", "updated", "missing")} == {"matched": 2, "updated": 2, "missing": [999]}
+    assert titles(client, auth) == {ids[0]: "after", ids[1]: "before", ids[2]: "after"}
+
+def test_selections_must_be_explicit(client, auth):
+    for body in (
+        {"changes": {"title": "x"}},
+        {"photo_ids": [1], "filter": {"category": 1}, "changes": {"title": "x"}},
+        {"filter": {}, "changes": {"title": "x"}},
+        {"photo_ids": [1], "changes": {}},
+    ):
+        assert client.patch("/admin/photos/bulk", headers=auth, json=body).status_code == 422, body
+
+def test_bulk_delete_releases_blobs(client, auth):
+    kept = upload(client, auth, (0, 0, 255), date="2023-06-01")["id_photo"]
+    gone = [upload(client, auth, date="2024-02-01")["id_photo"] for _ in range(2)]
+    response = client.request("DELETE", "/admin/photos/bulk", headers=auth, json={"filter": {"date_from": "2024-01-01"}})
+    assert {key: response.json()[key] for key in ("matched", "deleted", "blobs_released")} == {"matched": 2, "deleted": 2, "blobs_released": 1}
+    run_jobs()
+    assert list(titles(client, auth)) == [kept]
+    for id_photo in gone:
+        assert client.get(f"/photos/{id_photo}").status_code == 404
+
+def test_bulk_edit_passes_the_cors_preflight(client):
+    response = client.options("/admin/photos/bulk", headers={
+        "Origin": "http://localhost:3000",
+        "Access-Control-Request-Method": "PATCH",
+        "Access-Control-Request-Headers": "authorization, content-type",
+    })
+    assert response.status_code == 200
+    assert "PATCH" in response.headers["access-control-allow-methods"]
@@ -0,0 +1,51 @@
+import asyncio
+import json
+from pathlib import Path
+
+import cleanup
+import database
+import jobs
+from conftest import image_bytes, run_jobs, upload
+from models import Job, Photo, PhotoVariant
+from sqlalchemy import select
+
+def add_legacy_photo() -> int:
+    # Uploaded before the content-addressed tree, the file sits where it was written
+    Path("uploads/legacy.jpg").write_bytes(image_bytes((30, 160, 30)))
+    with database.engine.begin() as connection:
+        return connection.execute(Photo.__table__.insert().values(photo_path="/uploads/legacy.jpg")).inserted_primary_key[0]
+
+def test_processing_skips_photos_outside_the_content_addressed_tree(client, auth):
+    legacy = add_legacy_photo()
+    photo = upload(client, auth)["id_photo"]
+
+    async def scenario():
+        async with database.session_scope() as db:
+            job = await jobs.enqueue(db, "photos.process", {"photo_ids": [legacy, photo]})
+            await db.commit()
+        return job.id_job
+    id_job = asyncio.run(scenario())
+    run_jobs()
+
+    with database.engine.connect() as connection:
+        status, result = connection.execute(select(Job.status, Job.result).where(Job.id_job == id_job)).one()
+        owners = set(connection.scalars(select(PhotoVariant.id_photo)))
+    assert (status, json.loads(result)["skipped"]) == ("done", 1)
+    assert owners == {photo}
+
+def test_missing_variants_of_legacy_photos_are_not_queued():
+    legacy = add_legacy_photo()
+    with database.engine.begin() as connection:
+        id_variant = connection.execute(PhotoVariant.__table__.insert().values(
+            id_photo=legacy, variant_path="/uploads/variants/legacy/320.jpg", width=320, height=240, format="jpeg", byte_size=1,
+        )).inserted_primary_key[0]
+
+    async def scenario():
+        async with database.session_scope() as db:
+            await cleanup.rerender_variants(db, [id_variant])
+            await db.commit()
+    asyncio.run(scenario())
+
+    with database.engine.connect() as connection:
+        assert connection.execute(select(Job.id_job)).all() == []
+        assert connection.scalar(select(PhotoVariant.id_photo)) == legacy
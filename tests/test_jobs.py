@@ -0,0 +1,131 @@
+import asyncio
+from datetime import timedelta
+
+import database
+import jobs
+from jobs import JobWorker
+from models import Category, Job
+from sqlalchemy import select, update
+
+attempts = []
+
+@jobs.handler("tests.flaky")
+async def flaky(db, payload, progress):
+    attempts.append(payload["name"])
+    if len(attempts) == 1:
+        raise ValueError("first attempt fails")
+    db.add(Category(category_name=payload["name"]))
+    return {"attempt": len(attempts)}
+
+@jobs.handler("tests.slow")
+async def slow(db, payload, progress):
+    # Reports nothing while it runs longer than the lease
+    await asyncio.sleep(payload["seconds"])
+    db.add(Category(category_name=payload["name"]))
+    return {"taken over": await JobWorker(1, name="other").claim() is not None}
+
+async def enqueue(kind, payload) -> int:
+    async with database.session_scope() as db:
+        job = await jobs.enqueue(db, kind, payload)
+        await db.commit()
+        return job.id_job
+
+async def job(id_job) -> Job:
+    async with database.session_scope() as db:
+        return await db.scalar(select(Job).where(Job.id_job == id_job))
+
+async def categories() -> list:
+    async with database.session_scope() as db:
+        return list(await db.scalars(select(Category.category_name)))
+
+def test_failed_attempts_are_retried_after_a_backoff():
+    attempts.clear()
+
+    async def scenario():
+        id_job = await enqueue("tests.flaky", {"name": "retried"})
+        worker = JobWorker(1, name="tests")
+        await worker.run_until_idle()
+        first = await job(id_job)
+        assert (first.status, first.attempts, first.locked_by) == ("queued", 1, None)
+        assert first.message == "ValueError: first attempt fails"
+        # Not due before its backoff
+        assert await worker.claim() is None
+
+        async with database.session_scope() as db:
+            await db.execute(update(Job).values(run_after=jobs.utcnow() - timedelta(seconds=1)))
+            await db.commit()
+        await worker.run_until_idle()
+        second = await job(id_job)
+        assert (second.status, second.attempts, second.progress) == ("done", 2, 100)
+        assert await categories() == ["retried"]
+
+    asyncio.run(scenario())
+    assert jobs.backoff(1) == timedelta(seconds=jobs.JOB_BACKOFF_SECONDS)
+    assert jobs.backoff(2) == timedelta(seconds=2 * jobs.JOB_BACKOFF_SECONDS)
+    assert jobs.backoff(100) == timedelta(seconds=jobs.JOB_MAX_BACKOFF_SECONDS)
+
+def test_a_job_is_claimed_once():
+    async def scenario():
+        id_job = await enqueue("tests.flaky", {"name": "once"})
+        first, second = JobWorker(1, name="tests"), JobWorker(1, name="tests")
+        claimed = await first.claim()
+        assert claimed[0] == id_job
+        assert await second.claim() is None
+        assert (await job(id_job)).locked_by == claimed[1]
+
+    asyncio.run(scenario())
+
+def test_a_taken_over_claim_does_not_complete():
+    async def scenario():
+        id_job = await enqueue("tests.slow", {"name": "stale", "seconds": 0})
+        # Same name, as the slots of one worker have
+        stale, fresh = JobWorker(1, name="tests"), JobWorker(1, name="tests")
+        _, stale_token = await stale.claim()
+        async with database.session_scope() as db:
+            await db.execute(update(Job).values(locked_at=jobs.utcnow() - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)))
+            await db.commit()
+        _, fresh_token = await fresh.claim()
+
+        await stale.run(id_job, stale_token)
+        taken = await job(id_job)
+        assert (taken.status, taken.locked_by, taken.attempts) == ("running", fresh_token, 2)
+        assert await categories() == []
+
+        await fresh.run(id_job, fresh_token)
+        assert (await job(id_job)).status == "done"
+        assert await categories() == ["stale"]
+
+    asyncio.run(scenario())
+
+def test_the_lease_is_renewed_while_the_handler_runs(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+
+    async def scenario():
+        id_job = await enqueue("tests.slow", {"name": "slow", "seconds": 0.8})
+        await JobWorker(1, name="tests").run_until_idle()
+        done = await job(id_job)
+        assert done.status == "done"
+        assert '"taken over": false' in done.result
+
+    asyncio.run(scenario())
+
+def test_a_slot_outlives_a_failing_run(monkeypatch):
+    complete, failing = JobWorker.complete, set()
+
+    async def broken(self, id_job, token):
+        if id_job in failing:
+            raise RuntimeError("database went away")
+        await complete(self, id_job, token)
+
+    monkeypatch.setattr(JobWorker, "complete", broken)
+
+    async def scenario():
+        lost = await enqueue("tests.slow", {"name": "lost", "seconds": 0})
+        kept = await enqueue("tests.slow", {"name": "kept", "seconds": 0})
+        failing.add(lost)
+        await JobWorker(1, name="tests").run_until_idle()
+        # Left running until its lease runs out
+        assert (await job(lost)).status == "running"
+        assert (await job(kept)).status == "done"
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+from pathlib import Path
+
+import database
+from conftest import image_bytes, upload
+from models import CategoriesAndPhotos, PhotoBlob
+from sqlalchemy import select
+
+def add_category(client, auth, name="Streets") -> int:
+    return client.post("/admin/category/add", headers=auth, json={"category_name": name}).json()["id_category"]
+
+def add_gallery(client, auth, name="Lisbon") -> int:
+    return client.post("/admin/gallery/add", headers=auth, json={"gallery_name": name}).json()["id_gallery"]
+
+def test_unknown_ids_are_reported_not_linked(client, auth):
+    photo = upload(client, auth)["id_photo"]
+    category, gallery = add_category(client, auth), add_gallery(client, auth)
+
+    requests = [
+        (f"/admin/photos/update-category/{photo + 1}", {"list_id_category": [category]}, f"Photos not found: [{photo + 1}]"),
+        (f"/admin/photos/update-category/{photo}", {"list_id_category": [category, 99]}, "Categories not found: [99]"),
+        (f"/admin/photos/update-gallery/{photo + 1}", {"list_id_gallery": [gallery]}, f"Photos not found: [{photo + 1}]"),
+        (f"/admin/photos/update-gallery/{photo}", {"list_id_gallery": [98, gallery]}, "Galleries not found: [98]"),
+        ("/admin/photos/update-category", {"photo_ids": [photo, 97, 96], "list_id_category": [category]}, "Photos not found: [97, 96]"),
+        ("/admin/photos/update-gallery", {"photo_ids": [photo], "list_id_gallery": [95]}, "Galleries not found: [95]"),
+    ]
+    for url, body, detail in requests:
+        response = client.put(url, headers=auth, json=body)
+        assert (response.status_code, response.json()["detail"]) == (404, detail), url
+
+    response = client.put("/admin/photos/update-category", headers=auth, json={"photo_ids": [photo], "list_id_category": [category]})
+    assert response.json()["added"] == 1
+    response = client.put(f"/admin/photos/update-gallery/{photo}", headers=auth, json={"list_id_gallery": [gallery]})
+    assert response.status_code == 200
+    linked = client.get(f"/admin/photos/{photo}", headers=auth).json()
+    assert [link["category"]["id_category"] for link in linked["categories"]] == [category]
+
+def positions(category) -> dict:
+    with database.engine.connect() as connection:
+        return dict(connection.execute(
+            select(CategoriesAndPhotos.id_photo, CategoriesAndPhotos.position).where(CategoriesAndPhotos.id_category == category)
+        ).all())
+
+def test_moves_take_the_gap_between_neighbours(client, auth):
+    category = add_category(client, auth)
+    a, b, c, d = (upload(client, auth, (index * 60, 0, 0), categories=str(category))["id_photo"] for index in range(4))
+    assert positions(category) == {a: 1024, b: 2048, c: 3072, d: 4096}
+
+    def move(photo, **anchor) -> list:
+        response = client.put(f"/admin/category/{category}/order/{photo}", headers=auth, json=anchor)
+        assert response.status_code == 200, response.text
+        return response.json()["photo_ids"]
+
+    # Only the moved row is written
+    assert move(d, before=b) == [a, d, b, c]
+    assert positions(category) == {a: 1024, b: 2048, c: 3072, d: 1536}
+    assert move(a, after=c) == [d, b, c, a]
+    assert positions(category)[a] == 4096
+
+    # Halving the same gap until the neighbours are adjacent renumbers the list
+    order = [d, b, c, a]
+    for _ in range(12):
+        photo = order[2]
+        order = move(photo, before=order[1])
+        assert order[1] == photo
+    assert positions(category)[d] == 1024
+    assert order == sorted(positions(category), key=positions(category).get)
+    assert len(set(positions(category).values())) == 4
+
+    assert client.put(f"/admin/category/{category}/order/{a}", headers=auth, json={"before": a}).status_code == 400
+    assert client.put(f"/admin/category/{category}/order/{a}", headers=auth, json={"before": 999}).status_code == 404
+
+def test_set_order_puts_listed_photos_first(client, auth):
+    category = add_category(client, auth)
+    a, b, c = (upload(client, auth, (index * 60, 0, 0), categories=str(category))["id_photo"] for index in range(3))
+    response = client.put(f"/admin/category/{category}/order", headers=auth, json={"photo_ids": [c, a]})
+    assert response.json()["photo_ids"] == [c, a, b]
+    assert positions(category) == {c: 1024, a: 2048, b: 3072}
+    response = client.put(f"/admin/category/{category}/order", headers=auth, json={"photo_ids": [b, 999]})
+    assert (response.status_code, response.json()["detail"]) == (404, "Photos not in the category: [999]")
+
+def test_uploads_with_unknown_links_store_nothing(client, auth):
+    category = add_category(client, auth)
+    for params, detail in (
+        ({"list_id_category": f"{category},999", "list_id_gallery": ""}, "Categories not found: [999]"),
+        ({"list_id_category": "", "list_id_gallery": "998"}, "Galleries not found: [998]"),
+    ):
+        response = client.post("/admin/photos/upload", headers=auth, params=params,
+                               files={"file": ("photo.jpg", image_bytes(), "image/jpeg")})
+        assert (response.status_code, response.json()["detail"]) == (400, detail)
+    assert client.get("/admin/photos/count", headers=auth).json() == 0
+    with database.engine.connect() as connection:
+        assert connection.execute(select(PhotoBlob)).all() == []
+
+def test_bulk_uploads_with_unknown_links_store_nothing(client, auth):
+    gallery = add_gallery(client, auth)
+    files = [("files", (f"{name}.jpg", image_bytes(color), "image/jpeg")) for name, color in (("a", (0, 0, 255)), ("b", (0, 255, 0)))]
+    for params, metadata, detail in (
+        ({"list_id_category": "997", "list_id_gallery": ""}, None, "Categories not found: [997]"),
+        ({"list_id_category": "", "list_id_gallery": str(gallery)}, '{"b.jpg": {"list_id_gallery": [996]}}', "Galleries not found: [996]"),
+    ):
+        response = client.post("/admin/photos/bulk", headers=auth, params=params, files=files,
+                               data={"metadata": metadata} if metadata else None)
+        assert (response.status_code, response.json()["detail"]) == (400, detail)
+    assert client.get("/admin/photos/count", headers=auth).json() == 0
+    assert not list(Path("uploads").rglob("*.jpg"))
+
+def test_repeated_ids_link_once(client, auth):
+    category, gallery = add_category(client, auth), add_gallery(client, auth)
+    photo = upload(client, auth, categories=f"{category},{category}")["id_photo"]
+    assert positions(category) == {photo: 1024}
+    response = client.put("/admin/photos/update-gallery", headers=auth, json={"photo_ids": [photo, photo], "list_id_gallery": [gallery, gallery]})
+    assert (response.status_code, response.json()["added"]) == (200, 1)
+    response = client.put("/admin/photos/update-category", headers=auth, json={"photo_ids": [photo, photo], "list_id_category": []})
+    assert (response.status_code, response.json()["removed"]) == (200, 1)
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from conftest import ROOT
+
+def alembic(database_path, *args):
+    env = {**os.environ, "SQLALCHEMY_DATABASE_URL": f"sqlite:///{database_path}"}
+    subprocess.run([sys.executable, "-m", "alembic", *args], cwd=ROOT, env=env, check=True, capture_output=True)
+
+def test_upgrade_keeps_links_and_orders_them(tmp_path):
+    path = tmp_path / "legacy.db"
+    alembic(path, "upgrade", "0001_baseline")
+    with sqlite3.connect(path) as connection:
+        connection.executescript("""
+            INSERT INTO categories (id_category, category_name) VALUES (1, 'c');
+            INSERT INTO gallery (id_gallery, gallery_name) VALUES (1, 'g'), (2, 'h');
+            INSERT INTO photos (id_photo, photo_path, date) VALUES
+                (1, '/uploads/a.jpg', '2024-03-01'), (2, '/uploads/b.jpg', NULL),
+                (3, '/uploads/c.jpg', '2023-01-01'), (4, '/uploads/d.jpg', '2023-01-01');
+            INSERT INTO categories_and_photos VALUES (1, 1), (1, 2);
+            INSERT INTO gallery_and_photos VALUES (1, 1), (1, 2), (1, 3), (1, 4), (2, 2);
+            INSERT INTO featured_photos (id_photo, featured_type) VALUES (2, 'home'), (1, 'home');
+        """)
+
+    # Batch operations copy photos, categories and gallery, the cascades
+    # must not empty the tables pointing at them
+    alembic(path, "upgrade", "head")
+
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT count(*) FROM categories_and_photos").fetchone() == (2,)
+        assert connection.execute(
+            "SELECT id_gallery, id_photo, position FROM gallery_and_photos ORDER BY id_gallery, position"
+        ).fetchall() == [(1, 3, 1024), (1, 4, 2048), (1, 1, 3072), (1, 2, 4096), (2, 2, 1024)]
+        # Featured lists keep their date order, dated photos first
+        assert connection.execute(
+            "SELECT id_photo, position FROM featured_photos ORDER BY position"
+        ).fetchall() == [(1, 0), (2, 1)]
+
+    alembic(path, "check")
+    alembic(path, "downgrade", "base")
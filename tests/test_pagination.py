@@ -0,0 +1,28 @@
+from conftest import upload
+
+def pages(client, auth, **params) -> list:
+    pages, cursor = [], None
+    while True:
+        response = client.get("/admin/photos/all", headers=auth, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        pages.append([item["id_photo"] for item in body["items"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+def test_keyset_pages_follow_date_then_id_with_undated_last(client, auth):
+    dates = ["2024-05-01", None, "2023-01-01", "2024-05-01", None, "2022-12-31"]
+    ids = [upload(client, auth, (index * 40, 0, 0), date=value)["id_photo"] for index, value in enumerate(dates)]
+    expected = [ids[5], ids[2], ids[0], ids[3], ids[1], ids[4]]
+
+    assert pages(client, auth, limit=2) == [expected[0:2], expected[2:4], expected[4:6]]
+    # Page boundaries inside a run of equal dates and inside the undated tail
+    assert sum(pages(client, auth, limit=3), []) == expected
+    assert pages(client, auth, limit=5) == [expected[:5], expected[5:]]
+    assert pages(client, auth, limit=2, date_from="2023-01-01") == [[ids[2], ids[0]], [ids[3]]]
+
+def test_invalid_cursors_are_rejected(client, auth):
+    for cursor in ("not base64!", "WzFd", "WyJ4IiwxXQ"):
+        response = client.get("/admin/photos/all", headers=auth, params={"cursor": cursor})
+        assert (response.status_code, response.json()["detail"]) == (400, "Invalid cursor"), cursor
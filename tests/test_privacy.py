@@ -0,0 +1,38 @@
+import io
+
+from conftest import run_jobs
+from PIL import ExifTags, Image
+
+def geotagged_jpeg() -> bytes:
+    exif = Image.Exif()
+    exif[ExifTags.Base.Make] = "Camera"
+    exif[ExifTags.Base.BodySerialNumber] = "SN123456"
+    exif[ExifTags.IFD.GPSInfo] = {
+        ExifTags.GPS.GPSLatitudeRef: "N", ExifTags.GPS.GPSLatitude: (38.0, 43.0, 21.1),
+        ExifTags.GPS.GPSLongitudeRef: "W", ExifTags.GPS.GPSLongitude: (9.0, 8.0, 23.9),
+    }
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (90, 90, 200)).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+def test_public_pages_publish_no_original_and_no_exact_position(client, auth):
+    response = client.post(
+        "/admin/photos/upload", headers=auth, params={"list_id_category": "", "list_id_gallery": ""},
+        files={"file": ("photo.jpg", geotagged_jpeg(), "image/jpeg")},
+    )
+    id_photo = response.json()["id_photo"]
+    run_jobs()
+
+    page = client.get(f"/photos/{id_photo}").json()
+    assert page["location"] == "38.72, -9.14"
+    assert page["photo_path"] == f"/photos/{id_photo}/render"
+    assert "latitude" not in page["exif"]
+    for path in [page["photo_path"]] + [variant["variant_path"] for variant in page["variants"]]:
+        with Image.open(io.BytesIO(client.get(path).content)) as image:
+            assert not image.getexif(), path
+
+    # The admin still sees the stored original
+    original = client.get(f"/admin/photos/{id_photo}", headers=auth).json()["photo_path"]
+    assert original.startswith("/uploads/")
+    with Image.open(io.BytesIO(client.get(original).content)) as image:
+        assert image.getexif()[ExifTags.Base.BodySerialNumber] == "SN123456"
@@ -0,0 +1,25 @@
+from conftest import upload
+
+def found(client, q) -> list:
+    response = client.get("/photos/search", params={"q": q})
+    assert response.status_code == 200, response.text
+    return [item["id_photo"] for item in response.json()["items"]]
+
+def test_triggers_keep_the_index_in_step(client, auth):
+    harbour = upload(client, auth, title="Harbour at dawn", location="Lisboa")["id_photo"]
+    market = upload(client, auth, (10, 120, 60), title="Fish market")["id_photo"]
+    assert found(client, "harb") == [harbour]
+    assert found(client, "lisboa") == [harbour]
+
+    response = client.put(f"/admin/photos/update-details/{market}", headers=auth, json={"title": "Harbour cranes"})
+    assert response.status_code == 200
+    assert sorted(found(client, "harbour")) == sorted([harbour, market])
+    assert found(client, "fish") == []
+
+    assert client.delete(f"/admin/photos/photo/delete/{harbour}", headers=auth).status_code == 200
+    assert found(client, "harbour") == [market]
+
+def test_punctuation_alone_searches_everything(client, auth):
+    photo = upload(client, auth, title="Harbour")["id_photo"]
+    for q in ("-", "!!", '"', "  "):
+        assert found(client, q) == [photo]
@@ -0,0 +1,17 @@
+from pathlib import Path
+
+from conftest import run_jobs, upload
+
+def bytes_under(directory: str) -> int:
+    return sum(path.stat().st_size for path in Path(directory).rglob("*") if path.is_file())
+
+def test_shared_files_are_counted_once(client, auth):
+    # Same content twice, one original and one set of variants on disk
+    upload(client, auth)
+    upload(client, auth)
+    run_jobs()
+    variants = bytes_under("uploads/variants")
+    originals = bytes_under("uploads") - variants
+    assert client.get("/admin/stats", headers=auth).json()["storage_bytes"] == {
+        "originals": originals, "variants": variants, "total": originals + variants,
+    }
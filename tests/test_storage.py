@@ -0,0 +1,78 @@
+import asyncio
+from pathlib import Path
+
+import database
+import imaging
+from conftest import image_bytes, run_jobs, upload
+from models import PhotoBlob
+from sqlalchemy import select
+from storage import is_content_addressed
+
+def blobs() -> dict:
+    async def load():
+        async with database.session_scope() as db:
+            return {blob.sha256: (blob.ref_count, blob.blob_path) for blob in await db.scalars(select(PhotoBlob))}
+    return asyncio.run(load())
+
+def variant_paths(client, id_photo):
+    photo = client.get(f"/photos/{id_photo}").json()
+    return sorted(variant["variant_path"] for variant in photo["variants"])
+
+def test_variants_are_named_after_their_bytes(client, auth):
+    photo = upload(client, auth)
+    run_jobs()
+    paths = variant_paths(client, photo["id_photo"])
+    assert paths
+    for path in paths:
+        assert is_content_addressed(path.removeprefix("/uploads/"))
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+    # Other settings give other files instead of rewriting the served ones
+    source = client.get(f"/admin/photos/{photo['id_photo']}", headers=auth).json()["photo_path"].lstrip("/")
+    dest = str(Path(paths[0].lstrip("/")).parent)
+    rendered = {variant["variant_path"] for variant in imaging.generate_variants(source, dest, quality=40)}
+    assert rendered.isdisjoint(paths)
+    for path in paths:
+        assert Path(path.lstrip("/")).is_file()
+
+def test_files_rewritten_in_place_are_revalidated(client):
+    digest = "ab" * 32
+    assert is_content_addressed(f"ab/ab/{digest}.jpg")
+    assert is_content_addressed(f"cache/ab/{digest}.webp")
+    # Variants from before they carried a digest sit in a directory named after the blob
+    assert not is_content_addressed(f"variants/ab/ab/{digest}/320.jpg")
+    assert not is_content_addressed("admin1.jpg")
+
+    legacy = Path("uploads/variants/ab/ab", digest, "320.jpg")
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b"old")
+    response = client.get(f"/{legacy.as_posix()}")
+    assert response.headers["cache-control"] == "public, no-cache"
+
+def test_blobs_count_their_photos_and_go_with_the_last(client, auth):
+    first = upload(client, auth)["id_photo"]
+    second = upload(client, auth)["id_photo"]
+    files = [("files", (f"{name}.jpg", image_bytes(color), "image/jpeg")) for name, color in
+             (("same", (200, 30, 40)), ("other", (0, 0, 255)), ("other-again", (0, 0, 255)))]
+    response = client.post("/admin/photos/bulk", headers=auth, files=files, params={"list_id_category": "", "list_id_gallery": ""})
+    assert response.json()["summary"]["created"] == 3
+    bulk = [result["id_photo"] for result in response.json()["results"]]
+
+    stored = blobs()
+    assert sorted(count for count, _ in stored.values()) == [2, 3]
+    shared = next(sha256 for sha256, (count, _) in stored.items() if count == 3)
+    path = Path(stored[shared][1].lstrip("/"))
+    assert path.is_file()
+
+    for id_photo in (first, second):
+        assert client.delete(f"/admin/photos/photo/delete/{id_photo}", headers=auth).status_code == 200
+    run_jobs()
+    assert blobs()[shared][0] == 1
+    assert path.is_file()
+
+    assert client.delete(f"/admin/photos/photo/delete/{bulk[0]}", headers=auth).status_code == 200
+    run_jobs()
+    assert shared not in blobs()
+    assert not path.exists()
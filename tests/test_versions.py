@@ -0,0 +1,48 @@
+import asyncio
+
+import database
+from conftest import upload
+from models import Photo
+from sqlalchemy import update
+
+def test_unchanged_tables_answer_304(client, auth):
+    photo = upload(client, auth)["id_photo"]
+    first = client.get("/admin/photos/count", headers=auth)
+    assert first.status_code == 200
+    etag, modified = first.headers["etag"], first.headers["last-modified"]
+
+    for validators in ({"If-None-Match": etag}, {"If-None-Match": f'"other", {etag}'}, {"If-Modified-Since": modified}):
+        repeated = client.get("/admin/photos/count", headers={**auth, **validators})
+        assert (repeated.status_code, repeated.content) == (304, b""), validators
+        assert repeated.headers["etag"] == etag
+
+    # A write to a table the response is built from changes the validator
+    upload(client, auth, (0, 0, 255))
+    changed = client.get("/admin/photos/count", headers={**auth, "If-None-Match": etag})
+    assert (changed.status_code, changed.json()) == (200, 2)
+    assert changed.headers["etag"] != etag
+
+    # Bulk statements count as writes too, not only flushed objects
+    single = client.get(f"/admin/photos/{photo}", headers=auth).headers["etag"]
+    client.patch("/admin/photos/bulk", headers=auth, json={"photo_ids": [photo], "changes": {"title": "Renamed"}})
+    response = client.get(f"/admin/photos/{photo}", headers={**auth, "If-None-Match": single})
+    assert response.status_code == 200
+    assert response.json()["title"] == "Renamed"
+
+def test_writes_not_invalidated_here_still_miss_the_cache(client, auth):
+    photo = upload(client, auth, title="before")["id_photo"]
+    first = client.get("/admin/photos/all", headers=auth)
+    assert first.json()["items"][0]["title"] == "before"
+
+    # As a separate worker process writes: table versions move, this
+    # process's response cache hears nothing
+    async def rename():
+        async with database.session_scope() as db:
+            await db.execute(update(Photo).where(Photo.id_photo == photo).values(title="after"))
+            await db.commit()
+    asyncio.run(rename())
+
+    response = client.get("/admin/photos/all", headers={**auth, "If-None-Match": first.headers["etag"]})
+    assert response.status_code == 200
+    assert response.headers["etag"] != first.headers["etag"]
+    assert response.json()["items"][0]["title"] == "after"
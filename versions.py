@@ -0,0 +1,101 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import get_db
+from models import Job, TableVersion
+
+VERSIONS_TABLE = TableVersion.__tablename__
+# Written too often to be worth a version, and no response is built from them
+UNTRACKED_TABLES = {VERSIONS_TABLE, Job.__tablename__}
+
+def bump_tables(connection, tables):
+    """Bump the version of every table in tables on connection's transaction."""
+    tables = sorted(set(tables) - UNTRACKED_TABLES)
+    if not tables:
+        return
+    now = datetime.now(timezone.utc)
+    bumped = connection.execute(
+        update(TableVersion)
+        .where(TableVersion.table_name.in_(tables))
+        .values(version=TableVersion.version + 1, updated_at=now)
+    ).rowcount
+    if bumped < len(tables):
+        # First write to a table since its row was created
+        existing = set(connection.scalars(select(TableVersion.table_name).where(TableVersion.table_name.in_(tables))))
+        connection.execute(insert(TableVersion), [
+            {"table_name": table, "version": 1, "updated_at": now}
+            for table in tables if table not in existing
+        ])
+
+@event.listens_for(Session, "after_flush")
+def _bump_flushed(session, flush_context):
+    tables = {
+        instance.__table__.name
+        for instance in (*session.new, *session.dirty, *session.deleted)
+        if instance in session.new or instance in session.deleted or session.is_modified(instance)
+    }
+    bump_tables(session.connection(), tables)
+
+@event.listens_for(Session, "do_orm_execute")
+def _bump_executed(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements bypass the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        bump_tables(orm_execute_state.session.connection(), [orm_execute_state.statement.table.name])
+
+async def read_versions(db: AsyncSession, tables) -> list:
+    return (await db.execute(
+        select(TableVersion.table_name, TableVersion.version, TableVersion.updated_at)
+        .where(TableVersion.table_name.in_(tables))
+    )).all()
+
+def validator_headers(tables, rows) -> dict:
+    """ETag and Last-Modified for a response built from tables."""
+    versions = {table_name: version for table_name, version, _ in rows}
+    tag = ",".join(f"{table}:{versions.get(table, 0)}" for table in sorted(tables))
+    headers = {"ETag": f'W/"{hashlib.sha1(tag.encode()).hexdigest()[:20]}"'}
+    modified = [updated_at for _, _, updated_at in rows if updated_at is not None]
+    if modified:
+        # SQLite hands timestamps back without a zone, they are written in UTC
+        last = max(value if value.tzinfo else value.replace(tzinfo=timezone.utc) for value in modified)
+        headers["Last-Modified"] = format_datetime(last.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def not_modified(request: Request, headers: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, If-Modified-Since is ignored when this is present
+        etag = headers["ETag"].removeprefix("W/")
+        candidates = {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+        return "*" in candidates or etag in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or "Last-Modified" not in headers:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+def conditional_on(*tables):
+    """Dependency answering conditional GETs from the versions of tables.
+
+    Costs one query against table_versions, a matching If-None-Match or
+    If-Modified-Since ends the request with 304 before any rows are read.
+    Returns the validator headers for routes that build their own Response.
+    """
+    async def dependency(request: Request, response: Response, db: AsyncSession = Depends(get_db)) -> dict:
+        headers = validator_headers(tables, await read_versions(db, tables))
+        if not_modified(request, headers):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return headers
+    return dependency